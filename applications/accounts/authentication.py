@@ -0,0 +1,161 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from rest_framework.authentication import TokenAuthentication
+from rest_framework import exceptions
+
+
+def token_cache_settings():
+    return getattr(settings, 'TOKEN_AUTH_CACHE', {})
+
+
+class TokenCache:
+    """
+    Per-worker LRU of authenticated (user, token) pairs keyed by token key, with an optional
+    shared Django cache tier behind it.
+    Entries expire after `ttl` seconds, which also bounds how long a change made in another
+    worker process can go unnoticed; changes made in this process invalidate immediately.
+    """
+
+    SHARED_KEY_PREFIX = 'token-auth:'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def max_size(self):
+        return token_cache_settings().get('MAX_SIZE', 10000)
+
+    @property
+    def ttl(self):
+        return token_cache_settings().get('TTL', 60)
+
+    @property
+    def shared_cache(self):
+        alias = token_cache_settings().get('SHARED_CACHE')
+        return caches[alias] if alias else None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        @return: tuple: (user, token) or None when not cached
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, credentials = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return credentials
+                self._pop(key)
+
+        shared = self.shared_cache
+        if shared is not None:
+            credentials = shared.get(self.SHARED_KEY_PREFIX + key)
+            if credentials is not None:
+                self._store(key, credentials)
+                with self._lock:
+                    self.shared_hits += 1
+                return credentials
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, credentials):
+        self._store(key, credentials)
+        shared = self.shared_cache
+        if shared is not None:
+            shared.set(self.SHARED_KEY_PREFIX + key, credentials, token_cache_settings().get('SHARED_TTL', self.ttl))
+
+    def invalidate(self, key):
+        with self._lock:
+            self._pop(key)
+        shared = self.shared_cache
+        if shared is not None:
+            shared.delete(self.SHARED_KEY_PREFIX + key)
+
+    def invalidate_user(self, user_id, keys=()):
+        """
+        Drop every cached token of a user
+        @param: user_id:int, keys:iterable token keys to drop from the shared tier as well
+        """
+        with self._lock:
+            local_keys = set(self._keys_by_user.get(user_id, ()))
+            for key in local_keys:
+                self._pop(key)
+        shared = self.shared_cache
+        if shared is not None:
+            shared.delete_many([self.SHARED_KEY_PREFIX + key for key in local_keys | set(keys)])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+            self.hits = self.shared_hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
+
+    def _store(self, key, credentials):
+        user = credentials[0]
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, credentials)
+            self._keys_by_user.setdefault(user.pk, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._pop(next(iter(self._entries)))
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = entry[1][0].pk
+        keys = self._keys_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user_id]
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that remembers resolved tokens instead of joining Token and User on
+    every request. Deleting a token or saving its user invalidates the cached entry.
+    """
+
+    def authenticate_credentials(self, key):
+        credentials = token_cache.get(key)
+        if credentials is None:
+            credentials = super().authenticate_credentials(key)
+            token_cache.set(key, credentials)
+        user, token = credentials
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        # each request gets its own instances, views are free to modify them
+        return copy.copy(user), copy.copy(token)
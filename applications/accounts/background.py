@@ -0,0 +1,68 @@
+import threading
+
+from django.db import close_old_connections, connection
+
+
+class BackgroundFlusher:
+    """
+    Base of the in-process write buffers.
+    Subclasses keep their pending data under `_lock` and implement `flush`; a daemon thread calls
+    it every `flush_interval` seconds, or right away once a producer reports the buffer full.
+    `stop` flushes whatever is left, register it with atexit.
+    """
+
+    thread_name = 'background-flush'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._worker = None
+
+    @property
+    def flush_interval(self):
+        raise NotImplementedError
+
+    def flush(self):
+        raise NotImplementedError
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        worker = self._worker
+        if worker is not None and worker is not threading.current_thread():
+            worker.join(timeout=self.flush_interval * 2)
+        self.flush()
+
+    def _buffered(self, full):
+        """
+        Called by producers after buffering, starts the worker and wakes it when `full`
+        """
+        self._ensure_worker()
+        if full:
+            self._wake.set()
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._stopped.clear()
+            self._worker = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+                close_old_connections()
+                try:
+                    self.flush()
+                except Exception:
+                    # already logged by flush, the batch stays buffered for the next round
+                    pass
+        finally:
+            connection.close()
@@ -0,0 +1,75 @@
+import math
+
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_M / 360
+
+
+def cell_for(longitude, latitude, cell_size):
+    """
+    Quantize a coordinate onto a square grid of `cell_size` degrees
+    @param: longitude:float, latitude:float, cell_size:float
+    @return: tuple: (column:int, row:int)
+    """
+    return int(math.floor(longitude / cell_size)), int(math.floor(latitude / cell_size))
+
+
+def cell_key(cell):
+    return f"{cell[0]}:{cell[1]}"
+
+
+def cell_center(cell, cell_size):
+    return (cell[0] + 0.5) * cell_size, (cell[1] + 0.5) * cell_size
+
+
+def ring(cell, k):
+    """
+    Cells at Chebyshev distance exactly `k` from `cell`
+    """
+    if k == 0:
+        return [cell]
+    x, y = cell
+    cells = []
+    for dx in range(-k, k + 1):
+        cells.append((x + dx, y - k))
+        cells.append((x + dx, y + k))
+    for dy in range(-k + 1, k):
+        cells.append((x - k, y + dy))
+        cells.append((x + k, y + dy))
+    return cells
+
+
+def neighbours(cell, k=1):
+    """
+    `cell` and every cell within Chebyshev distance `k` of it
+    """
+    x, y = cell
+    return [(x + dx, y + dy) for dx in range(-k, k + 1) for dy in range(-k, k + 1)]
+
+
+def rings_for_radius(latitude, radius, cell_size):
+    """
+    Number of rings around a cell that must be visited to cover `radius` metres
+    """
+    return int(radius // min_cell_width(latitude, radius, cell_size)) + 1
+
+
+def min_cell_width(latitude, reach, cell_size):
+    """
+    Lower bound, in metres, of the width of a grid cell anywhere within `reach` metres of `latitude`.
+    Longitude degrees shrink towards the poles, so the bound uses the worst latitude in reach.
+    """
+    worst_latitude = min(abs(latitude) + reach / METERS_PER_DEGREE, 89.0)
+    return cell_size * METERS_PER_DEGREE * math.cos(math.radians(worst_latitude))
+
+
+def haversine(longitude1, latitude1, longitude2, latitude2):
+    """
+    Great-circle distance in metres between two coordinates
+    """
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(longitude2 - longitude1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
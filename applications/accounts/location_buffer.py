@@ -0,0 +1,142 @@
+import atexit
+import logging
+
+from django.conf import settings
+
+from applications.accounts.background import BackgroundFlusher
+from applications.accounts.locations import write_driver_locations
+from applications.accounts.models import DriverLocation
+from applications.accounts.signals import driver_locations_changed
+
+
+logger = logging.getLogger(__name__)
+
+
+def buffer_settings():
+    return getattr(settings, 'DRIVER_LOCATION_WRITE_BEHIND', {})
+
+
+class LocationWriteBuffer(BackgroundFlusher):
+    """
+    Write-behind buffer for driver location pings.
+    Only the latest position per DriverLocation is kept, a background thread writes the batch
+    with one bulk update every `flush_interval` seconds or as soon as `flush_size` locations are
+    pending. Once `max_pending` locations are buffered, producers flush inline before enqueueing,
+    which blocks them until the database has caught up.
+    Buffered positions are pushed into the spatial index immediately so listings never lag behind.
+    """
+
+    thread_name = 'driver-location-flush'
+
+    def __init__(self):
+        super().__init__()
+        self._pending = {}
+
+    @property
+    def enabled(self):
+        return buffer_settings().get('ENABLED', False)
+
+    @property
+    def flush_interval(self):
+        return buffer_settings().get('FLUSH_INTERVAL', 2.0)
+
+    @property
+    def flush_size(self):
+        return buffer_settings().get('FLUSH_SIZE', 500)
+
+    @property
+    def max_pending(self):
+        return buffer_settings().get('MAX_PENDING', 5000)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, location_id, point, is_driver_available, was_available):
+        """
+        Buffer the latest position of a driver
+        @param: location_id:int, point:Point, is_driver_available:bool,
+                was_available:bool availability currently stored in the database
+        """
+        while True:
+            with self._lock:
+                if location_id in self._pending or len(self._pending) < self.max_pending:
+                    previous = self._pending.get(location_id)
+                    if previous is not None:
+                        was_available = previous[2]
+                    self._pending[location_id] = (point, is_driver_available, was_available)
+                    full = len(self._pending) >= self.flush_size
+                    break
+            # backpressure: the buffer is full, drain it on the caller's thread
+            self.flush()
+
+        # in-memory consumers (spatial index, position feed, caches) see the position right away
+        driver_locations_changed.send(sender=DriverLocation, locations=[
+            DriverLocation(pk=location_id, location=point, is_driver_available=is_driver_available)
+        ])
+        self._buffered(full)
+
+    def put_many(self, updates):
+        """
+        Buffer many positions, ignoring ids that do not exist
+        @param: updates:dict DriverLocation id -> (Point, is_driver_available or None)
+        @return: set: ids that were buffered
+        """
+        stored = dict(DriverLocation.objects.filter(pk__in=list(updates)).values_list('pk', 'is_driver_available'))
+        for location_id, was_available in stored.items():
+            point, is_driver_available = updates[location_id]
+            if is_driver_available is None:
+                pending = self.get(location_id)
+                is_driver_available = pending[1] if pending else was_available
+            self.put(location_id, point, is_driver_available, was_available)
+        return set(stored)
+
+    def get(self, location_id):
+        return self._pending.get(location_id)
+
+    def pending(self):
+        with self._lock:
+            return dict(self._pending)
+
+    def availability_changes(self):
+        """
+        Buffered availability that differs from the database
+        @return: tuple: (ids now available:set, ids now unavailable:set)
+        """
+        available, unavailable = set(), set()
+        with self._lock:
+            for location_id, (point, is_driver_available, was_available) in self._pending.items():
+                if is_driver_available and not was_available:
+                    available.add(location_id)
+                elif was_available and not is_driver_available:
+                    unavailable.add(location_id)
+        return available, unavailable
+
+    def flush(self):
+        """
+        Write everything buffered so far to the database
+        @return: int: number of locations written
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                # availability is only written when the pings changed it: a dispatch may have taken
+                # the driver since, and a ping repeating the old state must not make them available again
+                write_driver_locations({
+                    location_id: (point, is_driver_available if is_driver_available != was_available else None)
+                    for location_id, (point, is_driver_available, was_available) in batch.items()
+                })
+            except Exception:
+                logger.exception("Failed to flush %d buffered driver locations", len(batch))
+                with self._lock:
+                    # keep newer positions that arrived while the flush was running
+                    batch.update(self._pending)
+                    self._pending = batch
+                raise
+            return len(batch)
+
+
+location_buffer = LocationWriteBuffer()
+atexit.register(location_buffer.stop)
@@ -0,0 +1,32 @@
+from django.db import transaction
+from django.utils import timezone
+
+from applications.accounts.models import DriverLocation
+from applications.accounts.signals import driver_locations_changed
+
+
+def write_driver_locations(updates, batch_size=500):
+    """
+    Apply many driver location updates with a single bulk UPDATE
+    @param: updates:dict DriverLocation id -> (Point or None, is_driver_available or None)
+    @return: set: ids of the DriverLocation rows that were updated
+    """
+    if not updates:
+        return set()
+    now = timezone.now()
+    with transaction.atomic():
+        locations = DriverLocation.objects.in_bulk(list(updates))
+        for location_id, location in locations.items():
+            point, is_driver_available = updates[location_id]
+            if point is not None:
+                # a position is a heartbeat, availability changes alone are not
+                location.location = point
+                location.last_seen = now
+            if is_driver_available is not None:
+                location.is_driver_available = is_driver_available
+        changed = list(locations.values())
+        DriverLocation.objects.bulk_update(changed, ['location', 'is_driver_available', 'last_seen'], batch_size=batch_size)
+        transaction.on_commit(
+            lambda: driver_locations_changed.send(sender=DriverLocation, locations=changed)
+        )
+    return set(locations)
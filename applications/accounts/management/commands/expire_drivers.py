@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from applications.accounts.presence import expire_stale_drivers, presence_settings
+
+
+class Command(BaseCommand):
+    help = "Mark drivers without a recent location ping as unavailable, once or every --interval seconds"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=presence_settings().get('SWEEP_INTERVAL', 30))
+        parser.add_argument('--once', action='store_true', help="Run a single sweep and exit")
+        parser.add_argument('--batch-size', type=int,
+                            help="Rows per transaction, defaults to DRIVER_PRESENCE['SWEEP_BATCH_SIZE']")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            started = time.monotonic()
+            expired = expire_stale_drivers(options['batch_size'])
+            if expired or options['verbosity'] > 1:
+                self.stdout.write(f"Expired {expired} drivers in {time.monotonic() - started:.3f}s")
+            if options['once']:
+                return
+            time.sleep(max(0.0, options['interval'] - (time.monotonic() - started)))
@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 07:49
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_auto_20231021_2057'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(django.db.models.functions.text.Upper('email'), name='accounts_user_email_upper_idx'),
+        ),
+    ]
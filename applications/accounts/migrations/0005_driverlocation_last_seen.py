@@ -0,0 +1,23 @@
+# Generated by Django 3.2 on 2026-10-18 08:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_user_email_upper_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='driverlocation',
+            name='last_seen',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='driverlocation',
+            index=models.Index(fields=['is_driver_available', 'last_seen'], name='accounts_driver_presence_idx'),
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.utils import timezone
+from django.db.models.functions import Upper
 from django.contrib.auth.models import AbstractUser
 from django.contrib.gis.db import models as gis_models
 
@@ -8,10 +10,25 @@ from phonenumber_field.modelfields import PhoneNumberField
 class DriverLocation(models.Model):
     location = gis_models.PointField(null=True, blank=True, geography=True)
     is_driver_available = models.BooleanField(default=True)
+    # refreshed by every position ping, drivers silent for DRIVER_PRESENCE['TTL'] are expired
+    last_seen = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # listings and the presence sweep filter available drivers on recency
+            models.Index(fields=['is_driver_available', 'last_seen'], name='accounts_driver_presence_idx'),
+        ]
 
     def __str__(self):
         return f"{self.location.x}, {self.location.y}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # stored values, so consumers of driver_locations_changed can tell what changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
 
 class User(AbstractUser):
     ROLES = (
@@ -23,6 +40,12 @@ class User(AbstractUser):
     user_role = models.CharField(max_length=125, null=True, blank=True, choices=ROLES)
     driver = gis_models.OneToOneField(DriverLocation, on_delete=models.CASCADE, null=True, blank=True)
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # login looks users up with email__iexact
+            models.Index(Upper('email'), name='accounts_user_email_upper_idx'),
+        ]
+
     def __str__(self):
         return self.username
 
@@ -0,0 +1,99 @@
+from django.contrib.gis.db import models as gis_models
+from django.contrib.gis.db.models.functions import Distance, GeometryDistance
+from django.contrib.gis.measure import D
+from django.db.models import F, Q, Value
+
+from applications.accounts.location_buffer import location_buffer
+from applications.accounts.models import User
+from applications.accounts.presence import presence_cutoff
+from applications.accounts.spatial_index import driver_index
+
+
+def available_drivers():
+    """
+    Drivers accepting rides and seen within the presence TTL, including availability changes
+    still held in the write-behind buffer
+    """
+    drivers = User.objects.filter(user_role='driver')
+    present = Q(driver__is_driver_available=True)
+    cutoff = presence_cutoff()
+    if cutoff is not None:
+        present &= Q(driver__last_seen__gte=cutoff)
+    now_available, now_unavailable = location_buffer.availability_changes()
+    if not now_available and not now_unavailable:
+        return drivers.filter(present)
+    return drivers.filter(present | Q(driver_id__in=now_available)).exclude(driver_id__in=now_unavailable)
+
+
+LISTING_FIELDS = ('id', 'full_name', 'phone', 'driver_id', 'driver__location', 'driver__is_driver_available')
+
+
+def listing_record(row, distance=None):
+    """
+    Flatten a `LISTING_FIELDS` row into the driver listing record
+    @return: dict: id, driver, full_name, phone, latitude, longitude, is_driver_available, distance in metres
+    """
+    point = row['driver__location']
+    if distance is None:
+        distance = row.get('distance')
+    return {
+        'id': row['id'],
+        'driver': row['driver_id'],
+        'full_name': row['full_name'],
+        'phone': row['phone'],
+        'latitude': point.y if point is not None else None,
+        'longitude': point.x if point is not None else None,
+        'is_driver_available': row['driver__is_driver_available'],
+        'distance': distance.m if isinstance(distance, D) else distance,
+    }
+
+
+def find_nearby_drivers(point, radius=None, limit=None):
+    """
+    Available drivers ordered by distance from a point.
+    Served from the in-process spatial index when it is enabled, the database is then only used
+    to load the selected users. Write-behind mode always uses the index since buffered positions
+    are not in the database yet.
+    @param: point:Point, radius:float metres, limit:int
+    @return: list: `listing_record` dicts, nearest first
+    """
+    if driver_index.enabled or location_buffer.enabled:
+        return nearest_from_index(point, radius, limit)
+    return nearest_from_database(point, radius, limit)
+
+
+def nearest_from_index(point, radius=None, limit=None):
+    driver_index.ensure_fresh()
+    matches = driver_index.nearest(point.x, point.y, k=limit, radius=radius)
+    distances = dict(matches)
+    records = []
+    for row in available_drivers().filter(driver_id__in=distances).values(*LISTING_FIELDS):
+        record = listing_record(row, distances[row['driver_id']])
+        # in write-behind mode a ping buffered by this worker is newer than the row, otherwise the
+        # row is authoritative and the index may be a refresh behind it
+        pending = location_buffer.get(row['driver_id']) if location_buffer.enabled else None
+        if pending is not None:
+            point, record['is_driver_available'], was_available = pending
+            record['longitude'], record['latitude'] = point.x, point.y
+        records.append(record)
+    records.sort(key=lambda record: record['distance'])
+    return records
+
+
+def nearest_from_database(point, radius=None, limit=None):
+    """
+    PostGIS nearest-driver search.
+    `ST_DWithin` prunes candidates through the GiST index on DriverLocation.location and the
+    KNN `<->` ordering lets PostgreSQL walk that same index nearest first, so only `limit` rows
+    are read instead of sorting every available driver.
+    """
+    target = Value(point, output_field=gis_models.PointField(geography=True, srid=4326))
+    drivers = available_drivers()
+    if radius is not None:
+        drivers = drivers.filter(driver__location__dwithin=(point, D(m=radius)))
+    drivers = drivers.annotate(
+        distance=Distance(F('driver__location'), point)
+    ).order_by(GeometryDistance(F('driver__location'), target)).values(*LISTING_FIELDS, 'distance')
+    if limit is not None:
+        drivers = drivers[:limit]
+    return [listing_record(row) for row in drivers]
@@ -0,0 +1,133 @@
+import datetime
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+from django.utils import timezone
+
+from applications.api.metrics import registry as metrics_registry
+
+
+logger = logging.getLogger(__name__)
+
+
+def presence_settings():
+    return getattr(settings, 'DRIVER_PRESENCE', {})
+
+
+def presence_cutoff():
+    """
+    @return: datetime: drivers last seen before it are considered gone, None when presence is disabled
+    """
+    ttl = presence_settings().get('TTL', 120)
+    if not ttl:
+        return None
+    return timezone.now() - datetime.timedelta(seconds=ttl)
+
+
+def expire_stale_drivers(batch_size=None):
+    """
+    Mark available drivers without a recent ping as unavailable.
+    Runs in batches over the (is_driver_available, last_seen) index, rows locked by a concurrent
+    ping are skipped and stay available. Positions still waiting in this worker's write-behind
+    buffer are fresher than the database and are left alone.
+    @param: batch_size:int rows per transaction
+    @return: int: number of drivers expired
+    """
+    from applications.accounts.location_buffer import location_buffer
+    from applications.accounts.models import DriverLocation
+    from applications.accounts.signals import driver_locations_changed
+
+    cutoff = presence_cutoff()
+    if cutoff is None:
+        return 0
+    batch_size = batch_size or presence_settings().get('SWEEP_BATCH_SIZE', 1000)
+    buffered = list(location_buffer.pending())
+    # the lazy sweep runs inside requests whose reads may be routed to a replica
+    db = router.db_for_write(DriverLocation)
+    locations = DriverLocation.objects.db_manager(db)
+    expired = 0
+    while True:
+        with transaction.atomic(using=db):
+            stale = list(
+                locations.select_for_update(skip_locked=True)
+                .filter(is_driver_available=True, last_seen__lt=cutoff)
+                .exclude(pk__in=buffered)
+                .only('id', 'location', 'is_driver_available')[:batch_size]
+            )
+            if not stale:
+                return expired
+            locations.filter(pk__in=[location.pk for location in stale]).update(is_driver_available=False)
+            for location in stale:
+                location.is_driver_available = False
+            transaction.on_commit(
+                lambda stale=stale: driver_locations_changed.send(sender=DriverLocation, locations=stale), using=db
+            )
+        expired += len(stale)
+        if len(stale) < batch_size:
+            return expired
+
+
+class PresenceSweeper:
+    """
+    Runs `expire_stale_drivers` from request handlers at most once every `sweep_interval` seconds.
+    Workers claim a round through the `CACHE` cache, with a shared cache only one of them sweeps.
+    When the cache fails the worker sweeps anyway, the failure is logged and counted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next_sweep = 0.0
+        self.cache_errors = 0
+
+    @property
+    def enabled(self):
+        return presence_settings().get('LAZY_SWEEP', True) and presence_cutoff() is not None
+
+    @property
+    def sweep_interval(self):
+        return presence_settings().get('SWEEP_INTERVAL', 30)
+
+    def maybe_sweep(self):
+        """
+        @return: int: number of drivers expired, None when no sweep was due
+        """
+        if not self.enabled or time.monotonic() < self._next_sweep:
+            return None
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            self._next_sweep = time.monotonic() + self.sweep_interval
+            alias = presence_settings().get('CACHE', 'default')
+            try:
+                claimed = caches[alias].add('driver-presence-sweep', True, self.sweep_interval)
+            except Exception:
+                # sweeping alongside another worker is harmless, the rows it has locked are skipped
+                logger.warning("Could not claim the presence sweep in the %r cache", alias, exc_info=True)
+                self.cache_errors += 1
+                claimed = True
+            if not claimed:
+                return None
+            return expire_stale_drivers()
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self._next_sweep = 0.0
+
+
+sweeper = PresenceSweeper()
+
+
+def presence_metrics():
+    return [
+        '# HELP rider_presence_sweep_cache_errors_total Presence sweeps claimed without the shared cache.',
+        '# TYPE rider_presence_sweep_cache_errors_total counter',
+        f'rider_presence_sweep_cache_errors_total {sweeper.cache_errors}',
+    ]
+
+
+metrics_registry.add_collector(presence_metrics)
@@ -0,0 +1,180 @@
+import asyncio
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from applications.accounts.geocell import METERS_PER_DEGREE, cell_for, cell_key, haversine, min_cell_width
+
+
+def pubsub_settings():
+    return getattr(settings, 'DRIVER_PUBSUB', {})
+
+
+class Subscription:
+    """
+    A subscriber's bounded inbox, bound to the event loop it was created on.
+    When the consumer falls behind the oldest message is dropped, a newer position of the same
+    driver is always more useful than a backlog.
+    """
+
+    def __init__(self, broker, maxsize):
+        self._broker = broker
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self.topics = frozenset()
+
+    def set_topics(self, topics):
+        self._broker.set_topics(self, frozenset(topics))
+
+    async def get(self):
+        return await self._queue.get()
+
+    def close(self):
+        self._broker.set_topics(self, frozenset())
+
+    def deliver(self, message):
+        try:
+            self._loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # the subscriber's loop is gone, it will never read again
+            self.close()
+
+    def _put(self, message):
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(message)
+
+
+class InProcessBroker:
+    """
+    Topic fan-out between threads and event loops of a single process.
+    Publishing is safe from any thread, messages are handed to each subscriber's own loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self):
+        return Subscription(self, pubsub_settings().get('QUEUE_SIZE', 1000))
+
+    def set_topics(self, subscription, topics):
+        with self._lock:
+            for topic in subscription.topics - topics:
+                subscribers = self._subscribers.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[topic]
+            for topic in topics - subscription.topics:
+                self._subscribers.setdefault(topic, set()).add(subscription)
+            subscription.topics = topics
+
+    def publish(self, topics, message):
+        """
+        Deliver `message` once to every subscriber of any of `topics`
+        """
+        with self._lock:
+            receivers = set()
+            for topic in topics:
+                receivers.update(self._subscribers.get(topic, ()))
+        for subscription in receivers:
+            subscription.deliver(message)
+
+
+class Area:
+    """
+    Subscribed region: a viewport bounding box, optionally narrowed to a radius around a point
+    """
+
+    def __init__(self, min_longitude, min_latitude, max_longitude, max_latitude, center=None, radius=None):
+        self.min_longitude = min_longitude
+        self.min_latitude = min_latitude
+        self.max_longitude = max_longitude
+        self.max_latitude = max_latitude
+        self.center = center
+        self.radius = radius
+
+    @classmethod
+    def around(cls, longitude, latitude, radius):
+        d_latitude = radius / METERS_PER_DEGREE
+        d_longitude = radius / min_cell_width(latitude, radius, 1.0)
+        return cls(longitude - d_longitude, latitude - d_latitude, longitude + d_longitude, latitude + d_latitude,
+                   center=(longitude, latitude), radius=radius)
+
+    def contains(self, longitude, latitude):
+        if not (self.min_longitude <= longitude <= self.max_longitude
+                and self.min_latitude <= latitude <= self.max_latitude):
+            return False
+        if self.radius is not None:
+            return haversine(self.center[0], self.center[1], longitude, latitude) <= self.radius
+        return True
+
+    def cells(self, cell_size):
+        min_x, min_y = cell_for(self.min_longitude, self.min_latitude, cell_size)
+        max_x, max_y = cell_for(self.max_longitude, self.max_latitude, cell_size)
+        return [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+
+class DriverPositionFeed:
+    """
+    Publishes driver position changes to geocell topics of the configured broker backend.
+    Remembers the last cell of each driver so subscribers of a cell also hear about drivers
+    leaving it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_cells = {}
+        self._broker = None
+
+    @property
+    def broker(self):
+        if self._broker is None:
+            backend = pubsub_settings().get('BACKEND', 'applications.accounts.pubsub.InProcessBroker')
+            self._broker = import_string(backend)()
+        return self._broker
+
+    @property
+    def cell_size(self):
+        return pubsub_settings().get('CELL_SIZE', 0.05)
+
+    def topics(self, area):
+        return [self.topic(cell) for cell in area.cells(self.cell_size)]
+
+    def topic(self, cell):
+        return f"drivers:{cell_key(cell)}"
+
+    def publish_locations(self, locations):
+        for location in locations:
+            if location.location is None:
+                self.publish_removed([location.pk])
+            else:
+                self.publish_position(location.pk, location.location.x, location.location.y,
+                                      location.is_driver_available)
+
+    def publish_position(self, location_id, longitude, latitude, is_driver_available):
+        cell = cell_for(longitude, latitude, self.cell_size)
+        with self._lock:
+            previous = self._last_cells.get(location_id)
+            self._last_cells[location_id] = cell
+        topics = {self.topic(cell)}
+        if previous is not None:
+            topics.add(self.topic(previous))
+        self.broker.publish(topics, {
+            'driver': location_id,
+            'latitude': latitude,
+            'longitude': longitude,
+            'is_driver_available': is_driver_available,
+        })
+
+    def publish_removed(self, location_ids):
+        for location_id in location_ids:
+            with self._lock:
+                previous = self._last_cells.pop(location_id, None)
+            if previous is not None:
+                self.broker.publish({self.topic(previous)}, {'driver': location_id, 'is_driver_available': False})
+
+
+driver_feed = DriverPositionFeed()
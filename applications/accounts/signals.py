@@ -0,0 +1,72 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal, receiver
+
+from rest_framework.authtoken.models import Token
+
+from applications.accounts.authentication import token_cache
+from applications.accounts.models import User, DriverLocation
+from applications.accounts.pubsub import driver_feed
+from applications.accounts.spatial_index import driver_index
+
+
+# Sent after commit with `locations`, a list of DriverLocation instances whose position or
+# availability changed. Code that writes driver locations without `save()` (bulk updates)
+# must send it itself so that in-memory consumers stay in sync. The write-behind buffer sends
+# it as soon as a position is buffered, before the row is written.
+driver_locations_changed = Signal()
+
+# Sent after commit with `location_ids`, a list of deleted DriverLocation ids.
+driver_locations_removed = Signal()
+
+
+@receiver(post_save, sender=DriverLocation)
+def driver_location_saved(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: driver_locations_changed.send(sender=DriverLocation, locations=[instance])
+    )
+
+
+@receiver(post_delete, sender=DriverLocation)
+def driver_location_deleted(sender, instance, **kwargs):
+    location_id = instance.pk
+    transaction.on_commit(
+        lambda: driver_locations_removed.send(sender=DriverLocation, location_ids=[location_id])
+    )
+
+
+@receiver(driver_locations_changed)
+def sync_driver_index(sender, locations, **kwargs):
+    driver_index.sync(locations)
+
+
+@receiver(driver_locations_removed)
+def prune_driver_index(sender, location_ids, **kwargs):
+    for location_id in location_ids:
+        driver_index.remove(location_id)
+
+
+@receiver(driver_locations_changed)
+def publish_driver_positions(sender, locations, **kwargs):
+    driver_feed.publish_locations(locations)
+
+
+@receiver(driver_locations_removed)
+def publish_removed_drivers(sender, location_ids, **kwargs):
+    driver_feed.publish_removed(location_ids)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_tokens(sender, instance, **kwargs):
+    # deactivation, password or role changes must not be served from a stale cached user
+    keys = ()
+    if token_cache.shared_cache is not None:
+        keys = Token.objects.filter(user_id=instance.pk).values_list('key', flat=True)
+    token_cache.invalidate_user(instance.pk, keys)
+
@@ -0,0 +1,187 @@
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from applications.accounts.geocell import cell_for, ring, rings_for_radius, min_cell_width, haversine
+from applications.accounts.presence import presence_cutoff
+
+
+def index_settings():
+    return getattr(settings, 'DRIVER_LOCATION_INDEX', {})
+
+
+class DriverSpatialIndex:
+    """
+    In-process grid index of available driver locations.
+    Locations are bucketed into square cells of `cell_size` degrees, nearest-K and radius queries
+    walk the cells ring by ring outwards from the query point and stop as soon as no unvisited
+    cell can hold a closer driver.
+    The index is fed by `driver_locations_changed` and is rebuilt from the database every
+    `refresh_seconds` so that writes made by other worker processes are eventually picked up.
+    """
+
+    def __init__(self, cell_size=None, refresh_seconds=None):
+        self._cell_size = cell_size
+        self._refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._cells = defaultdict(dict)
+        self._positions = {}
+        self._loaded_at = None
+
+    @property
+    def enabled(self):
+        return index_settings().get('ENABLED', False)
+
+    @property
+    def cell_size(self):
+        return self._cell_size or index_settings().get('CELL_SIZE', 0.01)
+
+    @property
+    def refresh_seconds(self):
+        if self._refresh_seconds is not None:
+            return self._refresh_seconds
+        return index_settings().get('REFRESH_SECONDS', 60)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, location_id):
+        return location_id in self._positions
+
+    def clear(self):
+        with self._lock:
+            self._cells = defaultdict(dict)
+            self._positions = {}
+            self._loaded_at = None
+
+    def upsert(self, location_id, longitude, latitude):
+        cell = cell_for(longitude, latitude, self.cell_size)
+        with self._lock:
+            self._discard(location_id)
+            self._cells[cell][location_id] = (longitude, latitude)
+            self._positions[location_id] = (longitude, latitude, cell)
+
+    def remove(self, location_id):
+        with self._lock:
+            self._discard(location_id)
+
+    def position(self, location_id):
+        entry = self._positions.get(location_id)
+        return entry[:2] if entry else None
+
+    def sync(self, locations):
+        """
+        Mirror the current state of DriverLocation instances into the index
+        @param: locations:iterable of DriverLocation
+        """
+        for location in locations:
+            if location.is_driver_available and location.location is not None:
+                self.upsert(location.pk, location.location.x, location.location.y)
+            else:
+                self.remove(location.pk)
+
+    def load(self):
+        """
+        Rebuild the index from the available driver locations in the database
+        """
+        from applications.accounts.models import DriverLocation
+        from applications.accounts.location_buffer import location_buffer
+
+        cell_size = self.cell_size
+        cells = defaultdict(dict)
+        positions = {}
+        rows = DriverLocation.objects.filter(is_driver_available=True, location__isnull=False)
+        cutoff = presence_cutoff()
+        if cutoff is not None:
+            # drivers that stopped pinging are left out until their next ping
+            rows = rows.filter(last_seen__gte=cutoff)
+        rows = rows.values_list('id', 'location').iterator(chunk_size=2000)
+        for location_id, point in rows:
+            cell = cell_for(point.x, point.y, cell_size)
+            cells[cell][location_id] = (point.x, point.y)
+            positions[location_id] = (point.x, point.y, cell)
+        with self._lock:
+            self._cells = cells
+            self._positions = positions
+            self._loaded_at = time.monotonic()
+            # positions still waiting in the write-behind buffer are newer than the database
+            for location_id, (point, is_driver_available, was_available) in location_buffer.pending().items():
+                if is_driver_available and point is not None:
+                    self.upsert(location_id, point.x, point.y)
+                else:
+                    self.remove(location_id)
+
+    def ensure_fresh(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.refresh_seconds:
+            self.load()
+
+    def nearest(self, longitude, latitude, k=None, radius=None):
+        """
+        Drivers ordered by distance from a point
+        @param: longitude:float, latitude:float, k:int max results, radius:float metres
+        @return: list: (location id, distance in metres) tuples, nearest first
+        """
+        cell_size = self.cell_size
+        origin = cell_for(longitude, latitude, cell_size)
+        found = []
+        with self._lock:
+            for k_ring, cells in self._rings(origin, latitude, radius):
+                if k is not None and len(found) >= k:
+                    found.sort()
+                    reach = found[k - 1][0]
+                    if reach <= (k_ring - 1) * min_cell_width(latitude, reach, cell_size):
+                        break
+                for cell in cells:
+                    bucket = self._cells.get(cell)
+                    if not bucket:
+                        continue
+                    for location_id, (x, y) in bucket.items():
+                        distance = haversine(longitude, latitude, x, y)
+                        if radius is None or distance <= radius:
+                            found.append((distance, location_id))
+        found.sort()
+        if k is not None:
+            found = found[:k]
+        return [(location_id, distance) for distance, location_id in found]
+
+    def _rings(self, origin, latitude, radius):
+        """
+        Yield (ring number, cells) from the origin outwards.
+        Walks the grid geometrically while that is cheaper than looking at every occupied cell,
+        otherwise groups the occupied cells by ring.
+        """
+        occupied = len(self._cells)
+        if radius is not None:
+            max_ring = rings_for_radius(latitude, radius, self.cell_size)
+            if (2 * max_ring + 1) ** 2 <= occupied:
+                for k in range(max_ring + 1):
+                    yield k, ring(origin, k)
+                return
+        else:
+            max_ring = None
+
+        by_ring = defaultdict(list)
+        x, y = origin
+        for cell in self._cells:
+            k = max(abs(cell[0] - x), abs(cell[1] - y))
+            if max_ring is None or k <= max_ring:
+                by_ring[k].append(cell)
+        for k in sorted(by_ring):
+            yield k, by_ring[k]
+
+    def _discard(self, location_id):
+        entry = self._positions.pop(location_id, None)
+        if entry is None:
+            return
+        cell = entry[2]
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.pop(location_id, None)
+            if not bucket:
+                del self._cells[cell]
+
+
+driver_index = DriverSpatialIndex()
@@ -1,11 +1,26 @@
-from django.test import TestCase
+import datetime
+import json
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from django.contrib.gis.geos import Point
 from django.urls import reverse
 
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase
 from rest_framework import status
 
+from .authentication import token_cache
 from .models import User, DriverLocation
+from .pubsub import driver_feed
+from .location_buffer import LocationWriteBuffer
+from .locations import write_driver_locations
+from .nearby import available_drivers
+from .presence import PresenceSweeper, expire_stale_drivers
+from .spatial_index import DriverSpatialIndex
 
 
 # tests for user model
@@ -34,6 +49,102 @@ class DriverLocationModelTest(TestCase):
         self.assertEqual(str(driver_location), "1.23, 4.56")
 
 
+class DriverSpatialIndexTest(TestCase):
+    def setUp(self):
+        self.index = DriverSpatialIndex(cell_size=0.01, refresh_seconds=60)
+        self.index.upsert(1, 77.5900, 12.9700)
+        self.index.upsert(2, 77.6000, 12.9800)
+        self.index.upsert(3, 77.7000, 13.0500)
+
+    def test_nearest_orders_by_distance(self):
+        matches = self.index.nearest(77.5901, 12.9701, k=2)
+        self.assertEqual([location_id for location_id, distance in matches], [1, 2])
+
+    def test_nearest_within_radius(self):
+        matches = self.index.nearest(77.5901, 12.9701, radius=2000)
+        self.assertEqual([location_id for location_id, distance in matches], [1, 2])
+
+    def test_remove_and_move(self):
+        self.index.remove(1)
+        self.index.upsert(3, 77.5902, 12.9702)
+        matches = self.index.nearest(77.5901, 12.9701, k=1)
+        self.assertEqual(matches[0][0], 3)
+        self.assertNotIn(1, self.index)
+
+
+class LocationWriteBufferTest(TestCase):
+    def setUp(self):
+        self.location = DriverLocation.objects.create(location=Point(77.59, 12.97, srid=4326))
+        self.buffer = LocationWriteBuffer()
+
+    def test_coalesces_pings_until_flush(self):
+        write_behind = {'ENABLED': True, 'FLUSH_INTERVAL': 60, 'FLUSH_SIZE': 100, 'MAX_PENDING': 100}
+        with self.settings(DRIVER_LOCATION_WRITE_BEHIND=write_behind):
+            self.buffer.put(self.location.pk, Point(77.60, 12.98, srid=4326), True, True)
+            self.buffer.put(self.location.pk, Point(77.61, 12.99, srid=4326), True, True)
+            self.assertEqual(len(self.buffer), 1)
+            self.location.refresh_from_db()
+            self.assertAlmostEqual(self.location.location.y, 12.97)
+
+            self.assertEqual(self.buffer.flush(), 1)
+            self.buffer.stop()
+        self.location.refresh_from_db()
+        self.assertAlmostEqual(self.location.location.y, 12.99)
+
+
+    def test_flush_keeps_availability_changed_meanwhile(self):
+        write_behind = {'ENABLED': True, 'FLUSH_INTERVAL': 60, 'FLUSH_SIZE': 100, 'MAX_PENDING': 100}
+        DriverLocation.objects.filter(pk=self.location.pk).update(is_driver_available=True)
+        with self.settings(DRIVER_LOCATION_WRITE_BEHIND=write_behind):
+            self.buffer.put(self.location.pk, Point(77.60, 12.98, srid=4326), True, True)
+            # dispatched before the ping is flushed
+            DriverLocation.objects.filter(pk=self.location.pk).update(is_driver_available=False)
+            self.buffer.flush()
+            self.buffer.stop()
+        self.location.refresh_from_db()
+        self.assertAlmostEqual(self.location.location.y, 12.98)
+        self.assertFalse(self.location.is_driver_available)
+
+class DriverPresenceTest(TestCase):
+    def setUp(self):
+        self.users = {}
+        for username, seconds_ago in (("fresh", 10), ("silent", 600)):
+            location = DriverLocation.objects.create(
+                location=Point(77.59, 12.97, srid=4326),
+                last_seen=timezone.now() - datetime.timedelta(seconds=seconds_ago),
+            )
+            self.users[username] = User.objects.create_user(username=username, password="driverpassword",
+                                                            user_role="driver", driver=location)
+
+    def test_silent_drivers_are_not_listed(self):
+        self.assertEqual([user.username for user in available_drivers()], ["fresh"])
+
+    def test_sweep_expires_silent_drivers(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(expire_stale_drivers(), 1)
+        self.assertEqual(
+            dict(DriverLocation.objects.values_list('user__username', 'is_driver_available')),
+            {"fresh": True, "silent": False},
+        )
+
+    def test_ping_refreshes_last_seen(self):
+        silent = self.users["silent"].driver
+        write_driver_locations({silent.pk: (Point(77.60, 12.98, srid=4326), None)})
+        self.assertEqual(expire_stale_drivers(), 0)
+        self.assertEqual(available_drivers().count(), 2)
+
+
+    @override_settings(DRIVER_PRESENCE={'TTL': 120, 'SWEEP_INTERVAL': 30, 'CACHE': 'broken'}, CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'broken': {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache', 'LOCATION': '127.0.0.1:1',
+                   'OPTIONS': {'retry_attempts': 0}},
+    })
+    def test_sweep_runs_when_the_cache_is_unreachable(self):
+        sweeper = PresenceSweeper()
+        with self.assertLogs('applications.accounts.presence', 'WARNING'):
+            self.assertEqual(sweeper.maybe_sweep(), 1)
+        self.assertEqual(sweeper.cache_errors, 1)
+
 # API tests
 # class LoginViewTest(APITestCase):
 #     def setUp(self):
@@ -95,6 +206,18 @@ class LoginViewTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
         self.assertEqual(response.data['message'], 'Invalid credentials')
 
+    def test_login_query_count(self):
+        url = '/api/login/'
+        data = {
+            'email': 'TestUser@example.com',
+            'password': 'testpassword',
+        }
+        first = self.client.post(url, data, format='json')
+        # user and token are loaded together once the token exists
+        with self.assertNumQueries(1):
+            second = self.client.post(url, data, format='json')
+        self.assertEqual(first.data['token'], second.data['token'])
+
     def test_login_user_not_registered(self):
         url = '/api/login/'
         data = {
@@ -118,3 +241,113 @@ class ProfileCreateViewTest(APITestCase):
         }
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class CachedTokenAuthenticationTest(APITestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user(username='rider@example.com', password='riderpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_token_is_cached(self):
+        self.assertEqual(self.client.get('/api/ride/').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get('/api/ride/').status_code, status.HTTP_200_OK)
+        self.assertEqual(token_cache.stats()['misses'], 1)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get('/api/ride/')
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get('/api/ride/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_token_is_rejected(self):
+        self.client.get('/api/ride/')
+        self.token.delete()
+        response = self.client.get('/api/ride/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class DriverPositionsSocketTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='rider@example.com', password='riderpassword')
+        self.token = Token.objects.create(user=user)
+
+    def communicator(self, query_string):
+        from rider.asgi import application
+        return ApplicationCommunicator(application, {
+            'type': 'websocket',
+            'path': '/ws/drivers/',
+            'query_string': query_string,
+            'headers': [],
+        })
+
+    def test_unauthenticated_connection_is_closed(self):
+        async def scenario():
+            communicator = self.communicator(b'token=invalid')
+            await communicator.send_input({'type': 'websocket.connect'})
+            return await communicator.receive_output(5)
+
+        event = async_to_sync(scenario)()
+        self.assertEqual(event['type'], 'websocket.close')
+        self.assertEqual(event['code'], 4401)
+
+    def test_subscriber_receives_deltas_inside_area(self):
+        async def scenario():
+            communicator = self.communicator(f'token={self.token.key}'.encode())
+            await communicator.send_input({'type': 'websocket.connect'})
+            events = [await communicator.receive_output(5)]
+            await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({
+                'action': 'subscribe', 'latitude': 12.97, 'longitude': 77.59, 'radius': 2000,
+            })})
+            events.append(json.loads((await communicator.receive_output(5))['text']))
+
+            driver_feed.publish_position(9001, 77.591, 12.971, True)
+            # moving out of the area removes the driver, drivers elsewhere are never sent
+            driver_feed.publish_position(9001, 77.7, 13.1, True)
+            driver_feed.publish_position(9002, 77.71, 13.11, True)
+            driver_feed.publish_position(9003, 77.592, 12.972, True)
+            for _ in range(3):
+                events.append(json.loads((await communicator.receive_output(5))['text']))
+            self.assertTrue(await communicator.receive_nothing())
+
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+            return events
+
+        events = async_to_sync(scenario)()
+        self.assertEqual(events[0], {'type': 'websocket.accept'})
+        self.assertEqual(events[1], {'type': 'drivers.snapshot', 'drivers': []})
+        self.assertEqual(events[2:], [
+            {'type': 'driver.moved', 'driver': 9001, 'latitude': 12.971, 'longitude': 77.591},
+            {'type': 'driver.removed', 'driver': 9001},
+            {'type': 'driver.moved', 'driver': 9003, 'latitude': 12.972, 'longitude': 77.592},
+        ])
+
+    def test_changes_during_snapshot_follow_it(self):
+        def snapshot(area):
+            # the driver leaves while the snapshot that still lists them is being read
+            driver_feed.publish_position(9001, 77.7, 13.1, True)
+            return [{'driver': 9001, 'latitude': 12.971, 'longitude': 77.591}]
+
+        async def scenario():
+            communicator = self.communicator(f'token={self.token.key}'.encode())
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output(5)
+            driver_feed.publish_position(9001, 77.591, 12.971, True)
+            await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({
+                'action': 'subscribe', 'latitude': 12.97, 'longitude': 77.59, 'radius': 2000,
+            })})
+            events = [json.loads((await communicator.receive_output(5))['text']) for _ in range(2)]
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+            return events
+
+        with mock.patch('applications.api.websocket.area_snapshot', snapshot):
+            events = async_to_sync(scenario)()
+        self.assertEqual(events, [
+            {'type': 'drivers.snapshot', 'drivers': [{'driver': 9001, 'latitude': 12.971, 'longitude': 77.591}]},
+            {'type': 'driver.removed', 'driver': 9001},
+        ])
@@ -0,0 +1,207 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from applications.accounts.geocell import cell_for, cell_key, neighbours, rings_for_radius
+from applications.accounts.signals import driver_locations_changed, driver_locations_removed
+from applications.api.metrics import registry as metrics_registry
+
+
+def listing_cache_settings():
+    return getattr(settings, 'DRIVER_LISTING_CACHE', {})
+
+
+class CacheEntry:
+    __slots__ = ('expires_at', 'records', 'size', 'cells', 'drivers')
+
+    def __init__(self, expires_at, records, size, cells, drivers):
+        self.expires_at = expires_at
+        self.records = records
+        self.size = size
+        self.cells = cells
+        self.drivers = drivers
+
+
+class ListingCache:
+    """
+    Short-lived cache of nearby-driver results, keyed by the pickup point quantized to a
+    `key_cell_size` geocell plus the radius and limit, so riders standing next to each other
+    share one search.
+    An entry is dropped as soon as a driver it lists changes, or any driver changes inside the
+    `cell_size` cells its radius covers. The TTL bounds staleness from changes made by other
+    worker processes. Size is bounded by `max_entries` and by the approximate JSON size of the
+    cached records, least recently used entries go first.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_cell = {}
+        self._keys_by_driver = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return listing_cache_settings().get('ENABLED', True)
+
+    @property
+    def ttl(self):
+        return listing_cache_settings().get('TTL', 2.0)
+
+    @property
+    def key_cell_size(self):
+        return listing_cache_settings().get('KEY_CELL_SIZE', 0.002)
+
+    @property
+    def cell_size(self):
+        return listing_cache_settings().get('CELL_SIZE', 0.02)
+
+    @property
+    def max_entries(self):
+        return listing_cache_settings().get('MAX_ENTRIES', 2000)
+
+    @property
+    def max_bytes(self):
+        return listing_cache_settings().get('MAX_BYTES', 8 * 1024 * 1024)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, point, radius, limit):
+        return cell_key(cell_for(point.x, point.y, self.key_cell_size)), radius, limit
+
+    def get_or_search(self, point, radius, limit, search):
+        """
+        Cached records of a nearby search, running `search()` on a miss
+        @param: point:Point pickup, radius:float metres, limit:int, search:callable returning records
+        @return: list: listing records
+        """
+        if not self.enabled:
+            return search()
+        key = self.key(point, radius, limit)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.records
+            if entry is not None:
+                self._pop(key)
+            self.misses += 1
+
+        records = search()
+        self.set(key, point, radius, records)
+        return records
+
+    def set(self, key, point, radius, records):
+        size = len(json.dumps(records, cls=DjangoJSONEncoder))
+        if size > self.max_bytes:
+            return
+        center = cell_for(point.x, point.y, self.cell_size)
+        cells = neighbours(center, rings_for_radius(point.y, radius, self.cell_size)) if radius else [center]
+        entry = CacheEntry(time.monotonic() + self.ttl, records, size, frozenset(cells),
+                           frozenset(record['driver'] for record in records))
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = entry
+            self._bytes += size
+            for cell in entry.cells:
+                self._keys_by_cell.setdefault(cell, set()).add(key)
+            for driver in entry.drivers:
+                self._keys_by_driver.setdefault(driver, set()).add(key)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_driver(self, location_id, longitude=None, latitude=None):
+        """
+        Drop the entries listing a driver and, given its new position, the entries covering it
+        """
+        with self._lock:
+            keys = set(self._keys_by_driver.get(location_id, ()))
+            if longitude is not None and latitude is not None:
+                keys.update(self._keys_by_cell.get(cell_for(longitude, latitude, self.cell_size), ()))
+            for key in keys:
+                self._pop(key)
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_cell.clear()
+            self._keys_by_driver.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.invalidations = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        for index, members in ((self._keys_by_cell, entry.cells), (self._keys_by_driver, entry.drivers)):
+            for member in members:
+                keys = index.get(member)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index[member]
+
+
+listing_cache = ListingCache()
+
+
+def listing_cache_metrics():
+    stats = listing_cache.stats()
+    lines = []
+    for name, kind, help_text in (
+        ('entries', 'gauge', 'Cached driver listings.'),
+        ('bytes', 'gauge', 'Approximate size of the cached driver listings.'),
+        ('hits', 'counter', 'Driver listings served from the cache.'),
+        ('misses', 'counter', 'Driver listings that ran the search.'),
+        ('invalidations', 'counter', 'Cached listings dropped because a driver changed.'),
+        ('evictions', 'counter', 'Cached listings dropped to stay within the size bounds.'),
+        ('hit_ratio', 'gauge', 'Share of driver listings served from the cache.'),
+    ):
+        metric = f'rider_listing_cache_{name}' + ('_total' if kind == 'counter' else '')
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {kind}', f'{metric} {stats[name]}']
+    return lines
+
+
+metrics_registry.add_collector(listing_cache_metrics)
+
+
+def invalidate_changed_drivers(sender, locations, **kwargs):
+    for location in locations:
+        point = location.location
+        listing_cache.invalidate_driver(location.pk, *((point.x, point.y) if point is not None else ()))
+
+
+def invalidate_removed_drivers(sender, location_ids, **kwargs):
+    for location_id in location_ids:
+        listing_cache.invalidate_driver(location_id)
+
+
+driver_locations_changed.connect(invalidate_changed_drivers, dispatch_uid='listing_cache_changed')
+driver_locations_removed.connect(invalidate_removed_drivers, dispatch_uid='listing_cache_removed')
@@ -0,0 +1,98 @@
+"""
+Driver inbox long poll waiting on the event loop.
+
+Under WSGI every waiting inbox request holds a worker thread for up to `RIDE_INBOX['MAX_TIMEOUT']`
+seconds, and under ASGI Django 3.2 runs the sync DRF view on the one thread shared by all sync
+views. rider/asgi.py routes inbox requests here instead: the wait for the inbox to change is an
+asyncio future, the database is only touched on a thread for the re-reads. The answer itself is
+left to Django, the request is passed on with `timeout=0` so it goes through the middleware and
+the DRF view like any other request. Requests this handler cannot wait for, a missing or invalid
+token or invalid parameters, are passed on unchanged and answered by the view without waiting.
+"""
+import asyncio
+import logging
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.http import QueryDict
+from rest_framework import exceptions
+
+from applications.accounts.authentication import CachedTokenAuthentication
+from applications.api.renderers import ORJSONRenderer
+from applications.api.views import inbox_timeout
+from applications.api.websocket import header_token
+from applications.ride.notifier import poll_async
+
+logger = logging.getLogger(__name__)
+
+INBOX_PATH = '/api/ride-request/inbox/'
+
+
+async def authenticate(scope):
+    """
+    @return: User or None when the request carries no valid token
+    """
+    key = header_token(scope)
+    if key is None:
+        return None
+    try:
+        user, token = await sync_to_async(CachedTokenAuthentication().authenticate_credentials)(key)
+    except exceptions.AuthenticationFailed:
+        return None
+    return user
+
+
+async def inbox(scope, receive, send, application):
+    """
+    ASGI handler of `/api/ride-request/inbox/`
+    @param: application: ASGI application answering the request once the wait is over
+    """
+    user = await authenticate(scope) if scope['method'] == 'GET' else None
+    params = QueryDict(scope.get('query_string', b'').decode(), mutable=True)
+    try:
+        timeout = inbox_timeout(SimpleNamespace(query_params=params)) if user is not None else 0
+    except exceptions.ValidationError:
+        timeout = 0
+    if not timeout:
+        await application(scope, receive, send)
+        return
+
+    received = []
+
+    async def wait_disconnect():
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            # the request body, replayed to Django below
+            received.append(message)
+
+    async def replay():
+        return received.pop(0) if received else await receive()
+
+    # a client that hangs up stops the wait instead of leaving it to time out
+    poll = asyncio.ensure_future(poll_async(user.pk, params.get('cursor'), timeout))
+    disconnect = asyncio.ensure_future(wait_disconnect())
+    try:
+        await asyncio.wait({poll, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (poll, disconnect):
+            task.cancel()
+    if not poll.done() or poll.cancelled():
+        return
+    if poll.exception() is not None:
+        logger.error("Inbox long poll failed", exc_info=poll.exception())
+        await send_json(send, 500, {'message': 'Internal server error', 'status': 500})
+        return
+    params['timeout'] = '0'
+    await application({**scope, 'query_string': params.urlencode().encode()}, replay, send)
+
+
+async def send_json(send, status_code, data):
+    body = ORJSONRenderer().render(data)
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
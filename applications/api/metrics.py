@@ -0,0 +1,170 @@
+import threading
+
+from django.conf import settings
+
+from rider.backends.postgis_pool.pool import pool_metrics
+from rider.db_router import routing_metrics
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def metrics_settings():
+    return getattr(settings, 'REQUEST_METRICS', {})
+
+
+class RouteStats:
+    """
+    Counters of one (route, method) pair within a shard
+    """
+    __slots__ = ('statuses', 'buckets', 'duration', 'count', 'queries', 'query_duration', 'response_bytes')
+
+    def __init__(self, bucket_count):
+        self.statuses = {}
+        self.buckets = [0] * bucket_count
+        self.duration = 0.0
+        self.count = 0
+        self.queries = 0
+        self.query_duration = 0.0
+        self.response_bytes = 0
+
+
+class MetricsRegistry:
+    """
+    Per-worker request metrics.
+    Every thread records into its own shard, so the request path never takes a lock; the shards
+    are only merged when /metrics is rendered. Each worker process reports its own numbers and
+    the scraper sums them across workers.
+    """
+
+    def __init__(self, buckets=None):
+        self._buckets = tuple(buckets) if buckets is not None else None
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._collectors = []
+
+    @property
+    def buckets(self):
+        if self._buckets is None:
+            self._buckets = tuple(metrics_settings().get('BUCKETS', DEFAULT_BUCKETS))
+        return self._buckets
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            # registration happens once per thread, recording itself is lock free
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def record(self, route, method, status_code, duration, queries=0, query_duration=0.0, response_bytes=0):
+        """
+        @param: route:str, method:str, status_code:int, duration:float seconds, queries:int,
+                query_duration:float seconds, response_bytes:int
+        """
+        shard = self._shard()
+        buckets = self.buckets
+        stats = shard.get((route, method))
+        if stats is None:
+            stats = shard[(route, method)] = RouteStats(len(buckets))
+        stats.statuses[status_code] = stats.statuses.get(status_code, 0) + 1
+        for index, bound in enumerate(buckets):
+            if duration <= bound:
+                stats.buckets[index] += 1
+                break
+        stats.duration += duration
+        stats.count += 1
+        stats.queries += queries
+        stats.query_duration += query_duration
+        stats.response_bytes += response_bytes
+
+    def snapshot(self):
+        """
+        Merge every shard
+        @return: dict: (route, method) -> RouteStats
+        """
+        with self._shards_lock:
+            shards = list(self._shards)
+        merged = {}
+        bucket_count = len(self.buckets)
+        for shard in shards:
+            for key, stats in list(shard.items()):
+                total = merged.get(key)
+                if total is None:
+                    total = merged[key] = RouteStats(bucket_count)
+                for status_code, count in list(stats.statuses.items()):
+                    total.statuses[status_code] = total.statuses.get(status_code, 0) + count
+                for index, count in enumerate(stats.buckets):
+                    total.buckets[index] += count
+                total.duration += stats.duration
+                total.count += stats.count
+                total.queries += stats.queries
+                total.query_duration += stats.query_duration
+                total.response_bytes += stats.response_bytes
+        return merged
+
+    def add_collector(self, collector):
+        """
+        Render extra metrics with every scrape
+        @param: collector:callable returning a list of Prometheus text lines
+        """
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    def clear(self):
+        with self._shards_lock:
+            for shard in self._shards:
+                shard.clear()
+
+    def render(self):
+        """
+        @return: str: metrics in the Prometheus text exposition format
+        """
+        snapshot = sorted(self.snapshot().items())
+        buckets = self.buckets
+        lines = [
+            '# HELP rider_http_requests_total Requests by route, method and status code.',
+            '# TYPE rider_http_requests_total counter',
+        ]
+        for (route, method), stats in snapshot:
+            for status_code, count in sorted(stats.statuses.items()):
+                lines.append(f'rider_http_requests_total{{{_labels(route, method)},status="{status_code}"}} {count}')
+
+        lines += [
+            '# HELP rider_http_request_duration_seconds Request latency by route and method.',
+            '# TYPE rider_http_request_duration_seconds histogram',
+        ]
+        for (route, method), stats in snapshot:
+            labels = _labels(route, method)
+            cumulative = 0
+            for bound, count in zip(buckets, stats.buckets):
+                cumulative += count
+                lines.append(f'rider_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'rider_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.count}')
+            lines.append(f'rider_http_request_duration_seconds_sum{{{labels}}} {stats.duration}')
+            lines.append(f'rider_http_request_duration_seconds_count{{{labels}}} {stats.count}')
+
+        for name, kind, help_text, attribute in (
+            ('rider_db_queries_total', 'counter', 'SQL queries run by requests.', 'queries'),
+            ('rider_db_query_duration_seconds_total', 'counter', 'Time spent in SQL queries.', 'query_duration'),
+            ('rider_http_response_size_bytes_total', 'counter', 'Response body bytes sent.', 'response_bytes'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for (route, method), stats in snapshot:
+                lines.append(f'{name}{{{_labels(route, method)}}} {getattr(stats, attribute)}')
+        for collector in self._collectors:
+            lines += collector()
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(route, method):
+    route = route.replace('\\', '\\\\').replace('"', '\\"')
+    return f'route="{route}",method="{method}"'
+
+
+registry = MetricsRegistry()
+# the database backend and router do not import apps, their collectors are registered from here
+registry.add_collector(pool_metrics)
+registry.add_collector(routing_metrics)
@@ -0,0 +1,161 @@
+import gzip
+import time
+import zlib
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+
+from applications.api.metrics import metrics_settings, registry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class QueryCounter:
+    """
+    Execute wrapper counting the queries of a request and the time spent in them
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.queries += 1
+
+
+class MetricsMiddleware:
+    """
+    Records request count, latency, SQL queries and response size per route into the
+    per-worker metrics registry. Routes are URL names, so `/api/ride/12/` is reported as
+    `ride-detail`. Queries run while a streaming response is consumed are not counted.
+    """
+
+    registry = registry
+
+    def __init__(self, get_response):
+        if not metrics_settings().get('ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(counter))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        route = (match.view_name or match.route) if match is not None else 'unmatched'
+        if route != 'metrics':
+            self.registry.record(
+                route, request.method, response.status_code, duration,
+                queries=counter.queries,
+                query_duration=counter.duration,
+                response_bytes=0 if response.streaming else len(response.content),
+            )
+        return response
+
+
+def compression_settings():
+    return getattr(settings, 'RESPONSE_COMPRESSION', {})
+
+
+def accepted_encodings(header):
+    """
+    @param: header:str Accept-Encoding
+    @return: set: codings the client accepts, those with q=0 left out
+    """
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def brotli_stream(chunks, quality):
+    compressor = brotli.Compressor(quality=quality)
+    for chunk in chunks:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    Compresses response bodies of at least `MIN_SIZE` bytes, with brotli when the client accepts
+    it and the optional brotli package is installed, gzip otherwise. Streaming responses are
+    compressed chunk by chunk, bodies that would not shrink are sent as they are.
+    """
+
+    def __init__(self, get_response):
+        if not compression_settings().get('ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        options = compression_settings()
+        if response.has_header('Content-Encoding'):
+            return response
+        if not response.streaming and len(response.content) < options.get('MIN_SIZE', 1024):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and 'br' in accepted:
+            encoding, quality = 'br', options.get('BROTLI_QUALITY', 4)
+        elif 'gzip' in accepted:
+            encoding, quality = 'gzip', options.get('GZIP_LEVEL', 6)
+        else:
+            return response
+
+        if response.streaming:
+            stream = brotli_stream if encoding == 'br' else gzip_stream
+            response.streaming_content = stream(response.streaming_content, quality)
+            del response['Content-Length']
+        else:
+            if encoding == 'br':
+                compressed = brotli.compress(response.content, quality=quality)
+            else:
+                compressed = gzip.compress(response.content, compresslevel=quality, mtime=0)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            # the compressed body is a different representation
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
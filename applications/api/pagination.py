@@ -0,0 +1,105 @@
+import base64
+import binascii
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+class CreatedCursorPagination(BasePagination):
+    """
+    Keyset pagination over (created, id), newest first.
+    The cursor holds the (created, id) of the last row already returned, so each page is a range
+    scan on a (..., created, id) index no matter how far the client has paged.
+    A queryset filtered by an OR of columns matches no single such index. Views return the terms
+    of that OR from `keyset_scopes()`: each gets its own keyset query, they run as one UNION ALL
+    and their pages are merged here, so every branch stays a range scan on its own index.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 50
+    max_page_size = 200
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        scopes = view.keyset_scopes() if hasattr(view, 'keyset_scopes') else None
+        if scopes:
+            pages = [self.keyset(queryset.filter(scope), position) for scope in scopes]
+            # a row found by two scopes comes back twice, keep one copy
+            rows = sorted({row.pk: row for row in pages[0].union(*pages[1:], all=True)}.values(),
+                          key=lambda row: (row.created, row.pk), reverse=True)[:self.page_size + 1]
+        else:
+            rows = list(self.keyset(queryset, position))
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def keyset(self, queryset, position):
+        """
+        @param: position:tuple (created, id) from the cursor or None
+        @return: queryset of at most one page plus one row after `position`
+        """
+        queryset = queryset.order_by('-created', '-id')
+        if position is not None:
+            created, pk = position
+            # `created <= ?` keeps the index range condition, the OR only breaks ties on id
+            queryset = queryset.filter(created__lte=created).filter(Q(created__lt=created) | Q(id__lt=pk))
+        return queryset[:self.page_size + 1]
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True,
+                                 cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param,
+                                   self.encode_cursor(last.created, last.pk))
+
+    def get_first_link(self):
+        return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+
+    def encode_cursor(self, created, pk):
+        return base64.urlsafe_b64encode(f"{created.isoformat()}|{pk}".encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            created, pk = base64.urlsafe_b64decode(encoded.encode()).decode().split('|')
+            created = parse_datetime(created)
+            pk = int(pk)
+        except (TypeError, ValueError, binascii.Error, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if created is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created, pk
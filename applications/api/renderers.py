@@ -0,0 +1,85 @@
+"""
+API renderers.
+
+`ORJSONRenderer` replaces DRF's JSONRenderer with orjson, which encodes several times faster.
+Values orjson does not handle natively, datetimes included, go through DRF's JSON encoder so
+they are formatted as before. The output is equivalent JSON but not byte for byte the same:
+orjson writes some floats differently (`1e20` rather than `1e+20`). NaN and infinity are
+rejected like DRF's strict JSON does, and indented output is left to DRF's renderer.
+`MessagePackRenderer` answers clients that accept `application/msgpack`; it needs the optional
+msgpack package and is left out of content negotiation without it.
+"""
+import math
+
+import orjson
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+_encoder = JSONEncoder()
+
+
+def _default(value):
+    # DRF's encoder formats datetimes, decimals, UUIDs, lazy strings and querysets
+    return _encoder.default(value)
+
+
+def _non_finite(value):
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, dict):
+        return any(_non_finite(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_non_finite(item) for item in value)
+    return False
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+    strict = api_settings.STRICT_JSON
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        json_renderer = JSONRenderer()
+        if json_renderer.get_indent(accepted_media_type or '', renderer_context or {}):
+            # orjson only indents by 2 spaces, indented output is for people and can take the slow path
+            return json_renderer.render(data, accepted_media_type, renderer_context)
+        body = orjson.dumps(data, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+        # orjson writes NaN and infinity as null, only a body holding a null can hide one
+        if self.strict and b'null' in body and _non_finite(data):
+            raise ValueError("Out of range float values are not JSON compliant")
+        # escaped like DRF does, JSON allows them raw but JavaScript string literals do not
+        return body.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    available = msgpack is not None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+class ContentNegotiation(DefaultContentNegotiation):
+    """
+    Default negotiation over the renderers whose dependencies are installed
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        renderers = [renderer for renderer in renderers if getattr(renderer, 'available', True)]
+        return super().select_renderer(request, renderers, format_suffix)
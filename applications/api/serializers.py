@@ -6,6 +6,7 @@ from phonenumber_field.serializerfields import PhoneNumberField
 
 from applications.accounts.models import User, DriverLocation
 from applications.ride.models import Ride, RideRequest
+from applications.ride.services import fanout_settings
 
 
 class LoginSerializer(serializers.Serializer):
@@ -13,8 +14,11 @@ class LoginSerializer(serializers.Serializer):
     password = serializers.CharField()
 
     def validate(self, attrs):
-        if not User.objects.filter(email__iexact=attrs['email']).exists():
+        # one query loads the user together with their token, if any
+        user = User.objects.select_related('auth_token').filter(email__iexact=attrs['email']).order_by('pk').first()
+        if user is None:
             raise serializers.ValidationError("User not registered")
+        attrs['user'] = user
         return attrs
 
 
@@ -32,11 +36,70 @@ class UserListingSerializer(serializers.ModelSerializer):
         exclude = ['password', 'groups', 'user_permissions', ]
 
 
+class DriverListingSerializer(serializers.Serializer):
+    """
+    Flat, read-only driver listing record built from `applications.accounts.nearby.listing_record`
+    """
+    id = serializers.IntegerField(read_only=True)
+    driver = serializers.IntegerField(read_only=True)
+    full_name = serializers.CharField(read_only=True)
+    phone = serializers.CharField(read_only=True)
+    latitude = serializers.FloatField(read_only=True)
+    longitude = serializers.FloatField(read_only=True)
+    is_driver_available = serializers.BooleanField(read_only=True)
+    distance = serializers.FloatField(read_only=True)
+    eta_seconds = serializers.IntegerField(read_only=True, allow_null=True)
+
+
 class RideSerializer(serializers.ModelSerializer):
+    """
+    Rides are still written through the text lat/lon fields, the indexed
+    `pickup_location`/`dropoff_location` points are derived from them on save.
+    `notify_drivers` on creation sends the ride to that many nearest drivers, the created ride
+    then lists them in `notified_drivers`.
+    """
+    COORDINATE_FIELDS = (
+        ('pickup_loc_latitude', -90, 90),
+        ('pickup_loc_longitude', -180, 180),
+        ('dropoff_loc_latitude', -90, 90),
+        ('dropoff_loc_logitude', -180, 180),
+    )
+    notify_drivers = serializers.IntegerField(write_only=True, required=False, min_value=1)
 
     class Meta:
         model = Ride
         fields = '__all__'
+        read_only_fields = ('pickup_location', 'dropoff_location')
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        notified = getattr(instance, 'notified_drivers', None)
+        if notified is not None:
+            data['notified_drivers'] = notified
+        return data
+
+    def validate_notify_drivers(self, value):
+        maximum = fanout_settings().get('MAX_DRIVERS', 10)
+        if value > maximum:
+            raise serializers.ValidationError(f"Ensure this value is less than or equal to {maximum}.")
+        return value
+
+    def validate(self, attrs):
+        errors = {}
+        for field, minimum, maximum in self.COORDINATE_FIELDS:
+            value = attrs.get(field)
+            if value in (None, ''):
+                continue
+            try:
+                value = float(value)
+            except ValueError:
+                errors[field] = ["A valid number is required."]
+                continue
+            if not minimum <= value <= maximum:
+                errors[field] = [f"Must be between {minimum} and {maximum}."]
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
 
 
 class RideRequestSerializer(serializers.ModelSerializer):
@@ -46,6 +109,12 @@ class RideRequestSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class TrackPointSerializer(serializers.Serializer):
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    timestamp = serializers.DateTimeField(required=False)
+
+
 class DriverLocationSerializer(serializers.ModelSerializer):
     latitude = serializers.CharField(required=False)
     longitude = serializers.CharField(required=False)
@@ -54,3 +123,11 @@ class DriverLocationSerializer(serializers.ModelSerializer):
         model = DriverLocation
         fields = '__all__'
 
+
+class DriverLocationRecordSerializer(serializers.Serializer):
+    driver = serializers.IntegerField()
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    is_driver_available = serializers.BooleanField(required=False)
+    timestamp = serializers.DateTimeField(required=False)
+
@@ -16,5 +16,8 @@ router.register(r'^driver-location', views.DriverLocationView, basename='driver-
 urlpatterns = [
     url(r'^', include(router.urls)),
     url(r'^login/', views.LoginView.as_view(), name='login'),
+    url(r'^ride-export/', views.RideExportView.as_view(), name='ride-export'),
+    url(r'^heatmap/', views.HeatmapView.as_view(), name='heatmap'),
+    url(r'^eta/', views.EtaView.as_view(), name='eta'),
 
 ]
@@ -1,18 +1,39 @@
-from django.contrib.auth import authenticate, login
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.gis.geos import Point
-from django.contrib.gis.db.models.functions import Distance
-from django.db.models import F
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.utils import timezone
 
+from rest_framework.decorators import action
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
 from rest_framework import status, viewsets, permissions
-from rest_framework.serializers import ValidationError
+from rest_framework.serializers import BooleanField, DateTimeField, ValidationError
 
+from applications.api.metrics import metrics_settings, registry as metrics_registry
+from applications.api.pagination import CreatedCursorPagination
 from applications.api.serializers import LoginSerializer, UserCreateSerializer, RideSerializer, \
-    RideRequestSerializer, UserListingSerializer, DriverLocationSerializer
+    RideRequestSerializer, UserListingSerializer, DriverListingSerializer, DriverLocationSerializer, \
+    DriverLocationRecordSerializer, TrackPointSerializer
+from applications.accounts.location_buffer import location_buffer
+from applications.accounts.locations import write_driver_locations
 from applications.accounts.models import User, DriverLocation
+from applications.accounts.nearby import LISTING_FIELDS, available_drivers, find_nearby_drivers, listing_record
+from applications.accounts.presence import sweeper as presence_sweeper
+from applications.api.listing_cache import listing_cache
+from applications.ride.export import EXPORTS, FORMATS as EXPORT_FORMATS, RENDERERS as EXPORT_RENDERERS, \
+    export_rows, parse_bound
+from applications.ride.eta import add_driver_etas, estimate, eta_settings, parse_points
+from applications.ride.heatmap import cell_size as heatmap_cell_size, heatmap
 from applications.ride.models import Ride, RideRequest
+from applications.ride.notifier import inbox_settings, notifier as ride_request_notifier, poll as poll_inbox
+from applications.ride.polyline import encode as encode_polyline, simplify as simplify_track
+from applications.ride.services import accept_ride, notify_nearest_drivers
+from applications.ride.tracks import ride_track, track_buffer
 
 
 class LoginView(APIView):
@@ -26,13 +47,15 @@ class LoginView(APIView):
     def post(self, request):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
-        email = serializer.data['email']
-        password = serializer.data['password']
-        user = authenticate(username=email, password=password)
-        if not user:
+        user = serializer.validated_data['user']
+        password = serializer.validated_data['password']
+        if not (user.check_password(password) and user.is_active):
             return Response({'message': 'Invalid credentials'},
                             status=status.HTTP_401_UNAUTHORIZED)
-        token, created = Token.objects.get_or_create(user=user)
+        try:
+            token = user.auth_token
+        except ObjectDoesNotExist:
+            token, created = Token.objects.get_or_create(user=user)
         return Response({"status": "success", "token": token.key}, status=status.HTTP_200_OK)
 
 
@@ -65,9 +88,68 @@ class RideView(viewsets.ModelViewSet):
     serializer_class = RideSerializer
     queryset = Ride.objects.all()
     permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = CreatedCursorPagination
+    replica_reads = True
+
+    def get_queryset(self):
+        # riders see their own rides, drivers the rides assigned to them
+        user = self.request.user
+        if user.is_staff:
+            return self.queryset
+        return self.queryset.filter(Q(rider=user) | Q(driver=user))
+
+    def keyset_scopes(self):
+        # listed through the rider and driver (created, id) indexes, see CreatedCursorPagination
+        user = self.request.user
+        return None if user.is_staff else [Q(rider=user), Q(driver=user)]
 
     def perform_create(self, serializer):
-        serializer.save(rider=self.request.user)
+        notify_drivers = serializer.validated_data.pop('notify_drivers', None)
+        with transaction.atomic():
+            ride = serializer.save(rider=self.request.user)
+            if notify_drivers:
+                # one round trip instead of a ride-request POST per driver
+                ride.notified_drivers = notify_nearest_drivers(ride, notify_drivers)
+
+    def perform_update(self, serializer):
+        ride = serializer.save()
+        if serializer.validated_data.get('current_location') is not None:
+            point = ride.current_location
+            track_buffer.append(ride.pk, point.x, point.y)
+
+    @action(detail=True, methods=['get', 'post'], url_path='track')
+    def track(self, request, pk=None):
+        """
+        GET the path of a ride as an encoded polyline, `tolerance` in metres simplifies it first.
+        POST appends points from the ride's driver
+        @param: tolerance:float, or points:list of {latitude, longitude, timestamp}
+        @return: dict: ride:int, points:int, polyline:str, started, ended
+        """
+        ride = self.get_object()
+        if request.method == 'POST':
+            if ride.driver_id != request.user.pk:
+                return Response({'message': 'Only the driver of this ride can record its track',
+                                 'status': status.HTTP_403_FORBIDDEN}, status=status.HTTP_403_FORBIDDEN)
+            records = request.data.get('points') if isinstance(request.data, dict) else request.data
+            serializer = TrackPointSerializer(data=records, many=True)
+            serializer.is_valid(raise_exception=True)
+            for point in serializer.validated_data:
+                track_buffer.append(ride.pk, point['longitude'], point['latitude'], point.get('timestamp'))
+            return Response({'message': 'success', 'points': len(serializer.validated_data)},
+                            status=status.HTTP_201_CREATED)
+
+        tolerance = _query_number(request, 'tolerance', float, None, settings.RIDE_TRACK['MAX_TOLERANCE'])
+        points = ride_track(ride.pk)
+        path = [(longitude, latitude) for timestamp, longitude, latitude in points]
+        if tolerance:
+            path = simplify_track(path, tolerance)
+        return Response({
+            'ride': ride.pk,
+            'points': len(path),
+            'polyline': encode_polyline(path),
+            'started': points[0][0] if points else None,
+            'ended': points[-1][0] if points else None,
+        })
 
 
 class RideRequestView(viewsets.ModelViewSet):
@@ -81,6 +163,21 @@ class RideRequestView(viewsets.ModelViewSet):
     serializer_class = RideRequestSerializer
     queryset = RideRequest.objects.all()
     permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = CreatedCursorPagination
+    replica_reads = True
+
+    def get_queryset(self):
+        # riders see the requests they sent, drivers the requests sent to them
+        user = self.request.user
+        if user.is_staff:
+            return self.queryset
+        return self.queryset.filter(Q(ride__rider=user) | Q(driver=user))
+
+    def keyset_scopes(self):
+        # drivers page through the driver (created, id) index. The rider's branch joins the
+        # rider's rides and sorts their requests, its cost grows with those, not the table
+        user = self.request.user
+        return None if user.is_staff else [Q(ride__rider=user), Q(driver=user)]
 
     def perform_create(self, serializer):
         ride_id = self.request.data.get('ride')
@@ -96,13 +193,128 @@ class RideRequestView(viewsets.ModelViewSet):
 
     def update(self, request, *args, **kwargs):
         ride_request = self.get_object()
+        # riders can read their requests too, only the driver a request was sent to answers it
+        if ride_request.driver_id is None or ride_request.driver_id != request.user.pk:
+            return Response({'message': 'Only the driver of this request can answer it',
+                             'status': status.HTTP_403_FORBIDDEN}, status=status.HTTP_403_FORBIDDEN)
         driver_response = request.data.get('status', ride_request.status)
-        if driver_response == 'success':
-            ride_obj = ride_request.ride
-            ride_obj.driver = request.user
-            ride_obj.save()
+        if driver_response == 'success' and not accept_ride(ride_request, ride_request.driver):
+            return Response({'message': 'Ride already accepted', 'status': status.HTTP_409_CONFLICT},
+                            status=status.HTTP_409_CONFLICT)
         return Response({'message': 'success', 'status': status.HTTP_200_OK})
 
+    @action(detail=False, methods=['get'], url_path='inbox')
+    def inbox(self, request):
+        """
+        Long-poll the pending ride requests sent to the requesting driver, oldest first.
+        Answers at once when they differ from `cursor`, otherwise waits up to `timeout` seconds
+        for a change; `timeout=0` does not wait. Every pending request is returned each time,
+        replace the previous list with it.
+        Under ASGI, token-authenticated polls wait in applications/api/long_poll.py without
+        holding a thread. Here each wait holds a worker thread: once `RIDE_INBOX['MAX_WAITERS']`
+        wait in this worker, polls are turned away with a 503 and a `Retry-After` to honour.
+        @param: cursor:str from the previous answer, timeout:float seconds
+        @return: dict: results:list of ride requests, cursor:str to pass back
+        """
+        config = inbox_settings()
+        cursor = request.query_params.get('cursor')
+        timeout = inbox_timeout(request)
+        if timeout and not ride_request_notifier.acquire_slot(config.get('MAX_WAITERS', 8)):
+            # polling again right away would bring back the polling the long poll replaces
+            retry_after = int(config.get('RECHECK_INTERVAL', 5))
+            return Response({'message': 'Inbox busy, retry later', 'status': status.HTTP_503_SERVICE_UNAVAILABLE,
+                             'retry_after': retry_after},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': str(retry_after)})
+        try:
+            requests, cursor = poll_inbox(request.user.pk, cursor, timeout)
+        finally:
+            if timeout:
+                ride_request_notifier.release_slot()
+        return Response({'results': RideRequestSerializer(requests, many=True).data, 'cursor': cursor})
+
+
+def inbox_timeout(request):
+    config = inbox_settings()
+    return _query_number(request, 'timeout', float, config.get('DEFAULT_TIMEOUT', 20),
+                         config.get('MAX_TIMEOUT', 25), minimum=0)
+
+
+class RideExportView(APIView):
+    """
+    Views for streaming ride history to analytics
+    @param: model:str ride|ride-request, output:str ndjson|csv, created_from:str, created_to:str,
+            status:str comma separated
+    @return: streamed NDJSON or CSV rows
+    """
+    permission_classes = (permissions.IsAdminUser,)
+    replica_reads = True
+
+    def get(self, request):
+        params = request.query_params
+        model_name = params.get('model', 'ride')
+        output = params.get('output', 'ndjson')
+        if model_name not in EXPORTS:
+            raise ValidationError({'model': [f"Must be one of {', '.join(sorted(EXPORTS))}."]})
+        if output not in EXPORT_RENDERERS:
+            raise ValidationError({'output': [f"Must be one of {', '.join(sorted(EXPORT_RENDERERS))}."]})
+        try:
+            created_from = parse_bound(params['created_from']) if params.get('created_from') else None
+            created_to = parse_bound(params['created_to'], end=True) if params.get('created_to') else None
+        except ValueError as error:
+            raise ValidationError({'created': [str(error)]})
+        statuses = [value for value in params.get('status', '').split(',') if value]
+
+        fields, rows = export_rows(model_name, created_from, created_to, statuses)
+        response = StreamingHttpResponse(EXPORT_RENDERERS[output](fields, rows), content_type=EXPORT_FORMATS[output])
+        response['Content-Disposition'] = f'attachment; filename="{model_name}-export.{output}"'
+        return response
+
+
+class HeatmapView(APIView):
+    """
+    Views for the supply and demand of every geocell, read from the incrementally kept counters
+    @return: dict: cell_size:float degrees, cells:list of {cell, longitude, latitude, pending_rides,
+             available_drivers}
+    """
+    permission_classes = (permissions.IsAdminUser,)
+    replica_reads = True
+
+    def get(self, request):
+        return Response({'cell_size': heatmap_cell_size(), 'cells': heatmap()})
+
+
+class EtaView(APIView):
+    """
+    Views for estimating many trips at once, origins and destinations are paired by position
+    @param: origins:list of {latitude, longitude}, destinations:list of {latitude, longitude},
+            departure:str ISO 8601 datetime, defaults to now
+    @return: dict: results:list of {distance:float metres, eta_seconds:int}, in payload order
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request):
+        data = request.data if isinstance(request.data, dict) else {}
+        points = {}
+        for name in ('origins', 'destinations'):
+            try:
+                points[name] = parse_points(data.get(name))
+            except ValueError as error:
+                raise ValidationError({name: [str(error)]})
+        if len(points['origins']) != len(points['destinations']):
+            raise ValidationError({'destinations': ["Expected as many destinations as origins"]})
+        max_pairs = eta_settings().get('MAX_PAIRS', 10000)
+        if len(points['origins']) > max_pairs:
+            raise ValidationError({'origins': [f"At most {max_pairs} pairs are accepted per request"]})
+        departure = data.get('departure')
+        if departure is not None:
+            departure = DateTimeField().to_internal_value(departure)
+
+        distances, seconds = estimate(points['origins'], points['destinations'], departure)
+        return Response({'results': [
+            {'distance': distance, 'eta_seconds': eta}
+            for distance, eta in zip(distances.tolist(), np.rint(seconds).astype(int).tolist())
+        ]})
+
 
 class DriverLocationView(viewsets.ModelViewSet):
     """
@@ -135,44 +347,142 @@ class DriverLocationView(viewsets.ModelViewSet):
         location = self.get_object()
         latitude = request.data.get('latitude', location.location.y)
         longitude = request.data.get('longitude', location.location.x)
-        is_driver_available = request.data.get('is_driver_available', location.is_driver_available)
+        is_driver_available = location.is_driver_available
+        if 'is_driver_available' in request.data:
+            # form posts send "false", which the index, the buffer and the feed would read as truthy
+            is_driver_available = BooleanField().to_internal_value(request.data['is_driver_available'])
 
         # Create a new Point based on the updated latitude and longitude
         updated_location = Point(float(longitude), float(latitude), srid=4326)
+        if location_buffer.enabled:
+            location_buffer.put(location.pk, updated_location, is_driver_available, location.is_driver_available)
+            return Response({'message': 'success', 'status': status.HTTP_200_OK})
         location.location = updated_location
         location.is_driver_available = is_driver_available
+        location.last_seen = timezone.now()
         location.save()
         return Response({'message': 'success', 'status': status.HTTP_200_OK})
 
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """
+        Ingest many location pings in one request and write them with a single bulk update
+        @param: locations:list of {driver, latitude, longitude, is_driver_available, timestamp}
+        @return: dict: results:list per record status, in payload order
+        """
+        records = request.data.get('locations') if isinstance(request.data, dict) else request.data
+        if not isinstance(records, list):
+            raise ValidationError({'locations': ["Expected a list of location records"]})
+        max_records = settings.DRIVER_LOCATION_BULK_MAX_RECORDS
+        if len(records) > max_records:
+            raise ValidationError({'locations': [f"At most {max_records} records are accepted per request"]})
+
+        results = [None] * len(records)
+        latest = {}
+        for index, record in enumerate(records):
+            serializer = DriverLocationRecordSerializer(data=record)
+            if not serializer.is_valid():
+                results[index] = {'driver': _record_driver(record), 'status': 'invalid', 'errors': serializer.errors}
+                continue
+            data = serializer.validated_data
+            # Only the newest ping per driver is written, older ones in the same payload are superseded
+            current = latest.get(data['driver'])
+            if current is not None and _is_newer(current[1], data):
+                results[index] = {'driver': data['driver'], 'status': 'superseded'}
+                continue
+            if current is not None:
+                results[current[0]] = {'driver': data['driver'], 'status': 'superseded'}
+            latest[data['driver']] = (index, data)
+
+        updates = {
+            driver: (Point(data['longitude'], data['latitude'], srid=4326), data.get('is_driver_available'))
+            for driver, (index, data) in latest.items()
+        }
+        if location_buffer.enabled:
+            updated = location_buffer.put_many(updates)
+        else:
+            updated = write_driver_locations(updates)
+        for driver, (index, data) in latest.items():
+            results[index] = {'driver': driver, 'status': 'updated' if driver in updated else 'not_found'}
+        return Response({'message': 'success', 'updated': len(updated), 'results': results},
+                        status=status.HTTP_200_OK)
+
 
 class DriversListingView(viewsets.ModelViewSet):
     """
     Views for listing drivers for riders
-    @param: driver id:str
+    @param: driver id:str, radius:float metres, limit:int
     @return: dict:drive details:str
     """
 
     http_method_names = ['get', ]
     serializer_class = UserListingSerializer
+    listing_serializer_class = DriverListingSerializer
     queryset = User.objects.all()
     permission_classes = (permissions.IsAuthenticated,)
+    replica_reads = True
 
     def list(self, request):
-        drivers = self.queryset.filter(user_role='driver', driver__is_driver_available=True)
+        listing = settings.DRIVER_LISTING
+        radius = _query_number(request, 'radius', float, listing['DEFAULT_RADIUS'], listing['MAX_RADIUS'])
+        limit = _query_number(request, 'limit', int, listing['DEFAULT_LIMIT'], listing['MAX_LIMIT'])
+        # drivers that stopped pinging are filtered out anyway, the sweep keeps their rows out of the scans
+        presence_sweeper.maybe_sweep()
         user = self.request.user
-        ride_obj = Ride.objects.filter(rider=user).last()
-        if ride_obj and ride_obj.pickup_loc_latitude and ride_obj.pickup_loc_longitude:
-            pickup_latitude = ride_obj.pickup_loc_latitude
-            pickup_longitude = ride_obj.pickup_loc_longitude
-            if pickup_latitude is None or pickup_longitude is None:
-                return Response({"error": "Missing pickup location coordinates"})
-            user_location = Point(float(pickup_longitude), float(pickup_latitude), srid=4326)
-
-            # Query to find nearest drivers, Annotate the queryset with distance to the pickup location
-            drivers = drivers.annotate(
-                distance=Distance(F('driver__location'), user_location)
-            ).order_by('distance')
+        ride_obj = Ride.objects.filter(rider=user).only('pickup_location').last()
+        if ride_obj and ride_obj.pickup_location:
+            # Nearest drivers first, from the spatial index when enabled, shared by nearby riders for a short while
+            pickup = ride_obj.pickup_location
+            drivers = listing_cache.get_or_search(
+                pickup, radius, limit, lambda: find_nearby_drivers(pickup, radius=radius, limit=limit),
+            )
+            # distances and ETAs are measured from this rider's pickup, on copies of the shared cached records
+            drivers = add_driver_etas([dict(record) for record in drivers], pickup)
+            drivers.sort(key=lambda record: record['distance'])
+        else:
+            # without a pickup there is nothing to measure from, any available drivers will do
+            drivers = [listing_record(row) for row in available_drivers().values(*LISTING_FIELDS)[:limit]]
         if drivers:
-            serializer = self.serializer_class(drivers, many=True)
+            serializer = self.listing_serializer_class(drivers, many=True)
             return Response(serializer.data)
         return Response({'message': 'Drivers not found', 'status': status.HTTP_404_NOT_FOUND})
+
+
+def _query_number(request, name, cast, default, maximum, minimum=None):
+    """
+    @param: minimum: smallest accepted value, by default anything greater than 0
+    """
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+    try:
+        value = cast(value)
+    except ValueError:
+        raise ValidationError({name: ["A valid number is required."]})
+    if minimum is None and not 0 < value <= maximum:
+        raise ValidationError({name: [f"Must be greater than 0 and at most {maximum}."]})
+    if minimum is not None and not minimum <= value <= maximum:
+        raise ValidationError({name: [f"Must be at least {minimum} and at most {maximum}."]})
+    return value
+
+
+def _record_driver(record):
+    return record.get('driver') if isinstance(record, dict) else None
+
+
+def _is_newer(record, other):
+    # pings without a timestamp are ordered by their position in the payload
+    if record.get('timestamp') is None or other.get('timestamp') is None:
+        return False
+    return record['timestamp'] > other['timestamp']
+
+
+def metrics(request):
+    """
+    Request metrics of this worker in the Prometheus text format
+    @return: text/plain metrics
+    """
+    allowed = metrics_settings().get('ALLOWED_IPS', ('127.0.0.1', '::1'))
+    if allowed is not None and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,192 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.contrib.gis.geos import Point
+from rest_framework import exceptions
+
+from applications.accounts.authentication import CachedTokenAuthentication
+from applications.accounts.nearby import find_nearby_drivers
+from applications.accounts.pubsub import Area, driver_feed
+
+
+MAX_CELLS = 400
+SNAPSHOT_LIMIT = 100
+
+# application close codes, 4000-4999 are reserved for applications
+CLOSE_UNAUTHORIZED = 4401
+
+
+def scope_token(scope):
+    """
+    Token of a connection, from `?token=` or a `Authorization: Token <key>` header
+    """
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token')
+    if token:
+        return token[0]
+    return header_token(scope)
+
+
+def header_token(scope):
+    """
+    Token of an `Authorization: Token <key>` header, the only one DRF's TokenAuthentication reads
+    """
+    for name, value in scope.get('headers', ()):
+        if name == b'authorization':
+            parts = value.decode().split()
+            if len(parts) == 2 and parts[0].lower() == 'token':
+                return parts[1]
+    return None
+
+
+def parse_area(message):
+    """
+    Subscribed area of a client message, either a viewport `bbox` [min_lon, min_lat, max_lon, max_lat]
+    or a `latitude`, `longitude` and `radius` in metres
+    @return: Area
+    """
+    try:
+        if 'bbox' in message:
+            min_longitude, min_latitude, max_longitude, max_latitude = (float(value) for value in message['bbox'])
+            if min_longitude > max_longitude or min_latitude > max_latitude:
+                raise ValueError
+            area = Area(min_longitude, min_latitude, max_longitude, max_latitude)
+        else:
+            radius = float(message['radius'])
+            if radius <= 0:
+                raise ValueError
+            area = Area.around(float(message['longitude']), float(message['latitude']), radius)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Send a bbox or a latitude, longitude and radius")
+    if not (-180 <= area.min_longitude <= area.max_longitude <= 180
+            and -90 <= area.min_latitude <= area.max_latitude <= 90):
+        raise ValueError("Area out of range")
+    if len(area.cells(driver_feed.cell_size)) > MAX_CELLS:
+        raise ValueError("Area too large")
+    return area
+
+
+def area_snapshot(area):
+    """
+    Available drivers inside an area, nearest to its center first
+    """
+    if area.center is not None:
+        longitude, latitude = area.center
+    else:
+        longitude = (area.min_longitude + area.max_longitude) / 2
+        latitude = (area.min_latitude + area.max_latitude) / 2
+    records = find_nearby_drivers(Point(longitude, latitude, srid=4326), limit=SNAPSHOT_LIMIT)
+    return [
+        {key: record[key] for key in ('driver', 'latitude', 'longitude')}
+        for record in records
+        if record['latitude'] is not None and area.contains(record['longitude'], record['latitude'])
+    ]
+
+
+class DriverPositionsSocket:
+    """
+    WebSocket pushing driver positions inside a subscribed area.
+    After `{"action": "subscribe", ...}` the client gets a `drivers.snapshot` of the drivers in the
+    area followed by `driver.moved` and `driver.removed` deltas as DriverLocation rows change,
+    instead of polling the driver listing. Subscribing again replaces the area.
+    """
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.subscription = None
+        self.area = None
+        self.visible = set()
+        self.pump = None
+        # held while a snapshot is read and sent, deltas wait in the subscription meanwhile
+        self.sending = asyncio.Lock()
+
+    @classmethod
+    async def as_asgi(cls, scope, receive, send):
+        await cls(scope, receive, send).run()
+
+    async def run(self):
+        try:
+            while True:
+                event = await self.receive()
+                if event['type'] == 'websocket.connect':
+                    if not await self.connect():
+                        return
+                elif event['type'] == 'websocket.receive':
+                    await self.receive_message(event.get('text') or (event.get('bytes') or b'').decode())
+                elif event['type'] == 'websocket.disconnect':
+                    return
+        finally:
+            await self.disconnect()
+
+    async def connect(self):
+        key = scope_token(self.scope)
+        try:
+            if key is None:
+                raise exceptions.AuthenticationFailed('Token missing.')
+            await sync_to_async(CachedTokenAuthentication().authenticate_credentials)(key)
+        except exceptions.AuthenticationFailed:
+            await self.send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+            return False
+        await self.send({'type': 'websocket.accept'})
+        return True
+
+    async def disconnect(self):
+        if self.pump is not None:
+            self.pump.cancel()
+        if self.subscription is not None:
+            self.subscription.close()
+
+    async def receive_message(self, text):
+        try:
+            message = json.loads(text)
+            if not isinstance(message, dict) or message.get('action') != 'subscribe':
+                raise ValueError("Unknown action")
+            area = parse_area(message)
+        except ValueError as e:
+            await self.send_json({'type': 'error', 'message': str(e)})
+            return
+
+        if self.subscription is None:
+            self.subscription = driver_feed.broker.subscribe()
+            self.pump = asyncio.ensure_future(self.forward())
+        async with self.sending:
+            # subscribe before reading the snapshot so no change in between is lost, the changes
+            # queued meanwhile are replayed after the snapshot and merged into `visible`
+            self.area = area
+            self.subscription.set_topics(driver_feed.topics(area))
+            drivers = await sync_to_async(area_snapshot)(area)
+            self.visible = {driver['driver'] for driver in drivers}
+            await self.send_json({'type': 'drivers.snapshot', 'drivers': drivers})
+
+    async def forward(self):
+        while True:
+            message = await self.subscription.get()
+            async with self.sending:
+                delta = self.delta(message)
+                if delta is not None:
+                    await self.send_json(delta)
+
+    def delta(self, message):
+        driver = message['driver']
+        inside = (
+            message['is_driver_available'] and message.get('latitude') is not None
+            and self.area.contains(message['longitude'], message['latitude'])
+        )
+        if inside:
+            self.visible.add(driver)
+            return {
+                'type': 'driver.moved',
+                'driver': driver,
+                'latitude': message['latitude'],
+                'longitude': message['longitude'],
+            }
+        if driver in self.visible:
+            self.visible.discard(driver)
+            return {'type': 'driver.removed', 'driver': driver}
+        return None
+
+    async def send_json(self, content):
+        await self.send({'type': 'websocket.send', 'text': json.dumps(content)})
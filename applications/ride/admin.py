@@ -1,7 +1,9 @@
 from django.contrib import admin
 
-from applications.ride.models import Ride, RideRequest
+from applications.ride.models import GeocellCounter, Ride, RideRequest, RideTrackSegment
 
 
 admin.site.register(Ride)
 admin.site.register(RideRequest)
+admin.site.register(RideTrackSegment)
+admin.site.register(GeocellCounter)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RideConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'applications.ride'
+
+    def ready(self):
+        from applications.ride import heatmap, notifier  # noqa: F401
@@ -0,0 +1,236 @@
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from applications.accounts.geocell import EARTH_RADIUS_M, METERS_PER_DEGREE
+from applications.accounts.location_buffer import location_buffer
+from applications.accounts.locations import write_driver_locations
+from applications.accounts.models import DriverLocation
+from applications.accounts.nearby import available_drivers
+from applications.ride.heatmap import rides_taken
+from applications.ride.models import Ride, RideRequest
+
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('greedy', 'hungarian')
+
+# rides measured at once, bounds memory to BLOCK_ROWS x drivers floats
+BLOCK_ROWS = 512
+
+# nearest drivers considered per ride by the greedy strategy
+CANDIDATES_PER_RIDE = 32
+
+
+def dispatch_settings():
+    return getattr(settings, 'RIDE_DISPATCH', {})
+
+
+def haversine_matrix(latitudes_a, longitudes_a, latitudes_b, longitudes_b):
+    """
+    Great-circle distances between every pair of two coordinate arrays
+    @param: coordinates in degrees, arrays of length n and m
+    @return: ndarray: n x m distances in metres
+    """
+    lat_a = np.radians(np.asarray(latitudes_a, dtype=np.float64))[:, None]
+    lon_a = np.radians(np.asarray(longitudes_a, dtype=np.float64))[:, None]
+    lat_b = np.radians(np.asarray(latitudes_b, dtype=np.float64))[None, :]
+    lon_b = np.radians(np.asarray(longitudes_b, dtype=np.float64))[None, :]
+    a = np.sin((lat_b - lat_a) / 2) ** 2 + np.cos(lat_a) * np.cos(lat_b) * np.sin((lon_b - lon_a) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def candidate_edges(rides, drivers, max_distance, per_ride=None):
+    """
+    Ride/driver pairs closer than `max_distance`.
+    Rides are measured in latitude-sorted blocks, each against the drivers of its own latitude
+    band only, so large batches never materialise the full matrix.
+    @param: rides, drivers: ndarray of shape (n, 2) holding (longitude, latitude),
+            per_ride:int keep only this many nearest drivers of each ride
+    @return: tuple of ndarrays: (ride indices, driver indices, distances)
+    """
+    ride_order = np.argsort(rides[:, 1], kind='stable')
+    driver_order = np.argsort(drivers[:, 1], kind='stable')
+    driver_latitudes = drivers[driver_order, 1]
+    reach = max_distance / METERS_PER_DEGREE
+
+    ride_indices, driver_indices, distances = [], [], []
+    for start in range(0, len(rides), BLOCK_ROWS):
+        block = ride_order[start:start + BLOCK_ROWS]
+        low = np.searchsorted(driver_latitudes, rides[block[0], 1] - reach, side='left')
+        high = np.searchsorted(driver_latitudes, rides[block[-1], 1] + reach, side='right')
+        band = driver_order[low:high]
+        if not len(band):
+            continue
+        matrix = haversine_matrix(rides[block, 1], rides[block, 0], drivers[band, 1], drivers[band, 0])
+        if per_ride is not None and per_ride < len(band):
+            columns = np.argpartition(matrix, per_ride - 1, axis=1)[:, :per_ride].ravel()
+            rows = np.repeat(np.arange(len(block)), per_ride)
+            within = matrix[rows, columns] <= max_distance
+            rows, columns = rows[within], columns[within]
+        else:
+            rows, columns = np.nonzero(matrix <= max_distance)
+        ride_indices.append(block[rows])
+        driver_indices.append(band[columns])
+        distances.append(matrix[rows, columns])
+    if not ride_indices:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0)
+    return np.concatenate(ride_indices), np.concatenate(driver_indices), np.concatenate(distances)
+
+
+def match_greedy(rides, drivers, max_distance):
+    """
+    Repeatedly pair the closest remaining ride and driver among the `CANDIDATES_PER_RIDE`
+    nearest drivers of each ride.
+    Not optimal in total distance, but runs in O(E log E) over the candidate pairs only; a ride
+    whose candidates all went to closer rides waits for the next round.
+    @return: list: (ride index, driver index, distance in metres)
+    """
+    ride_indices, driver_indices, distances = candidate_edges(rides, drivers, max_distance, CANDIDATES_PER_RIDE)
+    order = np.argsort(distances, kind='stable')
+    taken_rides, taken_drivers = set(), set()
+    wanted = min(len(rides), len(drivers))
+    matches = []
+    for ride, driver, distance in zip(ride_indices[order].tolist(), driver_indices[order].tolist(),
+                                      distances[order].tolist()):
+        if ride in taken_rides or driver in taken_drivers:
+            continue
+        taken_rides.add(ride)
+        taken_drivers.add(driver)
+        matches.append((ride, driver, distance))
+        if len(matches) == wanted:
+            break
+    return matches
+
+
+def match_hungarian(rides, drivers, max_distance):
+    """
+    Assignment minimising the total pickup distance (Hungarian / Jonker-Volgenant via scipy).
+    Pairs beyond `max_distance` are priced so that they are only chosen when nothing else is
+    left, and dropped afterwards. Needs the dense matrix, so it suits batches of a few thousand.
+    @return: list: (ride index, driver index, distance in metres)
+    """
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:
+        raise ImproperlyConfigured("The hungarian dispatch strategy requires scipy")
+
+    matrix = haversine_matrix(rides[:, 1], rides[:, 0], drivers[:, 1], drivers[:, 0])
+    out_of_reach = matrix > max_distance
+    cost = np.where(out_of_reach, max_distance * len(rides) + 1.0, matrix)
+    ride_indices, driver_indices = linear_sum_assignment(cost)
+    return [
+        (int(ride), int(driver), float(matrix[ride, driver]))
+        for ride, driver in zip(ride_indices, driver_indices)
+        if not out_of_reach[ride, driver]
+    ]
+
+
+MATCHERS = {
+    'greedy': match_greedy,
+    'hungarian': match_hungarian,
+}
+
+
+def pending_rides(limit):
+    """
+    @return: list: (ride id, longitude, latitude) of unassigned rides, oldest first
+    """
+    rides = Ride.objects.filter(
+        Q(status='pending') | Q(status__isnull=True), driver__isnull=True, pickup_location__isnull=False,
+    ).order_by('created', 'id').values_list('id', 'pickup_location')[:limit]
+    return [(ride_id, point.x, point.y) for ride_id, point in rides]
+
+
+def idle_drivers():
+    """
+    @return: list: (user id, DriverLocation id, longitude, latitude) of available drivers,
+             at their database position unless this process buffered a newer ping
+    """
+    drivers = []
+    rows = available_drivers().filter(driver__location__isnull=False).values_list('id', 'driver_id', 'driver__location')
+    for user_id, location_id, point in rows:
+        # the spatial index of a dispatcher process only reloads every REFRESH_SECONDS, it is not newer
+        pending = location_buffer.get(location_id) if location_buffer.enabled else None
+        if pending is not None:
+            point = pending[0]
+        drivers.append((user_id, location_id, point.x, point.y))
+    return drivers
+
+
+def assign(matches):
+    """
+    Write matched pairs back in one transaction.
+    Driver locations are locked first and drivers that went offline meanwhile are skipped, the
+    ride itself is only taken while it is still unassigned, like `accept_ride`.
+    @param: matches:list (ride id, driver user id, DriverLocation id)
+    @return: list: (ride id, driver user id) pairs that were assigned
+    """
+    if not matches:
+        return []
+    now = timezone.now()
+    with transaction.atomic():
+        still_available = set(DriverLocation.objects.select_for_update(skip_locked=True).filter(
+            pk__in=[location_id for ride_id, driver_id, location_id in matches], is_driver_available=True,
+        ).values_list('pk', flat=True))
+        matches = [match for match in matches if match[2] in still_available]
+        if not matches:
+            return []
+
+        values = ', '.join(['(%s, %s)'] * len(matches))
+        params = [value for ride_id, driver_id, location_id in matches for value in (ride_id, driver_id)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {Ride._meta.db_table} AS ride
+                SET driver_id = matched.driver_id, updated = %s
+                FROM (VALUES {values}) AS matched (ride_id, driver_id)
+                WHERE ride.id = matched.ride_id AND ride.driver_id IS NULL
+                  AND (ride.status = 'pending' OR ride.status IS NULL)
+                RETURNING ride.id
+                """,
+                [now] + params,
+            )
+            assigned = {row[0] for row in cursor.fetchall()}
+        matches = [match for match in matches if match[0] in assigned]
+        rides_taken(assigned)
+
+        RideRequest.objects.filter(ride_id__in=assigned, status='pending').update(status='cancelled', updated=now)
+        RideRequest.objects.bulk_create([
+            RideRequest(ride_id=ride_id, driver_id=driver_id, status='success')
+            for ride_id, driver_id, location_id in matches
+        ])
+        write_driver_locations({location_id: (None, False) for ride_id, driver_id, location_id in matches})
+    return [(ride_id, driver_id) for ride_id, driver_id, location_id in matches]
+
+
+def dispatch(strategy=None, max_distance=None, batch_size=None):
+    """
+    Run one dispatch round: match pending rides to idle drivers in batch and assign them
+    @param: strategy:str one of STRATEGIES, max_distance:float metres, batch_size:int rides per round
+    @return: list: (ride id, driver user id) pairs that were assigned
+    """
+    strategy = strategy or dispatch_settings().get('STRATEGY', 'greedy')
+    max_distance = max_distance or dispatch_settings().get('MAX_DISTANCE', 5000)
+    batch_size = batch_size or dispatch_settings().get('BATCH_SIZE', 10000)
+    if strategy not in MATCHERS:
+        raise ValueError(f"Unknown dispatch strategy {strategy}")
+
+    rides = pending_rides(batch_size)
+    if not rides:
+        return []
+    drivers = idle_drivers()
+    if not drivers:
+        return []
+
+    ride_positions = np.array([(longitude, latitude) for ride_id, longitude, latitude in rides])
+    driver_positions = np.array([(longitude, latitude) for user_id, location_id, longitude, latitude in drivers])
+    matches = MATCHERS[strategy](ride_positions, driver_positions, max_distance)
+    assigned = assign([(rides[ride][0], drivers[driver][0], drivers[driver][1]) for ride, driver, distance in matches])
+    logger.info("Dispatched %d of %d pending rides to %d idle drivers", len(assigned), len(rides), len(drivers))
+    return assigned
@@ -0,0 +1,111 @@
+"""
+Server-side travel time estimates.
+
+Every estimate is the haversine distance stretched by `DETOUR_FACTOR`, the straight line being
+shorter than any road, and divided by the speed that `RIDE_ETA['SPEED_PROFILE']` gives for the
+departure hour and the area of the trip. Whole batches are estimated in one NumPy pass.
+"""
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from applications.accounts.geocell import EARTH_RADIUS_M
+
+
+def eta_settings():
+    return getattr(settings, 'RIDE_ETA', {})
+
+
+def haversine_pairs(longitudes_a, latitudes_a, longitudes_b, latitudes_b):
+    """
+    Great-circle distances between the points of two coordinate arrays, pair by pair
+    @param: coordinates in degrees, arrays of the same length
+    @return: ndarray: distances in metres
+    """
+    lat_a = np.radians(latitudes_a)
+    lat_b = np.radians(latitudes_b)
+    a = np.sin((lat_b - lat_a) / 2) ** 2 + \
+        np.cos(lat_a) * np.cos(lat_b) * np.sin(np.radians(longitudes_b - longitudes_a) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def in_hours(hour, hours):
+    start, end = hours
+    # ranges such as (22, 5) run past midnight
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+def speeds(longitudes, latitudes, hour):
+    """
+    Speed of every trip from the profile rules matching the hour and the trip's midpoint,
+    the last matching rule wins
+    @param: longitudes, latitudes: ndarray midpoints in degrees, hour:int local hour of departure
+    @return: ndarray: speeds in km/h
+    """
+    profile = eta_settings()
+    result = np.full(len(longitudes), float(profile.get('DEFAULT_SPEED', 25)))
+    for rule in profile.get('SPEED_PROFILE', ()):
+        if 'hours' in rule and not in_hours(hour, rule['hours']):
+            continue
+        if 'area' in rule:
+            min_longitude, min_latitude, max_longitude, max_latitude = rule['area']
+            mask = (longitudes >= min_longitude) & (longitudes <= max_longitude) & \
+                   (latitudes >= min_latitude) & (latitudes <= max_latitude)
+            result[mask] = rule['speed']
+        else:
+            result[:] = rule['speed']
+    return result
+
+
+def parse_points(points):
+    """
+    Validate request points, ValueError when one is malformed or out of range
+    @param: points:list of {latitude, longitude} dicts
+    @return: ndarray: shape (n, 2) of (longitude, latitude)
+    """
+    if not isinstance(points, list):
+        raise ValueError("Expected a list of {latitude, longitude} points")
+    try:
+        coordinates = np.array(
+            [(float(point['longitude']), float(point['latitude'])) for point in points], dtype=np.float64
+        ).reshape(-1, 2)
+    except (TypeError, KeyError, ValueError):
+        raise ValueError("Every point needs a numeric latitude and longitude")
+    # NaN compares false and is rejected with the out of range values
+    if not (np.all(np.abs(coordinates[:, 0]) <= 180) and np.all(np.abs(coordinates[:, 1]) <= 90)):
+        raise ValueError("Latitudes must be within [-90, 90] and longitudes within [-180, 180]")
+    return coordinates
+
+
+def estimate(origins, destinations, departure=None):
+    """
+    Distances and travel times of many trips
+    @param: origins, destinations: arrays of shape (n, 2) holding (longitude, latitude),
+            departure:datetime defaults to now
+    @return: tuple of ndarrays: (distances in metres, travel times in seconds)
+    """
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+    destinations = np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+    hour = timezone.localtime(departure).hour
+    distances = haversine_pairs(origins[:, 0], origins[:, 1], destinations[:, 0], destinations[:, 1])
+    midpoints = (origins + destinations) / 2
+    metres_per_second = speeds(midpoints[:, 0], midpoints[:, 1], hour) / 3.6
+    seconds = distances * eta_settings().get('DETOUR_FACTOR', 1.3) / metres_per_second
+    return distances, seconds
+
+
+def add_driver_etas(records, point, departure=None):
+    """
+    Set `distance` in metres and `eta_seconds`, how far each listed driver is from `point` and the
+    time they need to reach it
+    @param: records:list of `listing_record` dicts, point:Point pickup
+    @return: list: the same records
+    """
+    located = [record for record in records if record['longitude'] is not None]
+    if located:
+        origins = np.array([(record['longitude'], record['latitude']) for record in located])
+        distances, seconds = estimate(origins, np.array([[point.x, point.y]]).repeat(len(located), 0), departure)
+        for record, distance, eta in zip(located, distances.tolist(), np.rint(seconds).astype(int).tolist()):
+            record['distance'] = distance
+            record['eta_seconds'] = eta
+    return records
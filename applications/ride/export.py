@@ -0,0 +1,91 @@
+import csv
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from applications.ride.models import Ride, RideRequest
+
+
+EXPORTS = {
+    'ride': (Ride, (
+        'id', 'rider_id', 'driver_id', 'pickup_loc_latitude', 'pickup_loc_longitude',
+        'dropoff_loc_latitude', 'dropoff_loc_logitude', 'status', 'ride_review', 'created', 'updated',
+    )),
+    'ride-request': (RideRequest, ('id', 'ride_id', 'driver_id', 'status', 'created', 'updated')),
+}
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CHUNK_SIZE = 2000
+
+
+def parse_bound(value, end=False):
+    """
+    Parse an export date range bound, a date covers the whole day
+    @param: value:str ISO date or datetime, end:bool upper bound
+    @return: aware datetime
+    """
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        moment = datetime.datetime.combine(day, datetime.time.min)
+        if end:
+            moment += datetime.timedelta(days=1)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_rows(model_name, created_from=None, created_to=None, statuses=None, chunk_size=CHUNK_SIZE):
+    """
+    Stream rows of a ride table through a server-side cursor
+    @param: model_name:str key of EXPORTS, created_from/created_to:datetime half-open range,
+            statuses:list of str
+    @return: tuple: (field names, iterator of value tuples)
+    """
+    model, fields = EXPORTS[model_name]
+    queryset = model.objects.order_by('id')
+    if created_from is not None:
+        queryset = queryset.filter(created__gte=created_from)
+    if created_to is not None:
+        queryset = queryset.filter(created__lt=created_to)
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    return fields, queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+
+
+def render_ndjson(fields, rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(fields, row))) + '\n'
+
+
+def render_csv(fields, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([_csv_value(value) for value in row])
+
+
+RENDERERS = {
+    'ndjson': render_ndjson,
+    'csv': render_csv,
+}
+
+
+def _csv_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+class _Echo:
+    # csv.writer target that hands each formatted line back instead of buffering it
+    def write(self, value):
+        return value
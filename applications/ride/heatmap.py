@@ -0,0 +1,263 @@
+"""
+Supply and demand per geocell.
+
+`GeocellCounter` rows hold the pending rides and available drivers of each cell of a
+`HEATMAP['CELL_SIZE']` degree grid. They are never recomputed on read: ride saves move them in
+the same transaction, driver changes right after commit through `driver_locations_changed`, and
+the bulk paths that bypass model saves (`accept_ride`, the dispatcher) report the rides they
+took. `reconcile` rebuilds every counter from the database and reports the drift.
+A ride is pending while it has no driver and its status is pending or unset.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from applications.accounts.geocell import cell_center, cell_for, cell_key
+from applications.accounts.models import DriverLocation
+from applications.accounts.signals import driver_locations_changed
+from applications.ride.models import GeocellCounter, Ride
+
+
+# state of an instance whose stored values are not known, its changes cannot be counted
+UNKNOWN = object()
+
+RIDE_FIELDS = ('status', 'driver_id', 'pickup_location')
+DRIVER_FIELDS = ('is_driver_available', 'location')
+
+
+def heatmap_settings():
+    return getattr(settings, 'HEATMAP', {})
+
+
+def cell_size():
+    return heatmap_settings().get('CELL_SIZE', 0.01)
+
+
+def point_cell(point):
+    return cell_key(cell_for(point.x, point.y, cell_size()))
+
+
+def cell_sql(column):
+    """
+    SQL expression of the cell key of a point column, the same key as `point_cell`
+    @return: tuple: (sql:str, params:list)
+    """
+    size = cell_size()
+    return (
+        f"floor(ST_X({column}::geometry) / %s)::bigint::text || ':' || "
+        f"floor(ST_Y({column}::geometry) / %s)::bigint::text",
+        [size, size],
+    )
+
+
+def ride_cell(values):
+    """
+    @param: values:dict of Ride attribute values
+    @return: str: cell key where the ride counts as pending, None when it does not count, or UNKNOWN
+    """
+    try:
+        status, driver_id, point = values['status'], values['driver_id'], values['pickup_location']
+    except KeyError:
+        return UNKNOWN
+    if status not in ('pending', None) or driver_id is not None or point is None:
+        return None
+    return point_cell(point)
+
+
+def driver_cell(values):
+    """
+    @param: values:dict of DriverLocation attribute values
+    @return: str: cell key where the driver counts as available, None when it does not count, or UNKNOWN
+    """
+    try:
+        available, point = values['is_driver_available'], values['location']
+    except KeyError:
+        return UNKNOWN
+    if not available or point is None:
+        return None
+    return point_cell(point)
+
+
+def apply_deltas(deltas):
+    """
+    Move counters by the given amounts with one upsert, cells locked in key order
+    @param: deltas:dict cell key -> (pending rides delta:int, available drivers delta:int)
+    """
+    rows = sorted((cell, rides, drivers) for cell, (rides, drivers) in deltas.items() if rides or drivers)
+    if not rows:
+        return
+    table = GeocellCounter._meta.db_table
+    now = timezone.now()
+    values = ', '.join(['(%s, %s, %s, %s)'] * len(rows))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} (cell, pending_rides, available_drivers, updated) VALUES {values}
+            ON CONFLICT (cell) DO UPDATE SET
+                pending_rides = {table}.pending_rides + EXCLUDED.pending_rides,
+                available_drivers = {table}.available_drivers + EXCLUDED.available_drivers,
+                updated = EXCLUDED.updated
+            """,
+            [value for row in rows for value in (*row, now)],
+        )
+
+
+def rides_taken(ride_ids):
+    """
+    Count rides out of their cells after a bulk update assigned them a driver
+    @param: ride_ids:iterable of ids of rides that were pending
+    """
+    ride_ids = list(ride_ids)
+    if not ride_ids:
+        return
+    table = GeocellCounter._meta.db_table
+    cell, params = cell_sql('pickup_location')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} (cell, pending_rides, available_drivers, updated)
+            SELECT cell, -count(*), 0, %s FROM (
+                SELECT {cell} AS cell FROM {Ride._meta.db_table}
+                WHERE id = ANY(%s) AND pickup_location IS NOT NULL
+            ) AS taken GROUP BY cell ORDER BY cell
+            ON CONFLICT (cell) DO UPDATE SET
+                pending_rides = {table}.pending_rides + EXCLUDED.pending_rides,
+                updated = EXCLUDED.updated
+            """,
+            [timezone.now()] + params + [ride_ids],
+        )
+
+
+def _move(deltas, old, new, column):
+    if old is UNKNOWN or new is UNKNOWN or old == new:
+        return
+    for cell, amount in ((old, -1), (new, 1)):
+        if cell is not None:
+            delta = deltas.setdefault(cell, [0, 0])
+            delta[column] += amount
+
+
+def _remember(instance, names, cell_of):
+    # the saved values become the stored ones, a later save of the same instance moves from there
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded is None:
+        loaded = instance._loaded_values = {}
+    loaded.update((name, instance.__dict__[name]) for name in names if name in instance.__dict__)
+    return cell_of(loaded)
+
+
+def ride_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = None if created else ride_cell(getattr(instance, '_loaded_values', {}))
+    new = _remember(instance, RIDE_FIELDS, ride_cell)
+    deltas = {}
+    _move(deltas, old, new, 0)
+    apply_deltas(deltas)
+
+
+def ride_deleted(sender, instance, **kwargs):
+    deltas = {}
+    _move(deltas, ride_cell(getattr(instance, '_loaded_values', instance.__dict__)), None, 0)
+    apply_deltas(deltas)
+
+
+def drivers_changed(sender, locations, **kwargs):
+    deltas = {}
+    for location in locations:
+        if location._state.adding:
+            # positions announced before they are written, counted once the write happens
+            continue
+        old = driver_cell(location._loaded_values) if hasattr(location, '_loaded_values') else None
+        _move(deltas, old, _remember(location, DRIVER_FIELDS, driver_cell), 1)
+    apply_deltas(deltas)
+
+
+def driver_deleted(sender, instance, **kwargs):
+    deltas = {}
+    _move(deltas, driver_cell(getattr(instance, '_loaded_values', instance.__dict__)), None, 1)
+    apply_deltas(deltas)
+
+
+post_save.connect(ride_saved, sender=Ride, dispatch_uid='heatmap_ride_saved')
+post_delete.connect(ride_deleted, sender=Ride, dispatch_uid='heatmap_ride_deleted')
+post_delete.connect(driver_deleted, sender=DriverLocation, dispatch_uid='heatmap_driver_deleted')
+driver_locations_changed.connect(drivers_changed, dispatch_uid='heatmap_drivers_changed')
+
+
+def heatmap():
+    """
+    Every non-empty cell
+    @return: list: dicts of cell, longitude, latitude of the cell center, pending_rides, available_drivers
+    """
+    size = cell_size()
+    cells = []
+    for key, pending_rides, available_drivers in GeocellCounter.objects.exclude(
+        pending_rides=0, available_drivers=0
+    ).values_list('cell', 'pending_rides', 'available_drivers').iterator(chunk_size=5000):
+        column, row = key.split(':')
+        longitude, latitude = cell_center((int(column), int(row)), size)
+        cells.append({
+            'cell': key,
+            'longitude': longitude,
+            'latitude': latitude,
+            'pending_rides': pending_rides,
+            'available_drivers': available_drivers,
+        })
+    return cells
+
+
+def actual_counts():
+    """
+    Counters computed from the rides and driver locations tables
+    @return: dict: cell key -> [pending rides, available drivers]
+    """
+    counts = {}
+    for index, column, table, condition in (
+        (0, 'pickup_location', Ride._meta.db_table, "driver_id IS NULL AND (status = 'pending' OR status IS NULL)"),
+        (1, 'location', DriverLocation._meta.db_table, "is_driver_available"),
+    ):
+        cell, params = cell_sql(column)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {cell}, count(*) FROM {table} WHERE {column} IS NOT NULL AND {condition} GROUP BY 1",
+                params,
+            )
+            for key, count in cursor.fetchall():
+                counts.setdefault(key, [0, 0])[index] = count
+    return counts
+
+
+def reconcile(dry_run=False, batch_size=1000):
+    """
+    Rebuild every counter from the database.
+    The counters table is locked while the counts are taken, ride saves wait and are counted on
+    top of the rebuilt values. Driver changes committed during the rebuild may still be counted
+    twice, the next run reports and fixes them.
+    @param: dry_run:bool only report the drift
+    @return: list: (cell, stored pending rides, actual, stored available drivers, actual) of every
+             cell that drifted
+    """
+    table = GeocellCounter._meta.db_table
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+        actual = actual_counts()
+        stored = {
+            key: (rides, drivers)
+            for key, rides, drivers in GeocellCounter.objects.values_list('cell', 'pending_rides', 'available_drivers')
+        }
+        drift = []
+        for key in sorted(set(actual) | set(stored)):
+            rides, drivers = stored.get(key, (0, 0))
+            actual_rides, actual_drivers = actual.get(key, (0, 0))
+            if (rides, drivers) != (actual_rides, actual_drivers):
+                drift.append((key, rides, actual_rides, drivers, actual_drivers))
+        if drift and not dry_run:
+            GeocellCounter.objects.all().delete()
+            GeocellCounter.objects.bulk_create([
+                GeocellCounter(cell=key, pending_rides=rides, available_drivers=drivers)
+                for key, (rides, drivers) in actual.items()
+            ], batch_size=batch_size)
+    return drift
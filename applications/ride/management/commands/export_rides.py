@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from applications.ride.export import EXPORTS, RENDERERS, CHUNK_SIZE, export_rows, parse_bound
+
+
+class Command(BaseCommand):
+    help = "Stream rides or ride requests as NDJSON or CSV with constant memory use"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=sorted(EXPORTS), default='ride')
+        parser.add_argument('--format', dest='output_format', choices=sorted(RENDERERS), default='ndjson')
+        parser.add_argument('--from', dest='created_from', help="ISO date or datetime, inclusive")
+        parser.add_argument('--to', dest='created_to', help="ISO date or datetime, exclusive; a date includes that day")
+        parser.add_argument('--status', action='append', help="Repeat to export several statuses")
+        parser.add_argument('--output', help="File to write, defaults to stdout")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            created_from = parse_bound(options['created_from']) if options['created_from'] else None
+            created_to = parse_bound(options['created_to'], end=True) if options['created_to'] else None
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        fields, rows = export_rows(options['model'], created_from, created_to, options['status'],
+                                   chunk_size=options['chunk_size'])
+        lines = RENDERERS[options['output_format']](fields, rows)
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from applications.ride.heatmap import reconcile
+
+
+class Command(BaseCommand):
+    help = "Rebuild the geocell supply/demand counters from the database and report the drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report the drift")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        drift = reconcile(dry_run=options['dry_run'], batch_size=options['batch_size'])
+        for cell, rides, actual_rides, drivers, actual_drivers in drift:
+            self.stdout.write(
+                f"{cell}: pending rides {rides} -> {actual_rides}, available drivers {drivers} -> {actual_drivers}"
+            )
+        action = "found" if options['dry_run'] else "fixed"
+        self.stdout.write(f"Drift {action} in {len(drift)} cells")
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from applications.ride.dispatch import STRATEGIES, dispatch, dispatch_settings
+
+
+class Command(BaseCommand):
+    help = "Match pending rides to available drivers in batch, once or every --interval seconds"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=dispatch_settings().get('INTERVAL', 5.0))
+        parser.add_argument('--once', action='store_true', help="Run a single round and exit")
+        parser.add_argument('--strategy', choices=STRATEGIES, default=dispatch_settings().get('STRATEGY', 'greedy'))
+        parser.add_argument('--max-distance', type=float, help="Metres, defaults to RIDE_DISPATCH['MAX_DISTANCE']")
+        parser.add_argument('--batch-size', type=int, help="Rides per round, defaults to RIDE_DISPATCH['BATCH_SIZE']")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            started = time.monotonic()
+            assigned = dispatch(options['strategy'], options['max_distance'], options['batch_size'])
+            if assigned or options['verbosity'] > 1:
+                self.stdout.write(f"Assigned {len(assigned)} rides in {time.monotonic() - started:.3f}s")
+            if options['once']:
+                return
+            time.sleep(max(0.0, options['interval'] - (time.monotonic() - started)))
@@ -0,0 +1,24 @@
+# Generated by Django 3.2 on 2026-10-18 07:47
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ride', '0003_auto_20231021_1944'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='dropoff_location',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, geography=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='ride',
+            name='pickup_location',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, geography=True, null=True, srid=4326),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2 on 2026-10-18 07:48
+
+from django.contrib.gis.geos import Point
+from django.db import migrations, transaction
+
+
+BATCH_SIZE = 2000
+
+
+def to_point(longitude, latitude):
+    if longitude in (None, '') or latitude in (None, ''):
+        return None
+    try:
+        return Point(float(longitude), float(latitude), srid=4326)
+    except (TypeError, ValueError):
+        return None
+
+
+def populate_locations(apps, schema_editor):
+    """
+    Convert the text pickup/dropoff coordinates into points, one short transaction per batch
+    so that no lock on the ride table is held for the whole backfill
+    """
+    Ride = apps.get_model('ride', 'Ride')
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            rides = list(
+                Ride.objects.filter(pk__gt=last_id).order_by('pk').only(
+                    'pk', 'pickup_loc_latitude', 'pickup_loc_longitude',
+                    'dropoff_loc_latitude', 'dropoff_loc_logitude',
+                )[:BATCH_SIZE]
+            )
+            if not rides:
+                return
+            for ride in rides:
+                ride.pickup_location = to_point(ride.pickup_loc_longitude, ride.pickup_loc_latitude)
+                ride.dropoff_location = to_point(ride.dropoff_loc_logitude, ride.dropoff_loc_latitude)
+            Ride.objects.bulk_update(rides, ['pickup_location', 'dropoff_location'])
+        last_id = rides[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('ride', '0004_ride_pickup_dropoff_location'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_locations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2 on 2026-10-18 07:50
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # build the indexes without blocking writes to the ride tables
+    atomic = False
+
+    dependencies = [
+        ('ride', '0005_populate_ride_locations'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='ride',
+            index=models.Index(fields=['rider', '-created', '-id'], name='ride_rider_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='ride',
+            index=models.Index(fields=['driver', '-created', '-id'], name='ride_driver_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='ride',
+            index=models.Index(fields=['-created', '-id'], name='ride_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='riderequest',
+            index=models.Index(fields=['driver', '-created', '-id'], name='riderequest_driver_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='riderequest',
+            index=models.Index(fields=['ride', '-created', '-id'], name='riderequest_ride_created_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2 on 2026-10-18 07:56
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ride', '0006_ride_created_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RideTrackSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField()),
+                ('points', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), size=None)),
+                ('offsets', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('ride', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='track_segments', to='ride.ride')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ridetracksegment',
+            index=models.Index(fields=['ride', 'started'], name='ridetrack_ride_started_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2 on 2026-10-18 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ride', '0007_ride_track_segment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocellCounter',
+            fields=[
+                ('cell', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('pending_rides', models.IntegerField(default=0)),
+                ('available_drivers', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-18 08:16
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # build the index without blocking writes to the ride request table
+    atomic = False
+
+    dependencies = [
+        ('ride', '0008_geocell_counter'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='riderequest',
+            index=models.Index(fields=['driver', 'status', 'created', 'id'], name='riderequest_inbox_idx'),
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.contrib.gis.db import models
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.gis.geos import Point
 
 from applications.accounts.models import User
 
@@ -17,15 +19,58 @@ class Ride(models.Model):
     pickup_loc_longitude = models.CharField(max_length=255, null=True, blank=True)
     dropoff_loc_latitude = models.CharField(max_length=255, null=True, blank=True)
     dropoff_loc_logitude = models.CharField(max_length=255, null=True, blank=True)
+    pickup_location = models.PointField(null=True, blank=True, geography=True)
+    dropoff_location = models.PointField(null=True, blank=True, geography=True)
     current_location = models.PointField(null=True, blank=True)
     status = models.CharField(max_length=60, null=True, blank=True, choices=STATUSES)
     ride_review = models.CharField(max_length=255, null=True, blank=True)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['rider', '-created', '-id'], name='ride_rider_created_idx'),
+            models.Index(fields=['driver', '-created', '-id'], name='ride_driver_created_idx'),
+            models.Index(fields=['-created', '-id'], name='ride_created_idx'),
+        ]
+
     def __str__(self):
         return self.rider.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # stored values, saves move the heatmap counters by the difference, see applications/ride/heatmap.py
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.sync_locations()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'pickup_location', 'dropoff_location'}
+        super().save(*args, **kwargs)
+
+    def sync_locations(self):
+        """
+        Keep the indexed pickup/dropoff points in step with the legacy lat/lon text fields
+        """
+        self.pickup_location = coordinates_to_point(self.pickup_loc_longitude, self.pickup_loc_latitude)
+        self.dropoff_location = coordinates_to_point(self.dropoff_loc_logitude, self.dropoff_loc_latitude)
+
+
+def coordinates_to_point(longitude, latitude):
+    """
+    Build a WGS84 point from text coordinates
+    @return: Point or None when either coordinate is missing or not a number
+    """
+    if longitude in (None, '') or latitude in (None, ''):
+        return None
+    try:
+        return Point(float(longitude), float(latitude), srid=4326)
+    except (TypeError, ValueError):
+        return None
+
 
 class RideRequest(models.Model):
     STATUSES = (
@@ -39,5 +84,49 @@ class RideRequest(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['driver', '-created', '-id'], name='riderequest_driver_created_idx'),
+            models.Index(fields=['ride', '-created', '-id'], name='riderequest_ride_created_idx'),
+            models.Index(fields=['driver', 'status', 'created', 'id'], name='riderequest_inbox_idx'),
+        ]
+
     def __str__(self):
         return self.ride.rider.username
+
+
+class GeocellCounter(models.Model):
+    """
+    Pending rides and available drivers in one geocell, moved by deltas as rides and drivers
+    change and rebuilt by the reconcile_heatmap command
+    """
+    cell = models.CharField(max_length=32, primary_key=True)
+    pending_rides = models.IntegerField(default=0)
+    available_drivers = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.cell}: {self.pending_rides} rides, {self.available_drivers} drivers"
+
+
+class RideTrackSegment(models.Model):
+    """
+    A chunk of a ride's GPS track, stored as arrays instead of one row per ping.
+    `points` holds flattened longitude/latitude pairs and `offsets` the milliseconds of each
+    point since `started`.
+    """
+    ride = models.ForeignKey(Ride, on_delete=models.CASCADE, related_name='track_segments')
+    started = models.DateTimeField()
+    points = ArrayField(models.FloatField())
+    offsets = ArrayField(models.IntegerField())
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ride', 'started'], name='ridetrack_ride_started_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.ride_id} @ {self.started}"
+
+    def __len__(self):
+        return len(self.offsets)
@@ -0,0 +1,259 @@
+"""
+Driver inbox of pending ride requests, long-polled.
+
+The inbox answers with every pending request of a driver, oldest first, and a `cursor` that
+fingerprints that list. A poll carrying the current cursor waits until the list changes, so
+requests committed out of id order are never skipped, and the client replaces its list with
+each answer.
+
+A pending ride request sent to a driver bumps that driver's version once its transaction
+commits; polls waiting in this worker for the driver then re-read the database instead of
+polling it on a timer. Bulk inserts send no signals, their callers report the drivers they
+notified. Waiters in other worker processes are not woken, `RIDE_INBOX['RECHECK_INTERVAL']`
+bounds how late they see a new request, and also how late cancelled requests drop out.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models.signals import post_save
+
+from applications.api.metrics import registry as metrics_registry
+from applications.ride.models import RideRequest
+
+
+def inbox_settings():
+    return getattr(settings, 'RIDE_INBOX', {})
+
+
+class RideRequestNotifier:
+    """
+    Per-driver versions plus the threads and event loop futures waiting on them, all under one
+    lock, so a notification only wakes the waiters of its own drivers.
+    Read `version` before querying the inbox and pass it to `wait`: a request committed in
+    between has already moved the version and the wait returns at once.
+    Blocking waits hold a worker thread, `acquire_slot` bounds how many a worker lets wait.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._conditions = {}
+        self._thread_waiters = {}
+        self._futures = {}
+        self._slots = 0
+        self.notifications = 0
+        self.wakeups = 0
+        self.timeouts = 0
+        self.busy = 0
+
+    def version(self, driver_id):
+        with self._lock:
+            return self._versions.get(driver_id, 0)
+
+    def notify(self, driver_ids):
+        """
+        @param: driver_ids:iterable of user ids that received a pending ride request
+        """
+        with self._lock:
+            for driver_id in set(driver_ids):
+                self._versions[driver_id] = self._versions.get(driver_id, 0) + 1
+                self.notifications += 1
+                condition = self._conditions.get(driver_id)
+                if condition is not None:
+                    condition.notify_all()
+                for loop, future in self._futures.get(driver_id, ()):
+                    try:
+                        loop.call_soon_threadsafe(_resolve, future)
+                    except RuntimeError:
+                        # the waiter's loop is gone, nobody reads the answer
+                        pass
+
+    def wait(self, driver_id, version, timeout):
+        """
+        Block until the driver's version moves past `version` or `timeout` seconds pass
+        @param: driver_id:int, version:int from `version`, timeout:float seconds
+        @return: bool: True when notified
+        """
+        with self._lock:
+            condition = self._conditions.get(driver_id)
+            if condition is None:
+                condition = self._conditions[driver_id] = threading.Condition(self._lock)
+            self._thread_waiters[driver_id] = self._thread_waiters.get(driver_id, 0) + 1
+            try:
+                notified = condition.wait_for(lambda: self._versions.get(driver_id, 0) != version, timeout)
+            finally:
+                self._thread_waiters[driver_id] -= 1
+                if not self._thread_waiters[driver_id]:
+                    del self._thread_waiters[driver_id]
+                    del self._conditions[driver_id]
+            self._count(notified)
+            return notified
+
+    async def wait_async(self, driver_id, version, timeout):
+        """
+        `wait` for an event loop, without holding a thread
+        @return: bool: True when notified
+        """
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._lock:
+            if self._versions.get(driver_id, 0) != version:
+                self._count(True)
+                return True
+            self._futures.setdefault(driver_id, set()).add(waiter)
+        notified = False
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+            notified = True
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._futures[driver_id].discard(waiter)
+                if not self._futures[driver_id]:
+                    del self._futures[driver_id]
+                self._count(notified)
+        return notified
+
+    def acquire_slot(self, limit):
+        """
+        Reserve one of the `limit` blocking waits of this worker
+        @return: bool: False when all are taken, the caller should turn the request away
+        """
+        with self._lock:
+            if self._slots >= limit:
+                self.busy += 1
+                return False
+            self._slots += 1
+            return True
+
+    def release_slot(self):
+        with self._lock:
+            self._slots -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'waiting': sum(self._thread_waiters.values()) + sum(map(len, self._futures.values())),
+                'notifications': self.notifications,
+                'wakeups': self.wakeups,
+                'timeouts': self.timeouts,
+                'busy': self.busy,
+            }
+
+    def _count(self, notified):
+        if notified:
+            self.wakeups += 1
+        else:
+            self.timeouts += 1
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+notifier = RideRequestNotifier()
+
+
+def notify_on_commit(driver_ids, using=None):
+    """
+    Wake the drivers' inbox waiters once the current transaction commits
+    @param: driver_ids:list of user ids, using:str database alias
+    """
+    driver_ids = [driver_id for driver_id in driver_ids if driver_id is not None]
+    if driver_ids:
+        transaction.on_commit(lambda: notifier.notify(driver_ids), using=using)
+
+
+def pending_requests(driver_id):
+    """
+    The driver's pending ride requests, oldest first, at most `RIDE_INBOX['LIMIT']`.
+    Read from the primary: the notifier fires once the primary commits, a lagging replica
+    could still miss the request.
+    @return: tuple: (list of RideRequest, cursor:str)
+    """
+    requests = list(RideRequest.objects.db_manager(router.db_for_write(RideRequest)).filter(
+        driver_id=driver_id, status='pending',
+    ).order_by('created', 'id')[:inbox_settings().get('LIMIT', 50)])
+    digest = hashlib.sha1(','.join(str(ride_request.pk) for ride_request in requests).encode())
+    return requests, digest.hexdigest()[:16]
+
+
+def release_connection():
+    # a pooled connection is not held while waiting
+    connection = connections[router.db_for_write(RideRequest)]
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+def poll(driver_id, cursor, timeout):
+    """
+    The driver's inbox, once it differs from `cursor` or after `timeout` seconds.
+    Blocks the calling thread while waiting.
+    @param: driver_id:int, cursor:str from a previous answer or None, timeout:float seconds
+    @return: tuple: (list of RideRequest, cursor:str)
+    """
+    deadline = time.monotonic() + timeout
+    recheck = inbox_settings().get('RECHECK_INTERVAL', 5)
+    while True:
+        version = notifier.version(driver_id)
+        requests, current = pending_requests(driver_id)
+        remaining = deadline - time.monotonic()
+        if current != cursor or remaining <= 0:
+            return requests, current
+        release_connection()
+        notifier.wait(driver_id, version, min(remaining, recheck))
+
+
+def _pending_requests_released(driver_id):
+    try:
+        return pending_requests(driver_id)
+    finally:
+        release_connection()
+
+
+async def poll_async(driver_id, cursor, timeout):
+    """
+    `poll` for an event loop: queries run on a thread that is released while waiting
+    """
+    deadline = time.monotonic() + timeout
+    recheck = inbox_settings().get('RECHECK_INTERVAL', 5)
+    while True:
+        version = notifier.version(driver_id)
+        requests, current = await sync_to_async(_pending_requests_released, thread_sensitive=False)(driver_id)
+        remaining = deadline - time.monotonic()
+        if current != cursor or remaining <= 0:
+            return requests, current
+        await notifier.wait_async(driver_id, version, min(remaining, recheck))
+
+
+def notifier_metrics():
+    stats = notifier.stats()
+    lines = []
+    for name, kind, help_text in (
+        ('waiting', 'gauge', 'Inbox requests waiting for a ride request.'),
+        ('notifications', 'counter', 'Drivers notified of a pending ride request.'),
+        ('wakeups', 'counter', 'Inbox waits ended by a notification.'),
+        ('timeouts', 'counter', 'Inbox waits that timed out.'),
+        ('busy', 'counter', 'Inbox requests turned away because every waiting thread was taken.'),
+    ):
+        metric = f'rider_inbox_{name}' + ('_total' if kind == 'counter' else '')
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {kind}', f'{metric} {stats[name]}']
+    return lines
+
+
+metrics_registry.add_collector(notifier_metrics)
+
+
+def notify_pending_request(sender, instance, using, **kwargs):
+    if instance.status == 'pending':
+        notify_on_commit([instance.driver_id], using=using)
+
+
+post_save.connect(notify_pending_request, sender=RideRequest, dispatch_uid='ride_request_inbox_notify')
@@ -0,0 +1,96 @@
+import math
+
+from applications.accounts.geocell import METERS_PER_DEGREE
+
+
+def encode(points, precision=5):
+    """
+    Encode coordinates with Google's encoded polyline algorithm
+    @param: points:iterable (longitude, latitude), precision:int decimal places kept
+    @return: str: encoded polyline, latitude first as the format expects
+    """
+    factor = 10 ** precision
+    chunks = []
+    previous_latitude = previous_longitude = 0
+    for longitude, latitude in points:
+        latitude, longitude = round(latitude * factor), round(longitude * factor)
+        _encode_value(latitude - previous_latitude, chunks)
+        _encode_value(longitude - previous_longitude, chunks)
+        previous_latitude, previous_longitude = latitude, longitude
+    return ''.join(chunks)
+
+
+def _encode_value(value, chunks):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+
+
+def decode(polyline, precision=5):
+    """
+    @return: list: (longitude, latitude) of an encoded polyline
+    """
+    factor = 10 ** precision
+    points = []
+    index = latitude = longitude = 0
+    while index < len(polyline):
+        d_latitude, index = _decode_value(polyline, index)
+        d_longitude, index = _decode_value(polyline, index)
+        latitude += d_latitude
+        longitude += d_longitude
+        points.append((longitude / factor, latitude / factor))
+    return points
+
+
+def _decode_value(polyline, index):
+    result = shift = 0
+    while True:
+        byte = ord(polyline[index]) - 63
+        index += 1
+        result |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            break
+    return (~(result >> 1) if result & 1 else result >> 1), index
+
+
+def simplify(points, tolerance):
+    """
+    Douglas-Peucker simplification, dropping points closer than `tolerance` metres to the line
+    through their neighbours. Distances use an equirectangular projection, exact enough for the
+    extent of a single ride.
+    @param: points:list (longitude, latitude), tolerance:float metres
+    @return: list: the kept points, first and last always included
+    """
+    if len(points) < 3 or tolerance <= 0:
+        return list(points)
+    scale = math.cos(math.radians(sum(latitude for longitude, latitude in points) / len(points)))
+    projected = [(longitude * METERS_PER_DEGREE * scale, latitude * METERS_PER_DEGREE)
+                 for longitude, latitude in points]
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    # explicit stack, long tracks would exceed the recursion limit
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, distance = None, tolerance
+        for index in range(first + 1, last):
+            offset = _segment_distance(projected[index], projected[first], projected[last])
+            if offset > distance:
+                farthest, distance = index, offset
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def _segment_distance(point, start, end):
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    if dx == 0 and dy == 0:
+        return math.hypot(point[0] - start[0], point[1] - start[1])
+    t = max(0.0, min(1.0, ((point[0] - start[0]) * dx + (point[1] - start[1]) * dy) / (dx * dx + dy * dy)))
+    return math.hypot(point[0] - start[0] - t * dx, point[1] - start[1] - t * dy)
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from applications.accounts.nearby import find_nearby_drivers
+from applications.ride.heatmap import rides_taken
+from applications.ride.models import Ride, RideRequest
+from applications.ride.notifier import notify_on_commit
+
+
+def accept_ride(ride_request, driver):
+    """
+    Assign `driver` to the ride of `ride_request` unless another driver got there first.
+    The assignment is a single conditional UPDATE, so concurrent acceptances cannot overwrite
+    each other; the winner's request is marked successful and the competing pending requests
+    for the ride are cancelled in bulk.
+    @param: ride_request:RideRequest, driver:User
+    @return: bool: True when this driver won the ride
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        won = Ride.objects.filter(
+            Q(status='pending') | Q(status__isnull=True), pk=ride_request.ride_id, driver__isnull=True,
+        ).update(driver=driver, updated=now)
+        if not won:
+            return False
+        rides_taken([ride_request.ride_id])
+        RideRequest.objects.filter(pk=ride_request.pk).update(status='success', updated=now)
+        RideRequest.objects.filter(ride_id=ride_request.ride_id, status='pending').exclude(
+            pk=ride_request.pk
+        ).update(status='cancelled', updated=now)
+    return True
+
+
+def fanout_settings():
+    return getattr(settings, 'RIDE_FANOUT', {})
+
+
+def notify_nearest_drivers(ride, count):
+    """
+    Send a ride to the `count` nearest available drivers with one bulk insert of pending
+    ride requests, inside the caller's transaction
+    @param: ride:Ride, count:int
+    @return: list: user ids of the notified drivers, nearest first
+    """
+    if ride.pickup_location is None:
+        return []
+    # one more than needed, the rider may be an available driver too
+    drivers = find_nearby_drivers(ride.pickup_location, radius=fanout_settings().get('RADIUS', 5000), limit=count + 1)
+    driver_ids = [record['id'] for record in drivers if record['id'] != ride.rider_id][:count]
+    RideRequest.objects.bulk_create([
+        RideRequest(ride=ride, driver_id=driver_id, status='pending') for driver_id in driver_ids
+    ])
+    # bulk inserts skip post_save, the inbox waiters are woken here
+    notify_on_commit(driver_ids)
+    return driver_ids
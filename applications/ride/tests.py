@@ -1,14 +1,47 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import json
+import threading
+import time
+from unittest import mock, skipUnless
+
+import numpy as np
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.core.cache import caches
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.contrib.gis.geos import Point
+from django.utils import timezone
 
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 from rest_framework import status
 
-from .models import Ride, RideRequest
+from .models import GeocellCounter, Ride, RideRequest, RideTrackSegment
+from .dispatch import dispatch, idle_drivers, match_greedy
+from .eta import estimate
+from .heatmap import reconcile
+from .notifier import RideRequestNotifier
+from .polyline import decode, encode, simplify
+from .tracks import ride_track, track_buffer
+from .services import accept_ride
+from applications.api.listing_cache import listing_cache
+from applications.api.renderers import MessagePackRenderer, ORJSONRenderer
+from applications.api.metrics import MetricsRegistry, registry as metrics_registry
 from applications.api.serializers import RideSerializer, RideRequestSerializer, DriverLocationSerializer, \
     UserListingSerializer
+from applications.accounts.location_buffer import location_buffer
 from applications.accounts.models import User, DriverLocation
+from applications.accounts.signals import driver_locations_changed
+from applications.accounts.spatial_index import driver_index
+from rider.backends.postgis_pool.pool import ConnectionPool, PoolTimeout
+from rider.db_router import ReplicaRouter, ReplicaRoutingMiddleware, pins
 
 
 # tests for ride models
@@ -41,6 +74,19 @@ class RideModelTest(TestCase):
         ride = Ride.objects.create(rider=self.rider, status="pending")
         self.assertEqual(str(ride), "rider")
 
+    def test_ride_locations_from_coordinates(self):
+        ride = Ride.objects.create(
+            rider=self.rider,
+            pickup_loc_latitude="12.34",
+            pickup_loc_longitude="56.78",
+            dropoff_loc_latitude="not a number",
+            dropoff_loc_logitude="78.12",
+        )
+        ride.refresh_from_db()
+        self.assertAlmostEqual(ride.pickup_location.x, 56.78)
+        self.assertAlmostEqual(ride.pickup_location.y, 12.34)
+        self.assertIsNone(ride.dropoff_location)
+
 
 class RideRequestModelTest(TestCase):
     def setUp(self):
@@ -103,11 +149,323 @@ class RideViewTest(TestCase):
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_create_ride_invalid_coordinates(self):
+        url = '/api/ride/'
+        data = {
+            "pickup_loc_latitude": 123.4,
+            "pickup_loc_longitude": 56.78,
+        }
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('pickup_loc_latitude', response.data)
+
+    def test_create_ride_notifies_nearest_drivers(self):
+        driver_index.clear()
+        drivers = {}
+        for username, longitude in (("far", 77.62), ("near", 77.60), ("nearer", 77.595)):
+            location = DriverLocation.objects.create(location=Point(longitude, 12.97, srid=4326))
+            drivers[username] = User.objects.create_user(username=username, password="driverpassword",
+                                                         user_role="driver", driver=location)
+        response = self.client.post('/api/ride/', {
+            "pickup_loc_latitude": 12.97, "pickup_loc_longitude": 77.59, "status": "pending", "notify_drivers": 2,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['notified_drivers'], [drivers["nearer"].pk, drivers["near"].pk])
+        self.assertEqual(
+            sorted(RideRequest.objects.filter(ride_id=response.data['id'], status='pending')
+                   .values_list('driver_id', flat=True)),
+            sorted([drivers["nearer"].pk, drivers["near"].pk]),
+        )
+
+    def test_rider_who_drives_is_not_counted_in_fanout(self):
+        driver_index.clear()
+        self.rider.driver = DriverLocation.objects.create(location=Point(77.59, 12.97, srid=4326))
+        self.rider.user_role = "driver"
+        self.rider.save()
+        drivers = []
+        for username, longitude in (("near", 77.60), ("far", 77.62)):
+            location = DriverLocation.objects.create(location=Point(longitude, 12.97, srid=4326))
+            drivers.append(User.objects.create_user(username=username, password="driverpassword",
+                                                    user_role="driver", driver=location).pk)
+        data = {"pickup_loc_latitude": 12.97, "pickup_loc_longitude": 77.59, "status": "pending"}
+        response = self.client.post('/api/ride/', {**data, "notify_drivers": 2}, format='json')
+        self.assertEqual(response.data['notified_drivers'], drivers)
+        response = self.client.post('/api/ride/', {**data, "notify_drivers": 11}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_list_rides(self):
         url = '/api/ride/'
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_list_rides_scoped_and_paginated(self):
+        other = User.objects.create_user(username="other@gmail.com", password="otherpassword")
+        Ride.objects.create(rider=other, status="pending")
+        own = [Ride.objects.create(rider=self.rider, status="pending") for _ in range(3)]
+
+        first = self.client.get('/api/ride/', {'page_size': 2})
+        self.assertEqual([ride['id'] for ride in first.data['results']], [own[2].id, own[1].id])
+        second = self.client.get(first.data['next'])
+        self.assertEqual([ride['id'] for ride in second.data['results']], [own[0].id])
+        self.assertIsNone(second.data['next'])
+
+    def test_list_rides_merges_ridden_and_driven_rides(self):
+        other = User.objects.create_user(username="other@gmail.com", password="otherpassword")
+        rides = [
+            Ride.objects.create(rider=self.rider, status="pending"),
+            Ride.objects.create(rider=other, driver=self.rider, status="running"),
+            Ride.objects.create(rider=self.rider, driver=self.rider, status="running"),
+            Ride.objects.create(rider=other, driver=self.rider, status="running"),
+        ]
+        Ride.objects.create(rider=other, status="pending")
+
+        first = self.client.get('/api/ride/', {'page_size': 3})
+        self.assertEqual([ride['id'] for ride in first.data['results']], [rides[3].id, rides[2].id, rides[1].id])
+        second = self.client.get(first.data['next'])
+        self.assertEqual([ride['id'] for ride in second.data['results']], [rides[0].id])
+        self.assertIsNone(second.data['next'])
+
+
+class RideTrackTest(TestCase):
+    def setUp(self):
+        track_buffer.flush()
+        self.client = APIClient()
+        self.rider = User.objects.create_user(username="rider", password="riderpassword")
+        self.driver = User.objects.create_user(username="driver", password="driverpassword", user_role="driver")
+        self.ride = Ride.objects.create(rider=self.rider, driver=self.driver, status="running")
+
+    def test_polyline_round_trip(self):
+        points = [(-120.2, 38.5), (-120.95, 40.7), (-126.453, 43.252)]
+        self.assertEqual(encode(points), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(decode(encode(points)), points)
+
+    def test_simplify_drops_collinear_points(self):
+        line = [(77.59 + i * 0.0001, 12.97) for i in range(100)] + [(77.60, 12.98)]
+        self.assertEqual(simplify(line, 1), [line[0], line[99], line[100]])
+
+    def test_track_is_appended_in_segments(self):
+        url = f'/api/ride/{self.ride.id}/track/'
+        points = [{'latitude': 12.97 + i * 0.001, 'longitude': 77.59} for i in range(5)]
+        self.client.force_authenticate(user=self.driver)
+        response = self.client.post(url, {'points': points}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.patch(f'/api/ride/{self.ride.id}/', {'current_location': 'POINT(77.59 12.98)'}, format='json')
+        track_buffer.flush()
+        self.assertEqual(RideTrackSegment.objects.filter(ride=self.ride).count(), 1)
+
+        self.client.force_authenticate(user=self.rider)
+        response = self.client.get(url)
+        self.assertEqual(response.data['points'], 6)
+        self.assertEqual(decode(response.data['polyline'])[-1], (77.59, 12.98))
+        self.assertEqual(self.client.get(url, {'tolerance': 5}).data['points'], 2)
+        self.assertEqual(self.client.post(url, {'points': points}, format='json').status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+    def test_flushes_fill_the_open_segment(self):
+        start = timezone.now()
+        track = {'FLUSH_INTERVAL': 60, 'FLUSH_SIZE': 1000, 'SEGMENT_POINTS': 8, 'MAX_TOLERANCE': 1000}
+        with self.settings(RIDE_TRACK=track):
+            for flush in range(2):
+                for i in range(5):
+                    track_buffer.append(self.ride.pk, 77.59, 12.97 + i * 0.001,
+                                        start + datetime.timedelta(seconds=flush * 5 + i))
+                track_buffer.flush()
+        segments = list(RideTrackSegment.objects.filter(ride=self.ride).order_by('started'))
+        self.assertEqual([len(segment) for segment in segments], [8, 2])
+        self.assertEqual(segments[0].offsets, [0, 1000, 2000, 3000, 4000, 5000, 6000, 7000])
+        self.assertEqual(len(ride_track(self.ride.pk)), 10)
+
+
+class RequestMetricsTest(TestCase):
+    def test_registry_merges_thread_shards(self):
+        registry = MetricsRegistry(buckets=(0.1, 1.0))
+        threads = [threading.Thread(target=registry.record, args=('ride-list', 'GET', 200, 0.05, 2))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        registry.record('ride-list', 'GET', 500, 0.5)
+        stats = registry.snapshot()[('ride-list', 'GET')]
+        self.assertEqual(stats.statuses, {200: 4, 500: 1})
+        self.assertEqual(stats.buckets, [4, 1])
+        self.assertEqual(stats.queries, 8)
+
+    def test_metrics_endpoint(self):
+        metrics_registry.clear()
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user(username="rider", password="riderpassword"))
+        client.get('/api/ride/')
+        response = client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn('rider_http_requests_total{route="ride-list",method="GET",status="200"} 1', body)
+        self.assertIn('rider_db_queries_total{route="ride-list",method="GET"}', body)
+        self.assertNotIn('route="metrics"', body)
+        self.assertEqual(client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ResponseEncodingTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.rider = User.objects.create_user(username="rider", password="riderpassword")
+        self.client.force_authenticate(user=self.rider)
+        for _ in range(20):
+            Ride.objects.create(rider=self.rider, status="pending", pickup_loc_latitude="12.97",
+                                pickup_loc_longitude="77.59")
+
+    def test_renderer_negotiation(self):
+        response = self.client.get('/api/ride/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(len(json.loads(response.content)['results']), 20)
+
+        with mock.patch.object(MessagePackRenderer, 'available', False):
+            response = self.client.get('/api/ride/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+
+    @skipUnless(MessagePackRenderer.available, "msgpack is not installed")
+    def test_msgpack_responses(self):
+        import msgpack
+
+        response = self.client.get('/api/ride/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), json.loads(self.client.get('/api/ride/').content))
+
+    def test_orjson_renderer_matches_strict_json(self):
+        renderer = ORJSONRenderer()
+        with self.assertRaises(ValueError):
+            renderer.render({'distance': float('nan')})
+        data = {'ride': 1, 'eta_seconds': None, 'note': 'a\u2028b'}
+        self.assertEqual(renderer.render(data), JSONRenderer().render(data))
+        self.assertEqual(renderer.render(data, 'application/json; indent=4'),
+                         JSONRenderer().render(data, 'application/json; indent=4'))
+
+    @override_settings(RESPONSE_COMPRESSION={'MIN_SIZE': 1024, 'GZIP_LEVEL': 6})
+    def test_large_responses_are_compressed(self):
+        response = self.client.get('/api/ride/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))['results']), 20)
+
+        small = self.client.get('/api/ride/', {'page_size': 1}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(small.has_header('Content-Encoding'))
+
+
+class FakeConnection:
+    closed = 0
+    autocommit = True
+
+    def get_transaction_status(self):
+        return 0
+
+    def cursor(self):
+        raise AssertionError("health check not expected")
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    def test_connections_are_reused(self):
+        pool = ConnectionPool(FakeConnection, 'default', max_size=2)
+        first = pool.getconn()
+        pool.putconn(first)
+        self.assertIs(pool.getconn(), first)
+        self.assertEqual(pool.stats()['checkouts'], 2)
+
+    def test_checkout_times_out_when_exhausted(self):
+        pool = ConnectionPool(FakeConnection, 'default', max_size=1, timeout=0.05)
+        pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+    def test_closed_connections_are_replaced(self):
+        pool = ConnectionPool(FakeConnection, 'default', max_size=1)
+        first = pool.getconn()
+        pool.putconn(first)
+        first.closed = 1
+        self.assertIsNot(pool.getconn(), first)
+
+    def test_first_checkout_opens_min_size(self):
+        pool = ConnectionPool(FakeConnection, 'default', min_size=3, max_size=5)
+        pool.getconn()
+        self.assertEqual(pool.stats()['idle'], 2)
+        self.assertEqual(pool.stats()['in_use'], 1)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_a', 'replica_b'],
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ReplicaRoutingTest(SimpleTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.factory = RequestFactory(HTTP_AUTHORIZATION='Token replica-test')
+        self.reads = []
+
+        def view(request):
+            self.reads.append(ReplicaRouter().db_for_read(Ride))
+            return HttpResponse()
+
+        view.replica_reads = True
+        self.view = view
+        self.middleware = ReplicaRoutingMiddleware(lambda request: self.dispatch(request))
+
+    def dispatch(self, request):
+        self.middleware.process_view(request, self.view, (), {})
+        return self.view(request)
+
+    def test_reads_alternate_between_replicas(self):
+        self.middleware(self.factory.get('/api/ride/'))
+        self.middleware(self.factory.get('/api/ride/'))
+        self.assertEqual(sorted(self.reads), ['replica_a', 'replica_b'])
+        self.assertEqual(ReplicaRouter().db_for_read(Ride), 'default')
+
+    def test_client_reads_from_primary_after_writing(self):
+        self.middleware(self.factory.post('/api/ride/'))
+        self.middleware(self.factory.get('/api/ride/'))
+        self.middleware(RequestFactory(HTTP_AUTHORIZATION='Token other').get('/api/ride/'))
+        self.assertEqual(self.reads[1], 'default')
+        self.assertIn(self.reads[2], ('replica_a', 'replica_b'))
+
+
+    @override_settings(REPLICA_ROUTING={'PIN_CACHE': 'broken'}, CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'broken': {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache', 'LOCATION': '127.0.0.1:1',
+                   'OPTIONS': {'retry_attempts': 0}},
+    })
+    def test_unreachable_pin_cache_reads_from_primary(self):
+        errors = pins.errors
+        with self.assertLogs('rider.db_router', 'WARNING'):
+            self.middleware(self.factory.post('/api/ride/'))
+            self.middleware(self.factory.get('/api/ride/'))
+        self.assertEqual(self.reads[1], 'default')
+        self.assertEqual(pins.errors, errors + 2)
+
+class RideExportViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = User.objects.create_user(username="analyst", password="analystpassword", is_staff=True)
+        self.client.force_authenticate(user=self.staff)
+        Ride.objects.create(rider=self.staff, status="completed")
+        Ride.objects.create(rider=self.staff, status="cancelled")
+
+    def test_export_ndjson(self):
+        response = self.client.get('/api/ride-export/', {'status': 'completed'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['status'], 'completed')
+
+    def test_export_csv(self):
+        response = self.client.get('/api/ride-export/', {'output': 'csv', 'model': 'ride'})
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][0], 'id')
+        self.assertEqual(len(rows), 3)
+
+    def test_export_requires_staff(self):
+        self.client.force_authenticate(user=User.objects.create_user(username="rider", password="riderpassword"))
+        response = self.client.get('/api/ride-export/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
 
 class RideRequestViewTest(TestCase):
     def setUp(self):
@@ -134,13 +492,323 @@ class RideRequestViewTest(TestCase):
 
     def test_update_ride_request(self):
         ride = Ride.objects.create(rider=self.rider, status="pending")
-        ride_request = RideRequest.objects.create(ride=ride, status="pending")
+        ride_request = RideRequest.objects.create(ride=ride, driver=self.driver, status="pending")
+        self.client.force_authenticate(user=self.driver)
         url = f'/api/ride-request/{ride_request.id}/'
         data = {
             "status": "success",
         }
         response = self.client.patch(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ride.refresh_from_db()
+        self.assertEqual(ride.driver, self.driver)
+
+    def test_update_ride_request_by_rider_is_forbidden(self):
+        ride = Ride.objects.create(rider=self.rider, status="pending")
+        ride_request = RideRequest.objects.create(ride=ride, driver=self.driver, status="pending")
+        url = f'/api/ride-request/{ride_request.id}/'
+        response = self.client.patch(url, {"status": "success"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        ride.refresh_from_db()
+        ride_request.refresh_from_db()
+        self.assertIsNone(ride.driver)
+        self.assertEqual(ride_request.status, "pending")
+
+    def test_update_ride_request_already_accepted(self):
+        other = User.objects.create_user(username="other", password="driverpassword")
+        ride = Ride.objects.create(rider=self.rider, driver=self.driver, status="pending")
+        ride_request = RideRequest.objects.create(ride=ride, driver=other, status="pending")
+        self.client.force_authenticate(user=other)
+        url = f'/api/ride-request/{ride_request.id}/'
+        response = self.client.patch(url, {"status": "success"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        ride.refresh_from_db()
+        self.assertEqual(ride.driver, self.driver)
+
+    def test_inbox_lists_pending_requests_for_driver(self):
+        other = User.objects.create_user(username="other", password="driverpassword")
+        ride = Ride.objects.create(rider=self.rider, status="pending")
+        first = RideRequest.objects.create(ride=ride, driver=self.driver, status="pending")
+        RideRequest.objects.create(ride=ride, driver=self.driver, status="cancelled")
+        RideRequest.objects.create(ride=ride, driver=other, status="pending")
+        second = RideRequest.objects.create(ride=ride, driver=self.driver, status="pending")
+        self.client.force_authenticate(user=self.driver)
+
+        response = self.client.get('/api/ride-request/inbox/', {'timeout': 0})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data['results']], [first.id, second.id])
+        cursor = response.data['cursor']
+
+        started = time.monotonic()
+        response = self.client.get('/api/ride-request/inbox/', {'cursor': cursor, 'timeout': 0.2})
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual([item['id'] for item in response.data['results']], [first.id, second.id])
+        self.assertEqual(response.data['cursor'], cursor)
+
+        # committed after `second` was returned although created before it, and not skipped
+        late = RideRequest.objects.create(ride=ride, driver=self.driver, status="pending")
+        RideRequest.objects.filter(pk=late.pk).update(created=first.created - datetime.timedelta(seconds=1))
+        response = self.client.get('/api/ride-request/inbox/', {'cursor': cursor, 'timeout': '0.0'})
+        self.assertEqual([item['id'] for item in response.data['results']], [late.id, first.id, second.id])
+        self.assertNotEqual(response.data['cursor'], cursor)
+
+    def test_inbox_rejects_negative_timeout(self):
+        self.client.force_authenticate(user=self.driver)
+        response = self.client.get('/api/ride-request/inbox/', {'timeout': -1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_inbox_turns_away_polls_when_every_waiter_is_taken(self):
+        self.client.force_authenticate(user=self.driver)
+        started = time.monotonic()
+        with override_settings(RIDE_INBOX={'MAX_TIMEOUT': 25, 'MAX_WAITERS': 0, 'RECHECK_INTERVAL': 3}):
+            response = self.client.get('/api/ride-request/inbox/', {'timeout': 10})
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '3')
+        self.assertEqual(response.data['retry_after'], 3)
+
+
+class RideRequestNotifierTest(SimpleTestCase):
+    def test_wait_returns_when_the_driver_is_notified(self):
+        notifier = RideRequestNotifier()
+        version = notifier.version(1)
+        threading.Timer(0.05, notifier.notify, args=([1],)).start()
+        self.assertTrue(notifier.wait(1, version, timeout=5))
+        self.assertFalse(notifier.wait(2, notifier.version(2), timeout=0.05))
+        # a notification between reading the version and waiting is not lost
+        version = notifier.version(1)
+        notifier.notify([1])
+        self.assertTrue(notifier.wait(1, version, timeout=0))
+        self.assertEqual(notifier.stats(), {
+            'waiting': 0, 'notifications': 2, 'wakeups': 2, 'timeouts': 1, 'busy': 0,
+        })
+
+    def test_async_wait_returns_when_the_driver_is_notified(self):
+        notifier = RideRequestNotifier()
+
+        async def scenario():
+            version = notifier.version(1)
+            threading.Timer(0.05, notifier.notify, args=([1],)).start()
+            return [
+                await notifier.wait_async(1, version, timeout=5),
+                await notifier.wait_async(2, notifier.version(2), timeout=0.05),
+            ]
+
+        self.assertEqual(async_to_sync(scenario)(), [True, False])
+        self.assertEqual(notifier.stats()['waiting'], 0)
+
+    def test_slots_are_bounded(self):
+        notifier = RideRequestNotifier()
+        self.assertTrue(notifier.acquire_slot(1))
+        self.assertFalse(notifier.acquire_slot(1))
+        notifier.release_slot()
+        self.assertTrue(notifier.acquire_slot(1))
+        self.assertEqual(notifier.stats()['busy'], 1)
+
+
+@override_settings(RIDE_INBOX={'DEFAULT_TIMEOUT': 20, 'MAX_TIMEOUT': 25, 'RECHECK_INTERVAL': 20, 'LIMIT': 50,
+                               'MAX_WAITERS': 8})
+class RideRequestInboxLongPollTest(TransactionTestCase):
+    def setUp(self):
+        rider = User.objects.create_user(username="rider", password="riderpassword")
+        self.driver = User.objects.create_user(username="driver", password="driverpassword", user_role="driver")
+        self.ride = Ride.objects.create(rider=rider, status="pending")
+        self.created = {}
+
+    def send_request_later(self):
+        def send_request():
+            try:
+                self.created['request'] = RideRequest.objects.create(ride=self.ride, driver=self.driver,
+                                                                     status="pending")
+            finally:
+                connection.close()
+
+        timer = threading.Timer(0.2, send_request)
+        timer.start()
+        return timer
+
+    def test_inbox_wakes_when_a_request_is_committed(self):
+        client = APIClient()
+        client.force_authenticate(user=self.driver)
+        timer = self.send_request_later()
+        started = time.monotonic()
+        response = client.get('/api/ride-request/inbox/', {'timeout': 10})
+        timer.join()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual([item['id'] for item in response.data['results']], [self.created['request'].id])
+
+    def test_asgi_inbox_waits_on_the_event_loop(self):
+        from rider.asgi import application
+        token = Token.objects.create(user=self.driver)
+
+        async def scenario():
+            communicator = ApplicationCommunicator(application, {
+                'type': 'http',
+                'method': 'GET',
+                'path': '/api/ride-request/inbox/',
+                'query_string': b'timeout=10',
+                'headers': [(b'authorization', f'Token {token.key}'.encode())],
+            })
+            await communicator.send_input({'type': 'http.request', 'body': b''})
+            timer = self.send_request_later()
+            start = await communicator.receive_output(5)
+            body = await communicator.receive_output(5)
+            await sync_to_async(timer.join)()
+            return start, body
+
+        started = time.monotonic()
+        start, body = async_to_sync(scenario)()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(start['status'], 200)
+        self.assertEqual([item['id'] for item in json.loads(body['body'])['results']], [self.created['request'].id])
+
+
+class AcceptRideConcurrencyTest(TransactionTestCase):
+    def test_only_one_driver_wins(self):
+        rider = User.objects.create_user(username="rider", password="riderpassword")
+        ride = Ride.objects.create(rider=rider, status="pending")
+        drivers = [
+            User.objects.create_user(username=f"driver{i}", password="driverpassword", user_role="driver")
+            for i in range(8)
+        ]
+        requests = [RideRequest.objects.create(ride=ride, driver=driver, status="pending") for driver in drivers]
+        barrier = threading.Barrier(len(drivers))
+        results = {}
+
+        def accept(ride_request, driver):
+            try:
+                barrier.wait()
+                results[driver.pk] = accept_ride(ride_request, driver)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=accept, args=pair) for pair in zip(requests, drivers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        winners = [driver_id for driver_id, won in results.items() if won]
+        self.assertEqual(len(winners), 1)
+        ride.refresh_from_db()
+        self.assertEqual(ride.driver_id, winners[0])
+        statuses = dict(RideRequest.objects.values_list('driver_id', 'status'))
+        self.assertEqual(statuses.pop(winners[0]), 'success')
+        self.assertEqual(set(statuses.values()), {'cancelled'})
+
+
+class DispatchTest(TestCase):
+    def setUp(self):
+        driver_index.clear()
+        self.rider = User.objects.create_user(username="rider", password="riderpassword")
+
+    def create_driver(self, name, longitude, latitude):
+        location = DriverLocation.objects.create(location=Point(longitude, latitude, srid=4326), is_driver_available=True)
+        return User.objects.create_user(username=name, password="driverpassword", user_role="driver", driver=location)
+
+    def create_ride(self, longitude, latitude):
+        return Ride.objects.create(rider=self.rider, status="pending",
+                                   pickup_loc_longitude=str(longitude), pickup_loc_latitude=str(latitude))
+
+    def test_match_greedy_prefers_closest_pairs(self):
+        rides = np.array([[77.5900, 12.9700], [77.6000, 12.9800], [80.0, 15.0]])
+        drivers = np.array([[77.6001, 12.9801], [77.5901, 12.9701]])
+        matches = match_greedy(rides, drivers, 5000)
+        self.assertEqual(sorted((ride, driver) for ride, driver, distance in matches), [(0, 1), (1, 0)])
+
+    def test_dispatch_assigns_nearest_driver(self):
+        near = self.create_driver("near", 77.5901, 12.9701)
+        self.create_driver("far", 77.7000, 13.0500)
+        ride = self.create_ride(77.5900, 12.9700)
+        out_of_reach = self.create_ride(80.0, 15.0)
+
+        self.assertEqual(dispatch(max_distance=5000), [(ride.pk, near.pk)])
+        ride.refresh_from_db()
+        out_of_reach.refresh_from_db()
+        near.driver.refresh_from_db()
+        self.assertEqual(ride.driver, near)
+        self.assertIsNone(out_of_reach.driver)
+        self.assertFalse(near.driver.is_driver_available)
+        self.assertTrue(RideRequest.objects.filter(ride=ride, driver=near, status='success').exists())
+
+
+    def test_dispatch_ignores_a_stale_index_position(self):
+        moved = self.create_driver("moved", 77.7000, 13.0500)
+        # the index still holds where the driver was before its last ping was written
+        driver_index.upsert(moved.driver.pk, 77.5901, 12.9701)
+        self.create_ride(77.5900, 12.9700)
+        self.assertEqual(idle_drivers(), [(moved.pk, moved.driver.pk, 77.7000, 13.0500)])
+        self.assertEqual(dispatch(max_distance=5000), [])
+
+class HeatmapTest(TestCase):
+    def setUp(self):
+        driver_index.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="ops", password="opspassword",
+                                                                is_staff=True))
+        self.rider = User.objects.create_user(username="rider", password="riderpassword")
+
+    def test_counters_follow_rides_and_drivers(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            location = DriverLocation.objects.create(location=Point(77.5901, 12.9701, srid=4326))
+            User.objects.create_user(username="driver", password="driverpassword", user_role="driver",
+                                     driver=location)
+            Ride.objects.create(rider=self.rider, status="pending",
+                                pickup_loc_longitude="77.5900", pickup_loc_latitude="12.9700")
+        response = self.client.get('/api/heatmap/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(cell['cell'], cell['pending_rides'], cell['available_drivers'])
+                          for cell in response.data['cells']], [("7759:1297", 1, 1)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch(max_distance=5000)
+        self.assertEqual(self.client.get('/api/heatmap/').data['cells'], [])
+        self.assertEqual(reconcile(), [])
+
+    def test_reconcile_fixes_drift(self):
+        GeocellCounter.objects.create(cell="1:1", pending_rides=3)
+        self.assertEqual(reconcile(dry_run=True), [("1:1", 3, 0, 0, 0)])
+        self.assertEqual(reconcile(), [("1:1", 3, 0, 0, 0)])
+        self.assertEqual(reconcile(), [])
+
+
+@override_settings(RIDE_ETA={
+    'DEFAULT_SPEED': 36,
+    'DETOUR_FACTOR': 1.0,
+    'SPEED_PROFILE': [
+        {'hours': (17, 21), 'speed': 18},
+        {'area': (77.0, 12.0, 78.0, 13.0), 'hours': (22, 6), 'speed': 72},
+    ],
+})
+class EtaTest(TestCase):
+    def at(self, hour):
+        return timezone.make_aware(datetime.datetime(2024, 1, 1, hour))
+
+    def test_speed_profile_by_hour_and_area(self):
+        origins = [[77.59, 12.97], [79.59, 12.97]]
+        destinations = [[77.59, 12.98], [79.59, 12.98]]
+        distances, seconds = estimate(origins, destinations, self.at(12))
+        self.assertAlmostEqual(distances[0], 1111.95, places=1)
+        self.assertAlmostEqual(seconds[0], distances[0] / 10)
+        self.assertAlmostEqual(estimate(origins, destinations, self.at(18))[1][0], distances[0] / 5)
+        # the night rule only covers the first trip's area and wraps past midnight
+        night = estimate(origins, destinations, self.at(2))[1]
+        self.assertAlmostEqual(night[0], distances[0] / 20)
+        self.assertAlmostEqual(night[1], distances[1] / 10)
+
+    def test_batch_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username="rider", password="riderpassword"))
+        origin, destination = {'latitude': 12.97, 'longitude': 77.59}, {'latitude': 12.98, 'longitude': 77.59}
+        response = client.post('/api/eta/', {
+            'origins': [origin, destination], 'destinations': [destination, destination],
+            'departure': '2024-01-01T12:00:00+05:30',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['eta_seconds'] for result in response.data['results']], [111, 0])
+
+        response = client.post('/api/eta/', {'origins': [origin], 'destinations': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
 class DriverLocationViewTest(TestCase):
@@ -175,9 +843,45 @@ class DriverLocationViewTest(TestCase):
         response = self.client.patch(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_update_driver_location_form_encoded_availability(self):
+        changed = []
+
+        def receiver(sender, locations, **kwargs):
+            changed.extend(locations)
+
+        driver_locations_changed.connect(receiver)
+        self.addCleanup(driver_locations_changed.disconnect, receiver)
+        url = f'/api/driver-location/{self.location.id}/'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, {"is_driver_available": "false"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIs(changed[-1].is_driver_available, False)
+        response = self.client.patch(url, {"is_driver_available": "maybe"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_update_driver_locations(self):
+        url = '/api/driver-location/bulk/'
+        data = {
+            "locations": [
+                {"driver": self.location.id, "latitude": 12.36, "longitude": 56.80,
+                 "timestamp": "2023-10-21T10:00:05Z"},
+                {"driver": self.location.id, "latitude": 12.35, "longitude": 56.79,
+                 "timestamp": "2023-10-21T10:00:00Z"},
+                {"driver": 0, "latitude": 12.35, "longitude": 56.79},
+                {"driver": self.location.id, "latitude": 120},
+            ]
+        }
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ['updated', 'superseded', 'not_found', 'invalid'])
+        self.location.refresh_from_db()
+        self.assertAlmostEqual(self.location.location.y, 12.36)
+
 
 class DriversListingViewTest(TestCase):
     def setUp(self):
+        listing_cache.clear()
         self.client = APIClient()
         self.rider = User.objects.create_user(
             username="rider",
@@ -190,3 +894,96 @@ class DriversListingViewTest(TestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_list_nearest_drivers_first(self):
+        driver_index.clear()
+        for username, longitude in (("far", 77.62), ("near", 77.60), ("out-of-range", 77.70)):
+            location = DriverLocation.objects.create(location=Point(longitude, 12.97, srid=4326))
+            User.objects.create_user(username=username, password="driverpassword", user_role="driver",
+                                     full_name=username, driver=location)
+        Ride.objects.create(rider=self.rider, pickup_loc_latitude="12.97", pickup_loc_longitude="77.59")
+        response = self.client.get('/api/driver-listing/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([driver['full_name'] for driver in response.data], ["near", "far"])
+        self.assertLess(response.data[0]['distance'], response.data[1]['distance'])
+        self.assertAlmostEqual(response.data[0]['longitude'], 77.60)
+        self.assertLess(response.data[0]['eta_seconds'], response.data[1]['eta_seconds'])
+
+    def test_listing_positions_come_from_the_database_outside_write_behind(self):
+        driver_index.clear()
+        location = DriverLocation.objects.create(location=Point(77.60, 12.97, srid=4326))
+        User.objects.create_user(username="near", password="driverpassword", user_role="driver",
+                                 full_name="near", driver=location)
+        driver_index.load()
+        # a position the index has not refreshed away yet
+        driver_index.upsert(location.pk, 77.595, 12.975)
+        Ride.objects.create(rider=self.rider, pickup_loc_latitude="12.97", pickup_loc_longitude="77.59")
+        response = self.client.get('/api/driver-listing/')
+        self.assertAlmostEqual(response.data[0]['longitude'], 77.60)
+        self.assertAlmostEqual(response.data[0]['latitude'], 12.97)
+
+        # a ping still buffered in write-behind mode is newer than the row
+        write_behind = {'ENABLED': True, 'FLUSH_INTERVAL': 60, 'FLUSH_SIZE': 100, 'MAX_PENDING': 100}
+        with self.settings(DRIVER_LOCATION_WRITE_BEHIND=write_behind):
+            location_buffer.put(location.pk, Point(77.599, 12.971, srid=4326), True, True)
+            response = self.client.get('/api/driver-listing/')
+            location_buffer.stop()
+        self.assertAlmostEqual(response.data[0]['longitude'], 77.599)
+
+    def test_listing_with_pickup_only_runs_the_nearby_search(self):
+        Ride.objects.create(rider=self.rider, pickup_loc_latitude="12.97", pickup_loc_longitude="77.59")
+        with mock.patch('applications.api.views.available_drivers') as unordered:
+            self.client.get('/api/driver-listing/')
+        unordered.assert_not_called()
+
+    def test_list_limit(self):
+        driver_index.clear()
+        for username, longitude in (("far", 77.62), ("near", 77.60)):
+            location = DriverLocation.objects.create(location=Point(longitude, 12.97, srid=4326))
+            User.objects.create_user(username=username, password="driverpassword", user_role="driver",
+                                     full_name=username, driver=location)
+        Ride.objects.create(rider=self.rider, pickup_loc_latitude="12.97", pickup_loc_longitude="77.59")
+        response = self.client.get('/api/driver-listing/', {'limit': 1, 'radius': 10000})
+        self.assertEqual([driver['full_name'] for driver in response.data], ["near"])
+
+    def test_listing_cached_until_a_driver_moves_nearby(self):
+        driver_index.clear()
+        location = DriverLocation.objects.create(location=Point(77.60, 12.97, srid=4326))
+        User.objects.create_user(username="near", password="driverpassword", user_role="driver",
+                                 full_name="near", driver=location)
+        Ride.objects.create(rider=self.rider, pickup_loc_latitude="12.97", pickup_loc_longitude="77.59")
+        self.client.get('/api/driver-listing/')
+        self.client.get('/api/driver-listing/')
+        self.assertEqual(listing_cache.stats()['hits'], 1)
+
+        location.location = Point(77.595, 12.97, srid=4326)
+        with self.captureOnCommitCallbacks(execute=True):
+            location.save()
+        response = self.client.get('/api/driver-listing/')
+        self.assertEqual(listing_cache.stats()['invalidations'], 1)
+        self.assertAlmostEqual(response.data[0]['longitude'], 77.595)
+
+    def test_cached_listing_etas_follow_each_pickup(self):
+        driver_index.clear()
+        location = DriverLocation.objects.create(location=Point(77.60, 12.97, srid=4326))
+        User.objects.create_user(username="near", password="driverpassword", user_role="driver",
+                                 full_name="near", driver=location)
+        other = User.objects.create_user(username="other", password="riderpassword")
+        distances, etas = [], []
+        # both pickups fall in the same cache key cell
+        for rider, longitude in ((self.rider, "77.5901"), (other, "77.5909")):
+            Ride.objects.create(rider=rider, pickup_loc_latitude="12.9701", pickup_loc_longitude=longitude)
+            self.client.force_authenticate(user=rider)
+            record = self.client.get('/api/driver-listing/').data[0]
+            distances.append(record['distance'])
+            etas.append(record['eta_seconds'])
+        self.assertEqual(listing_cache.stats()['hits'], 1)
+        expected_distances, expected_etas = estimate([[77.60, 12.97]] * 2, [[77.5901, 12.9701], [77.5909, 12.9701]])
+        self.assertEqual(etas, np.rint(expected_etas).astype(int).tolist())
+        self.assertGreater(etas[0], etas[1])
+        for distance, expected in zip(distances, expected_distances.tolist()):
+            self.assertAlmostEqual(distance, expected, places=3)
+        self.assertGreater(distances[0], distances[1])
+
+    def test_list_invalid_radius(self):
+        response = self.client.get('/api/driver-listing/', {'radius': 'far'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
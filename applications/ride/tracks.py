@@ -0,0 +1,146 @@
+import atexit
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from applications.accounts.background import BackgroundFlusher
+from applications.ride.models import RideTrackSegment
+
+
+logger = logging.getLogger(__name__)
+
+
+def track_settings():
+    return getattr(settings, 'RIDE_TRACK', {})
+
+
+class TrackBuffer(BackgroundFlusher):
+    """
+    Collects GPS points per ride and appends them to `RideTrackSegment` arrays every
+    `flush_interval` seconds or once `flush_size` points are pending.
+    Points fill the ride's latest segment up to `segment_points` before new segments are inserted,
+    so a long ride takes one row per `segment_points` points whatever the flush frequency.
+    """
+
+    thread_name = 'ride-track-flush'
+
+    def __init__(self):
+        super().__init__()
+        self._pending = {}
+        self._count = 0
+
+    @property
+    def flush_interval(self):
+        return track_settings().get('FLUSH_INTERVAL', 5.0)
+
+    @property
+    def flush_size(self):
+        return track_settings().get('FLUSH_SIZE', 1000)
+
+    @property
+    def segment_points(self):
+        return track_settings().get('SEGMENT_POINTS', 500)
+
+    def __len__(self):
+        return self._count
+
+    def append(self, ride_id, longitude, latitude, timestamp=None):
+        """
+        Buffer a point of a ride's track
+        @param: ride_id:int, longitude:float, latitude:float, timestamp:datetime defaults to now
+        """
+        with self._lock:
+            self._pending.setdefault(ride_id, []).append((timestamp or timezone.now(), longitude, latitude))
+            self._count += 1
+            full = self._count >= self.flush_size
+        self._buffered(full)
+
+    def pending(self, ride_id):
+        """
+        @return: list: (timestamp, longitude, latitude) of a ride not written yet
+        """
+        with self._lock:
+            return list(self._pending.get(ride_id, ()))
+
+    def flush(self):
+        """
+        Write everything buffered so far
+        @return: int: number of segments written
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending, self._count = self._pending, {}, 0
+            if not batch:
+                return 0
+            try:
+                return self._write(batch)
+            except Exception:
+                logger.exception("Failed to write the tracks of %d rides", len(batch))
+                with self._lock:
+                    for ride_id, points in batch.items():
+                        self._pending[ride_id] = points + self._pending.get(ride_id, [])
+                        self._count += len(points)
+                raise
+
+    def _write(self, batch):
+        latest = RideTrackSegment.objects.filter(ride_id__in=list(batch)).order_by(
+            'ride_id', '-started', '-id'
+        ).distinct('ride_id').values('id')
+        with transaction.atomic():
+            # locked, so flushes of other processes append to the same segment one after the other
+            open_segments = {
+                segment.ride_id: segment
+                for segment in RideTrackSegment.objects.select_for_update().filter(
+                    pk__in=latest, offsets__len__lt=self.segment_points,
+                )
+            }
+            updated, created = [], []
+            for ride_id, points in batch.items():
+                points = sorted(points, key=lambda point: point[0])
+                segment = open_segments.get(ride_id)
+                if segment is not None:
+                    room = self.segment_points - len(segment)
+                    self._extend(segment, points[:room])
+                    updated.append(segment)
+                    points = points[room:]
+                created += self.segments(ride_id, points)
+            RideTrackSegment.objects.bulk_update(updated, ['points', 'offsets'], batch_size=500)
+            RideTrackSegment.objects.bulk_create(created, batch_size=500)
+        return len(updated) + len(created)
+
+    def segments(self, ride_id, points):
+        for start in range(0, len(points), self.segment_points):
+            chunk = points[start:start + self.segment_points]
+            segment = RideTrackSegment(ride_id=ride_id, started=chunk[0][0], points=[], offsets=[])
+            self._extend(segment, chunk)
+            yield segment
+
+    @staticmethod
+    def _extend(segment, points):
+        segment.points += [value for timestamp, longitude, latitude in points for value in (longitude, latitude)]
+        segment.offsets += [int((timestamp - segment.started).total_seconds() * 1000)
+                            for timestamp, longitude, latitude in points]
+
+
+track_buffer = TrackBuffer()
+atexit.register(track_buffer.stop)
+
+
+def ride_track(ride_id):
+    """
+    Every recorded point of a ride in time order, including points still buffered
+    @return: list: (timestamp, longitude, latitude)
+    """
+    points = []
+    for started, coordinates, offsets in RideTrackSegment.objects.filter(ride_id=ride_id).order_by(
+        'started', 'id'
+    ).values_list('started', 'points', 'offsets').iterator():
+        for index, offset in enumerate(offsets):
+            points.append((started + timedelta(milliseconds=offset),
+                           coordinates[2 * index], coordinates[2 * index + 1]))
+    points.extend(track_buffer.pending(ride_id))
+    points.sort(key=lambda point: point[0])
+    return points
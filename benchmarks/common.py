@@ -0,0 +1,118 @@
+"""
+Shared helpers for the benchmark scripts in this package.
+
+Benchmarks run against a throwaway test database created from the configured
+`default` database, so they need the same PostGIS server as the test suite:
+
+    python -m benchmarks.driver_search
+"""
+import os
+import random
+import statistics
+import time
+from contextlib import contextmanager
+
+import django
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rider.settings')
+    django.setup()
+
+
+@contextmanager
+def benchmark_database(keepdb=False):
+    """
+    Create the test database for the duration of a benchmark and drop it afterwards
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+def measure(func, repeat=20, warmup=2):
+    """
+    Call `func` repeatedly
+    @return: list: wall clock seconds of each timed call
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    return {
+        'mean_ms': statistics.mean(samples) * 1000,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+    }
+
+
+def print_table(rows, columns):
+    widths = [max(len(column), *(len(_format(row[column])) for row in rows)) for column in columns]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(_format(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def _format(value):
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+
+def random_point(rng=random, center=(77.5946, 12.9716), spread=0.15):
+    """
+    Random coordinate around a city centre, (longitude, latitude)
+    """
+    return center[0] + rng.uniform(-spread, spread), center[1] + rng.uniform(-spread, spread)
+
+
+def seed_drivers(count, rng=random, batch_size=5000):
+    """
+    Bulk create `count` available drivers with locations spread around the city centre
+    @return: list: DriverLocation ids
+    """
+    from django.contrib.gis.geos import Point
+
+    from applications.accounts.models import User, DriverLocation
+
+    start = User.objects.count()
+    location_ids = []
+    for offset in range(0, count, batch_size):
+        size = min(batch_size, count - offset)
+        locations = DriverLocation.objects.bulk_create([
+            DriverLocation(location=Point(*random_point(rng), srid=4326), is_driver_available=True)
+            for _ in range(size)
+        ])
+        User.objects.bulk_create([
+            User(username=f"bench-driver-{start + offset + i}", password='!', user_role='driver', driver=location)
+            for i, location in enumerate(locations)
+        ])
+        location_ids.extend(location.pk for location in locations)
+    return location_ids
+
+
+def analyze(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
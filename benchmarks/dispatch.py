@@ -0,0 +1,96 @@
+"""
+Batch dispatch: ride/driver matching on the vectorized distance matrix alone, and a full
+dispatch round including the database reads and the single write-back transaction.
+
+    python -m benchmarks.dispatch [--sizes 1000 10000] [--max-distance 5000] [--hungarian-max 2000]
+
+Each size seeds that many pending rides and available drivers. The hungarian strategy needs
+scipy and a dense matrix, it is skipped above --hungarian-max.
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import setup, benchmark_database, measure, summarize, print_table, random_point, \
+    seed_drivers, analyze
+
+
+def seed_rides(count, rng=random, batch_size=5000):
+    from django.contrib.gis.geos import Point
+
+    from applications.accounts.models import User
+    from applications.ride.models import Ride
+
+    rider, _ = User.objects.get_or_create(username='bench-rider', defaults={'password': '!'})
+    for offset in range(0, count, batch_size):
+        rides = []
+        for _ in range(min(batch_size, count - offset)):
+            longitude, latitude = random_point(rng)
+            rides.append(Ride(
+                rider=rider, status='pending',
+                pickup_loc_longitude=str(longitude), pickup_loc_latitude=str(latitude),
+                pickup_location=Point(longitude, latitude, srid=4326),
+            ))
+        Ride.objects.bulk_create(rides)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--max-distance', type=float, default=5000)
+    parser.add_argument('--hungarian-max', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup()
+    import numpy as np
+
+    from applications.accounts.models import DriverLocation
+    from applications.ride.dispatch import MATCHERS, dispatch
+    from applications.ride.models import Ride, RideRequest
+
+    try:
+        import scipy  # noqa: F401
+        strategies = sorted(MATCHERS)
+    except ImportError:
+        strategies = ['greedy']
+
+    rng = random.Random(42)
+    rows = []
+    for size in sorted(args.sizes):
+        rides = np.array([random_point(rng) for _ in range(size)])
+        drivers = np.array([random_point(rng) for _ in range(size)])
+        for strategy in strategies:
+            if strategy == 'hungarian' and size > args.hungarian_max:
+                continue
+            matches = MATCHERS[strategy](rides, drivers, args.max_distance)
+            samples = measure(lambda: MATCHERS[strategy](rides, drivers, args.max_distance),
+                              repeat=args.repeat, warmup=1)
+            rows.append({
+                'size': size, 'stage': f'match ({strategy})', 'matched': len(matches),
+                'mean_pickup_m': sum(distance for ride, driver, distance in matches) / max(1, len(matches)),
+                **summarize(samples),
+            })
+
+    with benchmark_database() as connection:
+        for size in sorted(args.sizes):
+            Ride.objects.all().delete()
+            RideRequest.objects.all().delete()
+            DriverLocation.objects.all().delete()
+            seed_drivers(size, rng)
+            seed_rides(size, rng)
+            analyze(connection)
+
+            started = time.perf_counter()
+            assigned = dispatch('greedy', args.max_distance, size)
+            elapsed = time.perf_counter() - started
+            rows.append({
+                'size': size, 'stage': 'dispatch round (greedy)', 'matched': len(assigned), 'mean_pickup_m': '-',
+                **summarize([elapsed]),
+            })
+
+    print_table(rows, ['size', 'stage', 'matched', 'mean_pickup_m', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+
+
+if __name__ == '__main__':
+    main()
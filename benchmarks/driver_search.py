@@ -0,0 +1,61 @@
+"""
+Nearest-driver search: the original annotate/order_by over every available driver against the
+radius-bounded KNN query and the in-process spatial index.
+
+    python -m benchmarks.driver_search [--sizes 1000 10000 100000] [--radius 5000] [--limit 20]
+"""
+import argparse
+import random
+
+from benchmarks.common import setup, benchmark_database, measure, summarize, print_table, random_point, \
+    seed_drivers, analyze
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--radius', type=float, default=5000)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup()
+    from django.contrib.gis.db.models.functions import Distance
+    from django.contrib.gis.geos import Point
+    from django.db.models import F
+
+    from applications.accounts.nearby import available_drivers, nearest_from_database, nearest_from_index
+    from applications.accounts.spatial_index import driver_index
+
+    rng = random.Random(42)
+    rows = []
+    with benchmark_database() as connection:
+        seeded = 0
+        for size in sorted(args.sizes):
+            seed_drivers(size - seeded, rng)
+            seeded = size
+            analyze(connection)
+            driver_index.load()
+            pickups = [Point(*random_point(rng), srid=4326) for _ in range(args.repeat)]
+
+            def full_scan():
+                pickup = rng.choice(pickups)
+                list(available_drivers().annotate(
+                    distance=Distance(F('driver__location'), pickup)
+                ).order_by('distance'))
+
+            def knn():
+                nearest_from_database(rng.choice(pickups), radius=args.radius, limit=args.limit)
+
+            def spatial_index():
+                nearest_from_index(rng.choice(pickups), radius=args.radius, limit=args.limit)
+
+            for name, func in (('annotate/order_by', full_scan), ('dwithin + <->', knn),
+                               ('spatial index', spatial_index)):
+                rows.append({'drivers': size, 'query': name, **summarize(measure(func, repeat=args.repeat))})
+
+    print_table(rows, ['drivers', 'query', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+API endpoint latency and SQL query counts, with a query budget per endpoint.
+Each endpoint is called through APIClient with the same requests the view tests send, against
+a database seeded with configurable volumes. Fails with exit status 1 when an endpoint runs
+more queries per request than its budget in benchmarks/query_budgets.json.
+
+    python -m benchmarks.endpoints [--riders 200] [--drivers 2000] [--rides 20000] [--repeat 50]
+                                   [--only ride-list driver-listing] [--write-budgets] [--fast-hasher]
+
+--write-budgets stores the observed maximum of every endpoint as its new budget, review the diff
+before committing it. Budgets only ever come from such a run: regenerate them in any change that
+alters an endpoint's queries instead of editing the file by hand. Until a first run has filled in
+the file, endpoints without a budget are reported but do not fail; afterwards they do.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from benchmarks.common import setup, benchmark_database, summarize, print_table, random_point, seed_drivers, \
+    analyze
+
+
+BUDGETS_FILE = os.path.join(os.path.dirname(__file__), 'query_budgets.json')
+
+
+class Endpoint:
+    """
+    A benchmarked request.
+    `prepare(i)` returns the url and payload of the i-th call and may create the rows it needs,
+    its queries are not counted.
+    """
+
+    def __init__(self, name, method, user, prepare, expected=200):
+        self.name = name
+        self.method = method
+        self.user = user
+        self.prepare = prepare
+        self.expected = expected
+
+
+def seed(args, rng):
+    """
+    @return: dict: the users and rows the endpoints act on
+    """
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.gis.geos import Point
+    from rest_framework.authtoken.models import Token
+
+    from applications.accounts.models import User
+    from applications.ride.models import Ride, RideRequest
+
+    password = make_password('benchpassword')
+    riders = User.objects.bulk_create([
+        User(username=f"bench-rider-{i}@example.com", email=f"bench-rider-{i}@example.com", password=password)
+        for i in range(args.riders)
+    ], batch_size=5000)
+    location_ids = seed_drivers(args.drivers, rng)
+    drivers = list(User.objects.filter(driver_id__in=location_ids).order_by('pk'))
+    staff = User.objects.create_user(username='bench-staff', password='benchpassword', is_staff=True)
+
+    rides = []
+    for i in range(args.rides):
+        longitude, latitude = random_point(rng)
+        rides.append(Ride(
+            rider=riders[i % len(riders)], driver=drivers[i % len(drivers)] if i % 3 else None,
+            status=rng.choice(['completed', 'pending', 'cancelled']),
+            pickup_loc_longitude=str(longitude), pickup_loc_latitude=str(latitude),
+            pickup_location=Point(longitude, latitude, srid=4326),
+        ))
+    rides = Ride.objects.bulk_create(rides, batch_size=5000)
+    RideRequest.objects.bulk_create([
+        RideRequest(ride=ride, driver=drivers[i % len(drivers)], status='pending') for i, ride in enumerate(rides)
+    ], batch_size=5000)
+
+    for user in (riders[0], drivers[0], staff):
+        Token.objects.create(user=user)
+    return {
+        'rider': riders[0],
+        'driver': drivers[0],
+        'staff': staff,
+        'ride': Ride.objects.create(rider=riders[0], driver=drivers[0], status='running'),
+    }
+
+
+def endpoints(world, rng):
+    from applications.ride.models import Ride, RideRequest
+
+    rider, driver, ride = world['rider'], world['driver'], world['ride']
+
+    def pending_request(i):
+        pending = Ride.objects.create(rider=rider, status='pending')
+        ride_request = RideRequest.objects.create(ride=pending, driver=driver, status='pending')
+        return f'/api/ride-request/{ride_request.id}/', {'status': 'success'}
+
+    def new_ride_request(i):
+        pending = Ride.objects.create(rider=rider, status='pending')
+        return '/api/ride-request/', {'ride': pending.id, 'status': 'pending'}
+
+    def location_records(i):
+        return '/api/driver-location/bulk/', {'locations': [
+            dict(zip(('longitude', 'latitude'), random_point(rng)), driver=driver.driver_id + offset)
+            for offset in range(100)
+        ]}
+
+    return [
+        Endpoint('login', 'post', None, lambda i: (
+            '/api/login/', {'email': rider.email, 'password': 'benchpassword'})),
+        Endpoint('ride-list', 'get', 'rider', lambda i: ('/api/ride/', None)),
+        Endpoint('ride-create', 'post', 'rider', lambda i: ('/api/ride/', {
+            'pickup_loc_latitude': 12.97, 'pickup_loc_longitude': 77.59,
+            'dropoff_loc_latitude': 12.93, 'dropoff_loc_logitude': 77.62, 'status': 'pending',
+        }), expected=201),
+        Endpoint('ride-create-fanout', 'post', 'rider', lambda i: ('/api/ride/', {
+            'pickup_loc_latitude': 12.97, 'pickup_loc_longitude': 77.59, 'status': 'pending', 'notify_drivers': 5,
+        }), expected=201),
+        Endpoint('ride-retrieve', 'get', 'rider', lambda i: (f'/api/ride/{ride.id}/', None)),
+        Endpoint('ride-current-location', 'patch', 'driver', lambda i: (
+            f'/api/ride/{ride.id}/', {'current_location': 'POINT({} {})'.format(*random_point(rng))})),
+        Endpoint('ride-track', 'get', 'rider', lambda i: (f'/api/ride/{ride.id}/track/', None)),
+        Endpoint('ride-request-list', 'get', 'driver', lambda i: ('/api/ride-request/', None)),
+        Endpoint('ride-request-inbox', 'get', 'driver', lambda i: ('/api/ride-request/inbox/?timeout=0', None)),
+        Endpoint('ride-request-create', 'post', 'rider', new_ride_request, expected=201),
+        Endpoint('ride-request-accept', 'patch', 'driver', pending_request),
+        Endpoint('driver-listing', 'get', 'rider', lambda i: ('/api/driver-listing/', None)),
+        Endpoint('driver-location-update', 'patch', 'driver', lambda i: (
+            f'/api/driver-location/{driver.driver_id}/', dict(zip(('longitude', 'latitude'), random_point(rng))))),
+        Endpoint('driver-location-bulk', 'post', 'driver', location_records),
+        Endpoint('ride-export', 'get', 'staff', lambda i: ('/api/ride-export/?status=completed', None)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--riders', type=int, default=200)
+    parser.add_argument('--drivers', type=int, default=2000)
+    parser.add_argument('--rides', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--only', nargs='+', help="Endpoint names to run")
+    parser.add_argument('--write-budgets', action='store_true')
+    parser.add_argument('--fast-hasher', action='store_true')
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.authtoken.models import Token
+    from rest_framework.test import APIClient
+
+    from applications.accounts.spatial_index import driver_index
+    from applications.ride.tracks import track_buffer
+
+    if args.fast_hasher:
+        settings.PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+    with open(BUDGETS_FILE) as budgets_file:
+        budgets = json.load(budgets_file)
+    # an empty file has never been generated, there is nothing to hold endpoints to yet
+    recorded = bool(budgets)
+
+    rng = random.Random(42)
+    rows, over_budget = [], []
+    with benchmark_database():
+        world = seed(args, rng)
+        analyze(connection)
+        driver_index.load()
+        clients = {None: APIClient()}
+        for role in ('rider', 'driver', 'staff'):
+            clients[role] = APIClient()
+            clients[role].credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.get(user=world[role]).key}")
+
+        for endpoint in endpoints(world, rng):
+            if args.only and endpoint.name not in args.only:
+                continue
+            client = clients[endpoint.user]
+            samples, queries = [], []
+            # the first calls warm the token cache and the spatial index
+            for i in range(args.repeat + 2):
+                url, data = endpoint.prepare(i)
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = getattr(client, endpoint.method)(url, data, format='json')
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    elapsed = time.perf_counter() - started
+                assert response.status_code == endpoint.expected, (endpoint.name, response.status_code)
+                if i >= 2:
+                    samples.append(elapsed)
+                    queries.append(len(captured))
+            track_buffer.flush()
+
+            budget = budgets.get(endpoint.name)
+            if args.write_budgets:
+                budgets[endpoint.name] = budget = max(queries)
+            if (budget is None and recorded) or (budget is not None and max(queries) > budget):
+                over_budget.append(endpoint.name)
+            rows.append({
+                'endpoint': endpoint.name,
+                'queries': max(queries),
+                'budget': budget if budget is not None else '-',
+                **summarize(samples),
+            })
+
+    print_table(rows, ['endpoint', 'queries', 'budget', 'p50_ms', 'p95_ms', 'p99_ms'])
+    if args.write_budgets:
+        with open(BUDGETS_FILE, 'w') as budgets_file:
+            json.dump(budgets, budgets_file, indent=2, sort_keys=True)
+            budgets_file.write('\n')
+    elif not recorded:
+        print("\nNo query budgets recorded yet, run with --write-budgets against this fixture and commit "
+              "benchmarks/query_budgets.json", file=sys.stderr)
+    elif over_budget:
+        print(f"\nQuery budget exceeded or missing: {', '.join(over_budget)}\n"
+              f"Rerun with --write-budgets after an intended change and commit the measured budgets",
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
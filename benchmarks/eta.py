@@ -0,0 +1,77 @@
+"""
+ETA estimation for driver candidates: the vectorized `estimate` against the same haversine
+distance and speed profile computed candidate by candidate in Python.
+Reports the time of a whole batch and the cost per candidate. No database is needed.
+
+    python -m benchmarks.eta [--sizes 100 1000 10000]
+"""
+import argparse
+import random
+
+from benchmarks.common import setup, measure, summarize, print_table, random_point
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup()
+    import numpy as np
+    from django.utils import timezone
+
+    from applications.accounts.geocell import haversine
+    from applications.ride.eta import estimate, eta_settings, in_hours
+
+    departure = timezone.now()
+    hour = timezone.localtime(departure).hour
+    profile = eta_settings()
+    detour = profile.get('DETOUR_FACTOR', 1.3)
+
+    def scalar_speed(longitude, latitude):
+        speed = profile.get('DEFAULT_SPEED', 25)
+        for rule in profile.get('SPEED_PROFILE', ()):
+            if 'hours' in rule and not in_hours(hour, rule['hours']):
+                continue
+            if 'area' in rule:
+                min_longitude, min_latitude, max_longitude, max_latitude = rule['area']
+                if not (min_longitude <= longitude <= max_longitude and min_latitude <= latitude <= max_latitude):
+                    continue
+            speed = rule['speed']
+        return speed
+
+    rng = random.Random(42)
+    pickup = random_point(rng)
+    rows = []
+    for size in sorted(args.sizes):
+        candidates = [random_point(rng) for _ in range(size)]
+        origins = np.array(candidates)
+        destinations = np.array([pickup] * size)
+
+        def vectorized():
+            return estimate(origins, destinations, departure)
+
+        def per_candidate():
+            return [
+                haversine(longitude, latitude, *pickup) * detour / (scalar_speed(
+                    (longitude + pickup[0]) / 2, (latitude + pickup[1]) / 2) / 3.6)
+                for longitude, latitude in candidates
+            ]
+
+        expected = np.array(per_candidate())
+        assert np.allclose(vectorized()[1], expected), "vectorized ETAs differ from the per-candidate ones"
+        for name, func in (('numpy batch', vectorized), ('python loop', per_candidate)):
+            stats = summarize(measure(func, repeat=args.repeat))
+            rows.append({
+                'candidates': size,
+                'method': name,
+                'us_per_candidate': stats['mean_ms'] * 1000 / size,
+                **stats,
+            })
+
+    print_table(rows, ['candidates', 'method', 'us_per_candidate', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Driver listing serialization: the full UserListingSerializer over User instances against the
+flat values() projection rendered by DriverListingSerializer.
+Reports query + serialization time and JSON payload size for the same drivers.
+
+    python -m benchmarks.listing_serializer [--sizes 20 100 1000]
+"""
+import argparse
+import random
+
+from benchmarks.common import setup, benchmark_database, measure, summarize, print_table, seed_drivers, analyze
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup()
+    from rest_framework.renderers import JSONRenderer
+
+    from applications.accounts.nearby import LISTING_FIELDS, available_drivers, listing_record
+    from applications.api.serializers import UserListingSerializer, DriverListingSerializer
+
+    renderer = JSONRenderer()
+    rows = []
+    with benchmark_database() as connection:
+        seed_drivers(max(args.sizes), random.Random(42))
+        analyze(connection)
+        for size in sorted(args.sizes):
+            def full():
+                return renderer.render(UserListingSerializer(available_drivers()[:size], many=True).data)
+
+            def lean():
+                records = [listing_record(row) for row in available_drivers().values(*LISTING_FIELDS)[:size]]
+                return renderer.render(DriverListingSerializer(records, many=True).data)
+
+            for name, func in (('UserListingSerializer', full), ('DriverListingSerializer', lean)):
+                rows.append({
+                    'drivers': size,
+                    'serializer': name,
+                    'bytes': len(func()),
+                    **summarize(measure(func, repeat=args.repeat)),
+                })
+
+    print_table(rows, ['drivers', 'serializer', 'bytes', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Login throughput: SQL queries per login and sequential requests per second through
+POST /api/login/, next to the previous exists() + authenticate() + get_or_create() flow.
+
+    python -m benchmarks.login [--users 1000] [--logins 500] [--fast-hasher]
+
+Password hashing dominates login time with the production hasher, --fast-hasher swaps in MD5
+to isolate the database cost.
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import setup, benchmark_database, summarize, print_table, analyze
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--logins', type=int, default=500)
+    parser.add_argument('--fast-hasher', action='store_true')
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.contrib.auth import authenticate
+    from django.contrib.auth.hashers import make_password
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.authtoken.models import Token
+    from rest_framework.test import APIClient
+
+    from applications.accounts.models import User
+
+    if args.fast_hasher:
+        settings.PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+    def legacy_login(email, password):
+        User.objects.filter(email__iexact=email).exists()
+        user = authenticate(username=email, password=password)
+        Token.objects.get_or_create(user=user)
+
+    rng = random.Random(42)
+    client = APIClient()
+    rows = []
+    with benchmark_database():
+        password = make_password('benchpassword')
+        emails = [f"bench-rider-{i}@example.com" for i in range(args.users)]
+        User.objects.bulk_create(
+            [User(username=email, email=email, password=password) for email in emails], batch_size=5000
+        )
+        analyze(connection)
+
+        def api_login(email, password):
+            response = client.post('/api/login/', {'email': email, 'password': password}, format='json')
+            assert response.status_code == 200, response.data
+
+        sample = rng.sample(emails, min(args.logins, len(emails)))
+        for name, login in (('legacy flow', legacy_login), ('LoginView', api_login)):
+            # first round creates the tokens, the second measures steady state logins
+            for phase in ('first login', 'repeat login'):
+                samples, queries = [], 0
+                for email in sample:
+                    with CaptureQueriesContext(connection) as captured:
+                        started = time.perf_counter()
+                        login(email, 'benchpassword')
+                        samples.append(time.perf_counter() - started)
+                    queries += len(captured)
+                rows.append({
+                    'path': name,
+                    'phase': phase,
+                    'queries_per_login': queries / len(samples),
+                    'logins_per_s': len(samples) / sum(samples),
+                    **summarize(samples),
+                })
+            Token.objects.all().delete()
+
+    print_table(rows, ['path', 'phase', 'queries_per_login', 'logins_per_s', 'p50_ms', 'p95_ms', 'p99_ms'])
+
+
+if __name__ == '__main__':
+    main()
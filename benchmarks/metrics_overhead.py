@@ -0,0 +1,80 @@
+"""
+Overhead of MetricsMiddleware: the same API requests with and without the middleware, and the
+cost of the middleware's own bookkeeping relative to the request time. Exits with status 1 when
+that cost exceeds --max-overhead of the median request.
+
+    python -m benchmarks.metrics_overhead [--requests 500] [--max-overhead 0.02]
+"""
+import argparse
+import statistics
+import sys
+import time
+
+from benchmarks.common import setup, benchmark_database, measure, summarize, print_table, seed_drivers, analyze
+
+
+MIDDLEWARE = 'applications.api.middleware.MetricsMiddleware'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--max-overhead', type=float, default=0.02)
+    args = parser.parse_args()
+
+    setup()
+    import random
+
+    from django.conf import settings
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from django.test.utils import override_settings
+    from django.urls import resolve
+    from rest_framework.test import APIClient
+
+    from applications.accounts.models import User
+    from applications.api.middleware import MetricsMiddleware
+    from applications.api.metrics import MetricsRegistry
+    from applications.ride.models import Ride
+
+    rows = []
+    with benchmark_database() as connection:
+        seed_drivers(1000, random.Random(42))
+        rider = User.objects.create_user(username='bench-rider', password='!')
+        Ride.objects.bulk_create([Ride(rider=rider, status='completed') for _ in range(200)])
+        analyze(connection)
+        client = APIClient()
+        client.force_authenticate(user=rider)
+
+        def ride_list():
+            client.get('/api/ride/')
+
+        without = [name for name in settings.MIDDLEWARE if name != MIDDLEWARE]
+        medians = {}
+        for name, middleware in (('without middleware', without), ('with middleware', [MIDDLEWARE] + without)):
+            with override_settings(MIDDLEWARE=middleware):
+                samples = measure(ride_list, repeat=args.requests, warmup=20)
+            medians[name] = statistics.median(samples)
+            rows.append({'case': name, **summarize(samples)})
+
+    # the middleware alone, around a view that does nothing, into a fresh registry
+    request = RequestFactory().get('/api/ride/')
+    request.resolver_match = resolve('/api/ride/')
+    response = HttpResponse(b'{}')
+    middleware = MetricsMiddleware(lambda request: response)
+    middleware.registry = MetricsRegistry()
+    bookkeeping = measure(lambda: middleware(request), repeat=10000, warmup=100)
+    cost = statistics.median(bookkeeping)
+    rows.append({'case': 'middleware bookkeeping', **summarize(bookkeeping)})
+
+    print_table(rows, ['case', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+    overhead = cost / medians['without middleware']
+    print(f"\nbookkeeping {cost * 1e6:.1f}us = {overhead:.2%} of the median request "
+          f"(measured difference {medians['with middleware'] / medians['without middleware'] - 1:+.2%})")
+    if overhead > args.max_overhead:
+        print(f"Overhead above {args.max_overhead:.2%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
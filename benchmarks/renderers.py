@@ -0,0 +1,73 @@
+"""
+Response rendering and compression for the driver listing and ride list payloads.
+Renders the serialized data of each payload with DRF's JSONRenderer, ORJSONRenderer and, when
+msgpack is installed, MessagePackRenderer, then compresses the orjson body with gzip and, when
+brotli is installed, brotli at the levels of RESPONSE_COMPRESSION.
+Reports the time of each step and the bytes that would go on the wire.
+
+    python -m benchmarks.renderers [--sizes 20 100 1000]
+"""
+import argparse
+import gzip
+import random
+
+from benchmarks.common import setup, benchmark_database, measure, summarize, print_table, seed_drivers, analyze
+from benchmarks.dispatch import seed_rides
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup()
+    from rest_framework.renderers import JSONRenderer
+
+    from applications.accounts.nearby import LISTING_FIELDS, available_drivers, listing_record
+    from applications.api.middleware import brotli, compression_settings
+    from applications.api.renderers import MessagePackRenderer, ORJSONRenderer
+    from applications.api.serializers import DriverListingSerializer, RideSerializer
+    from applications.ride.models import Ride
+
+    renderers = [('JSONRenderer', JSONRenderer()), ('ORJSONRenderer', ORJSONRenderer())]
+    if MessagePackRenderer.available:
+        renderers.append(('MessagePackRenderer', MessagePackRenderer()))
+    gzip_level = compression_settings().get('GZIP_LEVEL', 6)
+    brotli_quality = compression_settings().get('BROTLI_QUALITY', 4)
+    compressors = [('gzip', lambda body: gzip.compress(body, compresslevel=gzip_level, mtime=0))]
+    if brotli is not None:
+        compressors.append(('br', lambda body: brotli.compress(body, quality=brotli_quality)))
+
+    rng = random.Random(42)
+    rows = []
+    with benchmark_database() as connection:
+        seed_drivers(max(args.sizes), rng)
+        seed_rides(max(args.sizes), rng)
+        analyze(connection)
+        for size in sorted(args.sizes):
+            payloads = {
+                'driver-listing': DriverListingSerializer(
+                    [listing_record(row) for row in available_drivers().values(*LISTING_FIELDS)[:size]], many=True
+                ).data,
+                'ride-list': RideSerializer(Ride.objects.order_by('-created', '-id')[:size], many=True).data,
+            }
+            for payload, data in payloads.items():
+                for name, renderer in renderers:
+                    body = renderer.render(data)
+                    rows.append({
+                        'payload': payload, 'items': size, 'step': f'render {name}', 'bytes': len(body),
+                        **summarize(measure(lambda: renderer.render(data), repeat=args.repeat)),
+                    })
+                body = ORJSONRenderer().render(data)
+                for name, compress in compressors:
+                    rows.append({
+                        'payload': payload, 'items': size, 'step': f'compress {name}', 'bytes': len(compress(body)),
+                        **summarize(measure(lambda: compress(body), repeat=args.repeat)),
+                    })
+
+    print_table(rows, ['payload', 'items', 'step', 'bytes', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+
+
+if __name__ == '__main__':
+    main()
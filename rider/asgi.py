@@ -2,6 +2,8 @@
 ASGI config for rider project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP is served by Django, WebSockets on ``/ws/drivers/`` push nearby driver positions.
+Driver inbox long polls wait on the event loop, see applications/api/long_poll.py.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
@@ -13,4 +15,32 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rider.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once the app registry is ready
+from applications.api import long_poll  # noqa: E402
+from applications.api.websocket import DriverPositionsSocket  # noqa: E402
+
+WEBSOCKET_ROUTES = {
+    '/ws/drivers/': DriverPositionsSocket.as_asgi,
+}
+
+HTTP_ROUTES = {
+    long_poll.INBOX_PATH: long_poll.inbox,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        handler = WEBSOCKET_ROUTES.get(scope['path'])
+        if handler is None:
+            await receive()
+            await send({'type': 'websocket.close'})
+            return
+        await handler(scope, receive, send)
+        return
+    handler = HTTP_ROUTES.get(scope['path']) if scope['type'] == 'http' else None
+    if handler is not None:
+        await handler(scope, receive, send, django_application)
+        return
+    await django_application(scope, receive, send)
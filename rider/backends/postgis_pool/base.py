@@ -0,0 +1,51 @@
+"""
+PostGIS backend handing out connections from a process-wide pool instead of opening one per
+request. Configure it in DATABASES with an optional POOL dict:
+
+    'ENGINE': 'rider.backends.postgis_pool',
+    'POOL': {'MIN_SIZE': 2, 'MAX_SIZE': 20, 'TIMEOUT': 10, 'MAX_IDLE': 300,
+             'MAX_LIFETIME': 3600, 'HEALTH_CHECK_AFTER': 30},
+
+MIN_SIZE connections are opened with the first checkout of a worker and kept open.
+
+Leave CONN_MAX_AGE at 0: Django then "closes" the connection at the end of every request,
+which returns it to the pool. The pool is shared by the threads of a worker, so it serves WSGI
+threads and the threads ASGI runs sync views and ORM calls on alike.
+"""
+import psycopg2
+import psycopg2.extras
+from django.contrib.gis.db.backends.postgis.base import DatabaseWrapper as PostGISDatabaseWrapper
+from django.utils.asyncio import async_unsafe
+
+from rider.backends.postgis_pool.creation import DatabaseCreation
+from rider.backends.postgis_pool.pool import get_pool
+
+
+class DatabaseWrapper(PostGISDatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    @property
+    def pool(self):
+        conn_params = self.get_connection_params()
+        return get_pool(self.alias, conn_params, self.settings_dict.get('POOL', {}),
+                        lambda: psycopg2.connect(**conn_params))
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        connection = self.pool.getconn()
+        # same session setup as the stock backend does after connecting
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection)
@@ -0,0 +1,11 @@
+from django.db.backends.postgresql.creation import DatabaseCreation as PostgresDatabaseCreation
+
+from rider.backends.postgis_pool.pool import close_pools
+
+
+class DatabaseCreation(PostgresDatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # idle pooled connections to the test database would block DROP DATABASE
+        close_pools(database=test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
@@ -0,0 +1,297 @@
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """
+    No connection became available in time; a psycopg2 error so Django reports it as an
+    OperationalError like any other connection failure
+    """
+
+
+class PooledConnection:
+    __slots__ = ('connection', 'created', 'returned')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = self.returned = time.monotonic()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections for one set of connection parameters.
+    The first checkout also opens idle connections up to `min_size`, and checkouts top the pool
+    up again when broken or recycled connections left it smaller.
+    Idle connections are handed out most recently used first so that the surplus above
+    `min_size` ages out after `max_idle` seconds. A connection idle for more than
+    `health_check_after` seconds is tested with a trivial query before it is handed out, and
+    connections older than `max_lifetime` are replaced.
+    """
+
+    def __init__(self, connect, alias, min_size=1, max_size=20, timeout=10.0, max_idle=300.0,
+                 max_lifetime=3600.0, health_check_after=30.0):
+        self.connect = connect
+        self.alias = alias
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+
+        self._condition = threading.Condition()
+        self._idle = deque()
+        self._in_use = {}
+        self._opening = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+        self.health_check_failures = 0
+        self.recycled = 0
+
+    @property
+    def size(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def getconn(self):
+        """
+        Check out a healthy connection, opening one when the pool is below `max_size`
+        and waiting up to `timeout` seconds otherwise
+        @return: psycopg2 connection
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        while True:
+            with self._condition:
+                while not self._idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(
+                            f"No connection available in the '{self.alias}' pool within {self.timeout}s"
+                        )
+                    waited = True
+                    self._condition.wait(remaining)
+                pooled = self._idle.pop() if self._idle else None
+                if pooled is None:
+                    self._opening += 1
+                else:
+                    self._in_use[id(pooled.connection)] = pooled
+
+            if pooled is None:
+                try:
+                    pooled = PooledConnection(self.connect())
+                finally:
+                    with self._condition:
+                        self._opening -= 1
+                        if pooled is not None:
+                            self._in_use[id(pooled.connection)] = pooled
+                        self._condition.notify()
+            elif not self._usable(pooled):
+                self._discard(pooled)
+                continue
+
+            with self._condition:
+                wait = time.monotonic() - started
+                self.checkouts += 1
+                if waited:
+                    self.waits += 1
+                    self.wait_seconds += wait
+                    self.max_wait_seconds = max(self.max_wait_seconds, wait)
+            if self.size < self.min_size:
+                self.fill()
+            return pooled.connection
+
+    def fill(self):
+        """
+        Open idle connections until the pool holds `min_size`, stopping at the first failure
+        @return: int: number of connections opened
+        """
+        opened = 0
+        while True:
+            with self._condition:
+                if self.size >= min(self.min_size, self.max_size):
+                    return opened
+                self._opening += 1
+            pooled = None
+            try:
+                pooled = PooledConnection(self.connect())
+            except psycopg2.Error:
+                # the caller already holds a connection, the next checkout tries again
+                return opened
+            finally:
+                with self._condition:
+                    self._opening -= 1
+                    if pooled is not None:
+                        self._idle.append(pooled)
+                    self._condition.notify()
+            opened += 1
+
+    def putconn(self, connection, discard=False):
+        """
+        Return a checked out connection, rolling back whatever transaction it left open
+        """
+        with self._condition:
+            pooled = self._in_use.get(id(connection))
+        if pooled is None:
+            connection.close()
+            return
+        now = time.monotonic()
+        if not discard and not connection.closed and now - pooled.created < self.max_lifetime:
+            try:
+                if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except psycopg2.Error:
+                discard = True
+        else:
+            discard = True
+        if discard:
+            self._discard(pooled)
+            return
+
+        pooled.returned = now
+        with self._condition:
+            del self._in_use[id(connection)]
+            self._idle.append(pooled)
+            self._prune_idle(now)
+            self._condition.notify()
+
+    def close(self):
+        """
+        Close every idle connection, checked out connections are closed when they come back.
+        The pool must not be used afterwards.
+        """
+        with self._condition:
+            idle, self._idle = list(self._idle), deque()
+            self.max_lifetime = 0
+        for pooled in idle:
+            pooled.connection.close()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_seconds': self.wait_seconds,
+                'max_wait_seconds': self.max_wait_seconds,
+                'timeouts': self.timeouts,
+                'health_check_failures': self.health_check_failures,
+                'recycled': self.recycled,
+            }
+
+    def _usable(self, pooled):
+        connection = pooled.connection
+        if connection.closed:
+            return False
+        if time.monotonic() - pooled.created >= self.max_lifetime:
+            with self._condition:
+                self.recycled += 1
+            return False
+        if time.monotonic() - pooled.returned < self.health_check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+            return True
+        except psycopg2.Error:
+            with self._condition:
+                self.health_check_failures += 1
+            return False
+
+    def _discard(self, pooled):
+        with self._condition:
+            self._in_use.pop(id(pooled.connection), None)
+            self._condition.notify()
+        try:
+            pooled.connection.close()
+        except psycopg2.Error:
+            pass
+
+    def _prune_idle(self, now):
+        # oldest returned first, never below min_size
+        while self._idle and self.size > self.min_size and now - self._idle[0].returned > self.max_idle:
+            self._idle.popleft().connection.close()
+            self.recycled += 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def get_pool(alias, conn_params, options, connect):
+    """
+    The process-wide pool of a database alias and its connection parameters.
+    Pools are dropped in forked children, connections must not be shared across processes.
+    """
+    global _pid
+    key = (alias, tuple(sorted((name, str(value)) for name, value in conn_params.items())))
+    with _pools_lock:
+        if os.getpid() != _pid:
+            _pools.clear()
+            _pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(
+                connect, alias,
+                min_size=options.get('MIN_SIZE', 1),
+                max_size=options.get('MAX_SIZE', 20),
+                timeout=options.get('TIMEOUT', 10.0),
+                max_idle=options.get('MAX_IDLE', 300.0),
+                max_lifetime=options.get('MAX_LIFETIME', 3600.0),
+                health_check_after=options.get('HEALTH_CHECK_AFTER', 30.0),
+            )
+        return pool
+
+
+def close_pools(database=None):
+    """
+    Close the idle connections of every pool, or of the pools connected to `database`
+    """
+    with _pools_lock:
+        keys = [key for key in _pools if database is None or ('database', database) in key[1]]
+        pools = [_pools.pop(key) for key in keys]
+    for pool in pools:
+        pool.close()
+
+
+def all_pools():
+    with _pools_lock:
+        return list(_pools.values())
+
+
+def pool_metrics():
+    """
+    Pool gauges and counters in the Prometheus text format, one series per database alias
+    @return: list: lines
+    """
+    stats = [(pool.alias, pool.stats()) for pool in all_pools()]
+    lines = []
+    for metric, kind, key, help_text in (
+        ('rider_db_pool_idle_connections', 'gauge', 'idle', 'Idle pooled connections.'),
+        ('rider_db_pool_in_use_connections', 'gauge', 'in_use', 'Checked out pooled connections.'),
+        ('rider_db_pool_checkouts_total', 'counter', 'checkouts', 'Connections handed out by the pool.'),
+        ('rider_db_pool_waits_total', 'counter', 'waits', 'Checkouts that had to wait for a connection.'),
+        ('rider_db_pool_wait_seconds_total', 'counter', 'wait_seconds', 'Time checkouts spent waiting.'),
+        ('rider_db_pool_max_wait_seconds', 'gauge', 'max_wait_seconds', 'Longest wait for a connection.'),
+        ('rider_db_pool_timeouts_total', 'counter', 'timeouts', 'Checkouts that gave up waiting.'),
+        ('rider_db_pool_health_check_failures_total', 'counter', 'health_check_failures',
+         'Idle connections found broken on checkout.'),
+        ('rider_db_pool_recycled_total', 'counter', 'recycled', 'Connections closed for age or idleness.'),
+    ):
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {kind}']
+        for alias, values in stats:
+            lines.append(f'{metric}{{alias="{alias}"}} {values[key]}')
+    return lines
@@ -0,0 +1,186 @@
+"""
+Read-replica routing.
+
+Views opt in with a `replica_reads = True` attribute. Their GET/HEAD/OPTIONS requests read
+from one of `DATABASE_REPLICAS`, chosen once per request; everything else, and every write,
+uses the primary. A client that has just written is pinned to the primary for
+`REPLICA_ROUTING['PIN_SECONDS']` so it reads its own writes despite replication lag. Clients
+are identified by their API token or session; the pin lives in the `PIN_CACHE` cache, which
+must be shared between workers for the pin to hold across them. When that cache fails the
+client reads from the primary, the failure is logged and counted.
+"""
+import contextvars
+import hashlib
+import itertools
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# apps whose reads may be served by a replica, authentication tables always use the primary
+REPLICA_APPS = ('accounts', 'ride')
+
+_replica = contextvars.ContextVar('replica', default=None)
+
+
+def routing_settings():
+    return getattr(settings, 'REPLICA_ROUTING', {})
+
+
+class ReplicaChooser:
+    """
+    Picks the replica of a request, round robin or the one serving the fewest requests of
+    this worker right now
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._in_flight = {}
+
+    def acquire(self, replicas):
+        with self._lock:
+            if routing_settings().get('STRATEGY', 'round_robin') == 'least_loaded':
+                alias = min(replicas, key=lambda name: self._in_flight.get(name, 0))
+            else:
+                alias = replicas[next(self._counter) % len(replicas)]
+            self._in_flight[alias] = self._in_flight.get(alias, 0) + 1
+        return alias
+
+    def release(self, alias):
+        with self._lock:
+            self._in_flight[alias] -= 1
+
+    def in_flight(self, alias):
+        return self._in_flight.get(alias, 0)
+
+
+chooser = ReplicaChooser()
+
+
+class PinCache:
+    """
+    Primary pins of clients in the `PIN_CACHE` cache.
+    A pin that cannot be read counts as set, the primary always has the client's writes; a pin
+    that cannot be stored is lost. Both are logged and counted instead of failing the request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.errors = 0
+
+    @property
+    def alias(self):
+        return routing_settings().get('PIN_CACHE', 'default')
+
+    def pin(self, key):
+        try:
+            caches[self.alias].set(key, True, routing_settings().get('PIN_SECONDS', 5))
+        except Exception:
+            self._failed('store')
+
+    def pinned(self, key):
+        try:
+            return bool(caches[self.alias].get(key))
+        except Exception:
+            self._failed('read')
+            return True
+
+    def _failed(self, action):
+        logger.warning("Could not %s a replica pin in the %r cache", action, self.alias, exc_info=True)
+        with self._lock:
+            self.errors += 1
+
+
+pins = PinCache()
+
+
+def routing_metrics():
+    return [
+        '# HELP rider_replica_pin_cache_errors_total Replica pins the cache failed to store or read.',
+        '# TYPE rider_replica_pin_cache_errors_total counter',
+        f'rider_replica_pin_cache_errors_total {pins.errors}',
+    ]
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        alias = _replica.get()
+        if alias is not None and model._meta.app_label in REPLICA_APPS:
+            return alias
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def client_key(request):
+    """
+    @return: str: cache key identifying the client of a request, None for anonymous clients
+    """
+    identity = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not identity:
+        return None
+    return 'db-pin:' + hashlib.sha1(identity.encode()).hexdigest()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Routes the reads of `replica_reads` views to a replica and pins clients to the primary
+    after they write
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.replica_alias = None
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            key = client_key(request)
+            if key is not None:
+                pins.pin(key)
+
+        alias = request.replica_alias
+        if alias is not None:
+
+            def release():
+                _replica.set(None)
+                chooser.release(alias)
+
+            if response.streaming:
+                # streamed rows are read while the response is sent, keep the replica until then
+                response._resource_closers.append(release)
+            else:
+                release()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        replicas = list(getattr(settings, 'DATABASE_REPLICAS', ()))
+        if not replicas or request.method not in SAFE_METHODS or not _replica_reads(view_func):
+            return None
+        key = client_key(request)
+        if key is not None and pins.pinned(key):
+            return None
+        request.replica_alias = chooser.acquire(replicas)
+        _replica.set(request.replica_alias)
+        return None
+
+
+def _replica_reads(view_func):
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    return getattr(view_class, 'replica_reads', getattr(view_func, 'replica_reads', False))
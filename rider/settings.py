@@ -48,11 +48,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'applications.api.middleware.MetricsMiddleware',
+    'applications.api.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'rider.db_router.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -82,10 +85,187 @@ WSGI_APPLICATION = 'rider.wsgi.application'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'applications.accounts.authentication.CachedTokenAuthentication',
     ],
+    # see applications/api/renderers.py, MessagePack is only offered when msgpack is installed
+    'DEFAULT_RENDERER_CLASSES': [
+        'applications.api.renderers.ORJSONRenderer',
+        'applications.api.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_CONTENT_NEGOTIATION_CLASS': 'applications.api.renderers.ContentNegotiation',
+}
+
+# Compression of response bodies of at least MIN_SIZE bytes, see CompressionMiddleware in
+# applications/api/middleware.py. Brotli needs the optional brotli package, gzip is used otherwise
+RESPONSE_COMPRESSION = {
+    'ENABLED': True,
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 4,
+}
+
+# Per-worker cache of authenticated tokens, see applications/accounts/authentication.py
+# TTL is in seconds, SHARED_CACHE names an entry of CACHES used as a second tier (None to disable)
+TOKEN_AUTH_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+    'SHARED_CACHE': None,
+    'SHARED_TTL': 300,
+}
+
+# Fan-out of driver position changes to WebSocket subscribers, see applications/accounts/pubsub.py
+# BACKEND is the broker class, CELL_SIZE the topic grid in degrees, QUEUE_SIZE the per-connection backlog
+DRIVER_PUBSUB = {
+    'BACKEND': 'applications.accounts.pubsub.InProcessBroker',
+    'CELL_SIZE': 0.05,
+    'QUEUE_SIZE': 1000,
+}
+
+# In-process spatial index answering nearest-driver queries, see applications/accounts/spatial_index.py
+# CELL_SIZE is in degrees, REFRESH_SECONDS bounds how stale the index can get across worker processes
+DRIVER_LOCATION_INDEX = {
+    'ENABLED': True,
+    'CELL_SIZE': 0.01,
+    'REFRESH_SECONDS': 60,
+}
+
+# Driver listing search bounds, radius in metres
+DRIVER_LISTING = {
+    'DEFAULT_RADIUS': 5000,
+    'MAX_RADIUS': 50000,
+    'DEFAULT_LIMIT': 20,
+    'MAX_LIMIT': 100,
+}
+
+# Ride requests sent to the nearest drivers when a ride is created with `notify_drivers`
+# MAX_DRIVERS bounds `notify_drivers`, RADIUS in metres bounds how far drivers are looked for
+RIDE_FANOUT = {
+    'MAX_DRIVERS': 10,
+    'RADIUS': 5000,
+}
+
+# Long-polled driver inbox of pending ride requests, see applications/ride/notifier.py
+# `timeout` defaults to DEFAULT_TIMEOUT and is capped by MAX_TIMEOUT seconds. A waiting request
+# re-reads the database every RECHECK_INTERVAL seconds to see requests committed by other workers.
+# LIMIT bounds the pending requests returned. Outside the ASGI long poll each wait holds a worker
+# thread, MAX_WAITERS per worker may wait at once, further polls get a 503 asking to retry after
+# RECHECK_INTERVAL seconds
+RIDE_INBOX = {
+    'DEFAULT_TIMEOUT': 20,
+    'MAX_TIMEOUT': 25,
+    'RECHECK_INTERVAL': 5,
+    'LIMIT': 50,
+    'MAX_WAITERS': 8,
 }
 
+# Short-lived per-worker cache of driver listings, see applications/api/listing_cache.py
+# Pickups in the same KEY_CELL_SIZE cell (degrees) share a listing for at most TTL seconds, drivers
+# moving within the CELL_SIZE cells a listing covers drop it right away. MAX_BYTES bounds the cached JSON
+DRIVER_LISTING_CACHE = {
+    'ENABLED': True,
+    'TTL': 2.0,
+    'KEY_CELL_SIZE': 0.002,
+    'CELL_SIZE': 0.02,
+    'MAX_ENTRIES': 2000,
+    'MAX_BYTES': 8 * 1024 * 1024,
+}
+
+# Batch ride-to-driver matching, see applications/ride/dispatch.py and the run_dispatcher command
+# STRATEGY is greedy or hungarian (needs scipy), MAX_DISTANCE is the pickup cutoff in metres,
+# INTERVAL the seconds between rounds and BATCH_SIZE the most rides matched per round
+RIDE_DISPATCH = {
+    'STRATEGY': 'greedy',
+    'MAX_DISTANCE': 5000,
+    'INTERVAL': 5.0,
+    'BATCH_SIZE': 10000,
+}
+
+# Travel time estimates, see applications/ride/eta.py
+# Speeds are in km/h: DEFAULT_SPEED unless a SPEED_PROFILE rule matches the local departure hour,
+# [start, end), and the trip midpoint inside its area, (min longitude, min latitude, max longitude,
+# max latitude). The last matching rule wins. MAX_PAIRS bounds the batch endpoint
+RIDE_ETA = {
+    'DEFAULT_SPEED': 25,
+    'DETOUR_FACTOR': 1.3,
+    'MAX_PAIRS': 10000,
+    'SPEED_PROFILE': [
+        {'hours': (8, 11), 'speed': 18},
+        {'hours': (17, 21), 'speed': 15},
+        {'hours': (23, 6), 'speed': 35},
+        {'area': (77.55, 12.93, 77.65, 13.01), 'hours': (8, 21), 'speed': 12},
+    ],
+}
+
+# Pending rides and available drivers per geocell, see applications/ride/heatmap.py
+# CELL_SIZE is in degrees, run the reconcile_heatmap command after changing it
+HEATMAP = {
+    'CELL_SIZE': 0.01,
+}
+
+# Ride GPS tracks, see applications/ride/tracks.py
+# Points are appended in batches every FLUSH_INTERVAL seconds or once FLUSH_SIZE are buffered,
+# SEGMENT_POINTS caps the points stored per row, MAX_TOLERANCE the simplification in metres
+RIDE_TRACK = {
+    'FLUSH_INTERVAL': 5.0,
+    'FLUSH_SIZE': 1000,
+    'SEGMENT_POINTS': 500,
+    'MAX_TOLERANCE': 1000,
+}
+
+# Per-route request metrics served on /metrics, see applications/api/metrics.py
+# BUCKETS are the latency histogram bounds in seconds. ALLOWED_IPS are the REMOTE_ADDRs that may
+# scrape, localhost only by default; add the scraper's address, None opens the endpoint to anyone
+REQUEST_METRICS = {
+    'ENABLED': True,
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    'ALLOWED_IPS': ('127.0.0.1', '::1'),
+}
+
+# Largest number of records accepted by the driver-location bulk endpoint
+DRIVER_LOCATION_BULK_MAX_RECORDS = 1000
+
+# Write-behind buffering of DriverLocationView pings, see applications/accounts/location_buffer.py
+# FLUSH_INTERVAL is in seconds, FLUSH_SIZE and MAX_PENDING count distinct driver locations
+DRIVER_LOCATION_WRITE_BEHIND = {
+    'ENABLED': False,
+    'FLUSH_INTERVAL': 2.0,
+    'FLUSH_SIZE': 500,
+    'MAX_PENDING': 5000,
+}
+
+# Heartbeat presence of drivers, see applications/accounts/presence.py and the expire_drivers command
+# Drivers without a position ping for TTL seconds are hidden from listings and marked unavailable by
+# the sweep, which also runs lazily from the listing at most every SWEEP_INTERVAL seconds per CACHE
+DRIVER_PRESENCE = {
+    'TTL': 120,
+    'SWEEP_INTERVAL': 30,
+    'SWEEP_BATCH_SIZE': 1000,
+    'LAZY_SWEEP': True,
+    'CACHE': 'default',
+}
+
+
+# Replica pins, presence sweep throttling and shared token lookups only hold across worker processes
+# through a shared cache: deployments with several workers set CACHE_LOCATION to their memcached
+# servers, comma separated. Without it every process keeps its own LocMemCache, enough for tests and
+# local development. Failures of the shared cache are logged and counted on /metrics by its users:
+# a failing server is left out for dead_timeout seconds and calls to it raise meanwhile, instead of
+# pymemcache answering as an empty cache while it retries
+if os.environ.get('CACHE_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.environ['CACHE_LOCATION'].split(','),
+            'OPTIONS': {'connect_timeout': 0.5, 'timeout': 0.5, 'retry_attempts': 0, 'dead_timeout': 10},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
@@ -97,17 +277,46 @@ REST_FRAMEWORK = {
 #     }
 # }
 
+# Connections come from a per-worker pool, see rider/backends/postgis_pool/base.py
+# CONN_MAX_AGE stays 0 so every request hands its connection back to the pool
 DATABASES = {
     'default': {
-        'ENGINE': 'django.contrib.gis.db.backends.postgis',
+        'ENGINE': 'rider.backends.postgis_pool',
         'NAME': 'riderdb',
         'USER': 'prodigy1_user',
         'PASSWORD': 'mind@123',
         'HOST': 'localhost',
         'PORT': '5432',
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MIN_SIZE': 2,
+            'MAX_SIZE': 20,
+            'TIMEOUT': 10,
+            'MAX_IDLE': 300,
+            'MAX_LIFETIME': 3600,
+            'HEALTH_CHECK_AFTER': 30,
+        },
     }
 }
 
+# Read replicas, comma separated hosts in DATABASE_REPLICA_HOSTS, each one a copy of the primary
+# settings. In tests they mirror the primary, so any second database works as a local replica.
+DATABASE_REPLICAS = []
+for index, replica_host in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_HOSTS', '').split(','))):
+    alias = f'replica_{index}'
+    DATABASES[alias] = {**DATABASES['default'], 'HOST': replica_host.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['rider.db_router.ReplicaRouter']
+
+# Replica choice per request, round_robin or least_loaded. Clients that wrote are pinned to the
+# primary for PIN_SECONDS, PIN_CACHE must be shared by all workers, see CACHE_LOCATION above
+REPLICA_ROUTING = {
+    'STRATEGY': 'round_robin',
+    'PIN_SECONDS': 5,
+    'PIN_CACHE': 'default',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
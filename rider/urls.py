@@ -18,8 +18,11 @@ from django.urls import include, path
 from django.conf.urls.static import static
 from django.conf import settings
 
+from applications.api.views import metrics
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('applications.api.urls')),
+    path('metrics', metrics, name='metrics'),
 ]